@@ -0,0 +1,210 @@
+import numpy as np
+
+class NCQE_Hist_Accumulator:
+
+    def __init__(self, features, groups, cutnames, intnames, cumulative=False):
+        """
+        Keeps the sum of weights and of squared weights of a family of 1D histograms
+        in NumPy arrays indexed by [feature, group, cut, channel, bin], and the TH1 statistics
+        sum(w*x) and sum(w*x^2) of the in-range fills in arrays indexed by [feature, group, cut, channel].
+
+        Parameters:
+        - features (list): Feature dicts with "name", "label" and fixed "bins" (nbins, xmin, xmax).
+        - groups (list): Selection names (gamma) or neutron categories.
+        - cutnames (list): Cut names.
+        - intnames (list): Interaction channel names.
+        - cumulative (bool): Cuts are successive selection stages. An event is filled once with the
+          index of the last stage it passes and enters every stage up to it in the histograms.
+
+        Bin 0 is the underflow and bin nbins+1 the overflow, as in TH1.
+        """
+        self.features = features
+        self.groups   = groups
+        self.cutnames = cutnames
+        self.intnames = intnames
+        self.cumulative = cumulative
+
+        self.nbins = np.array([feature["bins"][0] for feature in features], dtype=np.int64)
+        self.xmin  = np.array([feature["bins"][1] for feature in features], dtype=np.float64)
+        self.xmax  = np.array([feature["bins"][2] for feature in features], dtype=np.float64)
+
+        self.shape   = (len(features), len(groups), len(cutnames), len(intnames), int(self.nbins.max()) + 2)
+        self.sumw    = np.zeros(self.shape)
+        self.sumw2   = np.zeros(self.shape)
+        self.entries = np.zeros(self.shape[:-1], dtype=np.int64)
+        self.sumwx   = np.zeros(self.shape[:-1])
+        self.sumwx2  = np.zeros(self.shape[:-1])
+
+        # Histograms to fill, [feature, group, cut, channel]; fills of the others are dropped
+        self.requested = np.ones(self.shape[:-1], dtype=bool)
+
+        # Pending (flat bin index, weight, value) fills, added by flush()
+        self._index  = []
+        self._wgts   = []
+        self._values = []
+        # Per-stage sums of a cumulative accumulator, see totals()
+        self._totals = None
+        # (flat bin index, event record index, value) of every fill when recording (see NCQE_Reweight)
+        self.recorded = None
+
+    def find_bin(self, ifeature, values):
+        """
+        Returns the TH1::FindFixBin bin number of each value for one feature.
+        """
+        values = np.asarray(values, dtype=np.float64)
+        nbins, xmin, xmax = self.nbins[ifeature], self.xmin[ifeature], self.xmax[ifeature]
+        inside = values < xmax
+        bins = np.full(len(values), nbins + 1, dtype=np.int64)
+        bins[inside] = 1 + ((values[inside] - xmin) * nbins / (xmax - xmin)).astype(np.int64)
+        bins[values < xmin] = 0
+        return bins
+
+    def fill(self, ifeature, igroup, icut, ichannel, values, wgts, events=None):
+        """
+        Same as TH1::Fill(value, wgt) on histograms [ifeature, igroup, icut, ichannel] for each value.
+        igroup, icut and ichannel may be scalars or arrays matching values.
+        Values of histograms that are not requested are skipped.
+        events (array matching values) is the record index of the event of each value,
+        kept with its flat bin index and value when recording.
+        """
+        if len(values) == 0 :
+            return
+        requested = self.requested
+        if self.cumulative :
+            # the last stage of an event feeds every earlier stage
+            requested = np.logical_or.accumulate(requested, axis=2)
+        keep = requested[ifeature, igroup, icut, ichannel]
+        if not np.any(keep) :
+            return
+        if not np.all(keep) :
+            keep     = np.broadcast_to(keep, np.shape(values))
+            values   = np.asarray(values)[keep]
+            wgts     = np.broadcast_to(wgts, keep.shape)[keep]
+            igroup, icut, ichannel = ( np.broadcast_to(index, keep.shape)[keep] for index in (igroup, icut, ichannel) )
+            if events is not None :
+                events = np.asarray(events)[keep]
+        bins  = self.find_bin(ifeature, values)
+        index = np.ravel_multi_index((np.broadcast_to(ifeature, bins.shape), np.broadcast_to(igroup, bins.shape),
+                                      np.broadcast_to(icut, bins.shape), np.broadcast_to(ichannel, bins.shape), bins),
+                                     self.shape)
+        values = np.asarray(values, dtype=np.float64)
+        self._index.append(index)
+        self._wgts.append(np.broadcast_to(np.asarray(wgts, dtype=np.float64), bins.shape))
+        self._values.append(values)
+        if self.recorded is not None and events is not None :
+            self.recorded.append((index, np.asarray(events, dtype=np.int64), values))
+
+    def flush(self):
+        """
+        Adds the pending fills to the accumulators with one bincount.
+        """
+        if len(self._index) == 0 :
+            return
+        self.add(np.concatenate(self._index), np.concatenate(self._wgts), np.concatenate(self._values))
+        self._index  = []
+        self._wgts   = []
+        self._values = []
+
+    def add(self, index, wgts, values):
+        """
+        Adds fills given by their flat bin index, weight and value to the accumulators.
+        As TH1::Fill, sum(w*x) and sum(w*x^2) only count the values in a bin of the axis range.
+        """
+        size  = self.sumw.size
+        hists, bins = np.divmod(index, self.shape[-1])
+        inside = ( bins >= 1 ) & ( bins <= self.nbins[hists // (self.entries.size // self.shape[0])] )
+        wx = wgts[inside] * values[inside]
+        self.sumw    += np.bincount(index, weights=wgts,      minlength=size).reshape(self.shape)
+        self.sumw2   += np.bincount(index, weights=wgts*wgts, minlength=size).reshape(self.shape)
+        self.entries += np.bincount(hists, minlength=self.entries.size).reshape(self.entries.shape)
+        self.sumwx   += np.bincount(hists[inside], weights=wx, minlength=self.entries.size).reshape(self.entries.shape)
+        self.sumwx2  += np.bincount(hists[inside], weights=wx * values[inside],
+                                    minlength=self.entries.size).reshape(self.entries.shape)
+        self._totals = None
+
+    def totals(self):
+        """
+        Returns the (sumw, sumw2, entries) of the histograms. A cumulative accumulator keeps the
+        events by last stage passed; a stage histogram is the sum over that stage and the later ones.
+        """
+        return self._cumulated()[:3]
+
+    def moments(self):
+        """
+        Returns the (sumwx, sumwx2) of the histograms, summed over the later stages as totals().
+        """
+        return self._cumulated()[3:]
+
+    def _cumulated(self):
+        self.flush()
+        arrays = (self.sumw, self.sumw2, self.entries, self.sumwx, self.sumwx2)
+        if not self.cumulative :
+            return arrays
+        if self._totals is None :
+            self._totals = tuple(np.flip(np.cumsum(np.flip(array, axis=2), axis=2), axis=2) for array in arrays)
+        return self._totals
+
+    def stats(self, ifeature, igroup, icut, ichannel):
+        """
+        Returns the TH1 statistics (fTsumw, fTsumw2, fTsumwx, fTsumwx2) of a histogram:
+        the sums over the in-range fills, as accumulated by TH1::Fill.
+        """
+        sumw, sumw2, entries = self.totals()
+        sumwx, sumwx2 = self.moments()
+        inrange = slice(1, self.nbins[ifeature] + 1)
+        return np.array([ sumw[ifeature, igroup, icut, ichannel, inrange].sum(),
+                          sumw2[ifeature, igroup, icut, ichannel, inrange].sum(),
+                          sumwx[ifeature, igroup, icut, ichannel],
+                          sumwx2[ifeature, igroup, icut, ichannel] ])
+
+    def to_histogram(self, hist, ifeature, igroup, icut, ichannel):
+        """
+        Copies the accumulated bin contents, Sumw2, entries and statistics (mean and RMS)
+        into a TH1D with the same binning.
+        """
+        sumw, sumw2, entries = self.totals()
+        nbins = self.nbins[ifeature]
+        if hist.GetSumw2N() == 0 :
+            hist.Sumw2()
+        histsumw2 = hist.GetSumw2()
+        for ibin in range(0, nbins + 2) :
+            hist.SetBinContent(ibin, sumw[ifeature, igroup, icut, ichannel, ibin])
+            histsumw2.SetAt(sumw2[ifeature, igroup, icut, ichannel, ibin], ibin)
+        # after SetBinContent, which resets the statistics
+        hist.PutStats(self.stats(ifeature, igroup, icut, ichannel))
+        hist.SetEntries(entries[ifeature, igroup, icut, ichannel])
+        return hist
+
+    def state(self):
+        """
+        Returns copies of the accumulated arrays, e.g. to send them to another process.
+        """
+        self.flush()
+        return { "sumw" : self.sumw.copy(), "sumw2" : self.sumw2.copy(), "entries" : self.entries.copy(),
+                 "sumwx" : self.sumwx.copy(), "sumwx2" : self.sumwx2.copy() }
+
+    def merge(self, state):
+        """
+        Adds the arrays returned by state() of an accumulator with the same definition.
+        """
+        self.flush()
+        self.sumw    += state["sumw"]
+        self.sumw2   += state["sumw2"]
+        self.entries += state["entries"]
+        self.sumwx   += state["sumwx"]
+        self.sumwx2  += state["sumwx2"]
+        self._totals  = None
+
+    def reset(self):
+        """
+        Clears the accumulated and pending fills.
+        """
+        self.sumw[...]    = 0.
+        self.sumw2[...]   = 0.
+        self.entries[...] = 0
+        self.sumwx[...]   = 0.
+        self.sumwx2[...]  = 0.
+        self._index  = []
+        self._wgts   = []
+        self._values = []
+        self._totals = None
@@ -0,0 +1,150 @@
+import os
+import json
+import time
+import pickle
+import hashlib
+import progressbar as pb
+
+from NCQE_Parallel import file_tasks
+from NCQE_Incremental import config_fingerprint, PARTIAL_FORMAT
+
+class NCQE_Checkpoint:
+
+    def __init__(self, path, every=600.):
+        """
+        Periodic checkpoint of a serial columnar run, to resume it after a crash or preemption.
+
+        Parameters:
+        - path (str): Checkpoint file (best on a local disk).
+        - every (float): Minimum time between two checkpoints [s].
+
+        A checkpoint holds the engine partial() (histogram accumulators, cut flow, ...),
+        the state of the selected-event outputs (entries and file sizes so far, see output_states)
+        and the position (task index, entry in the file) of the next chunk. The selected events
+        themselves are in the output files. It is written atomically, so a crash while writing
+        keeps the previous one.
+        """
+        self.path  = path
+        self.every = float(every)
+        self.last  = time.time()
+
+    def due(self):
+        """
+        Returns whether the last checkpoint is older than every.
+        """
+        return time.time() - self.last >= self.every
+
+    def save(self, key, engine, position):
+        outputs = output_states(engine.selected)
+        with open(self.path + ".tmp", "wb") as fout :
+            pickle.dump({ "key"      : key,
+                          "position" : position,
+                          "partial"  : engine.partial(),
+                          "outputs"  : outputs }, fout, protocol=pickle.HIGHEST_PROTOCOL)
+        os.replace(self.path + ".tmp", self.path)
+        self.last = time.time()
+
+    def load(self, key=None):
+        """
+        Returns the content of the checkpoint file (None if there is none), checked against key if given.
+        """
+        if not os.path.exists(self.path) :
+            return None
+        with open(self.path, "rb") as fin :
+            state = pickle.load(fin)
+        if key is not None and state["key"] != key :
+            raise ValueError(f"Checkpoint {self.path} was written for other input files or settings")
+        return state
+
+    def remove(self):
+        if os.path.exists(self.path) :
+            os.remove(self.path)
+
+
+def output_states(selected):
+    """
+    Writes the selected events filled so far into the outputs (NCQE__mc, or the outputs of
+    NCQE_Selected_Outputs) and returns their {kind: checkpoint() state}.
+    """
+    outputs = getattr(selected, "outputs", [ selected ])
+    return { output.kind : output.checkpoint() for output in outputs }
+
+
+def resume_outputs(path, key):
+    """
+    Returns the {kind: state} of the selected-event outputs saved in a checkpoint file (None if
+    there is none): a resumed run reopens its outputs with them (resume argument of NCQE__mc and
+    of the column stores) before process_checkpointed continues filling them.
+
+    The checkpoint is checked against key (checkpoint_key of the run) first, so the outputs of a
+    checkpoint of other inputs or settings are never reopened and cut back.
+    """
+    state = NCQE_Checkpoint(path).load(key)
+    return None if state is None else state["outputs"]
+
+
+def checkpoint_key(engine, tasks):
+    """
+    Returns the sha256 of the tasks (with the size and mtime of each file), of the chunk size
+    of the config fingerprint of each flavor and schema and of the format of the partial results:
+    a checkpoint only resumes the same run.
+    """
+    files = [ (fileType, schema, os.path.abspath(infile), os.path.getsize(infile), os.path.getmtime(infile))
+              for fileType, schema, infile in tasks ]
+    fingerprints = sorted({ config_fingerprint(engine, fileType, schema) for fileType, schema, infile in tasks })
+    key = json.dumps([ files, engine.chunk_size, fingerprints, PARTIAL_FORMAT ])
+    return hashlib.sha256(key.encode()).hexdigest()
+
+
+def process_checkpointed(engine, groupedFiles, schemas, path, every=600., resume=False):
+    """
+    Processes every input file in the main process, with a checkpoint every `every` seconds.
+
+    Parameters:
+    - engine (NCQE_Engine): Engine holding the histograms and tree.
+    - groupedFiles (dict): {fileType: [infile, ...]} input files per neutrino flavor.
+    - schemas (dict): {infile: schema} input branch naming of each file.
+    - path (str): Checkpoint file, removed once every file is processed.
+    - every (float): Minimum time between two checkpoints [s].
+    - resume (bool): Continue from the checkpoint file if it exists; the selected-event outputs
+      must have been reopened at the checkpoint (see resume_outputs).
+
+    The selected events are written to the outputs as they come and each checkpoint only saves
+    their entry counts and file sizes, so its size does not grow with the run.
+    The files and chunks are processed in the order of the serial loop and a resumed run restores
+    the exact sums before the next chunk, so the output is identical to an uninterrupted run.
+    """
+    tasks      = file_tasks(groupedFiles, schemas)
+    key        = checkpoint_key(engine, tasks)
+    checkpoint = NCQE_Checkpoint(path, every)
+
+    first_task, first_entry = 0, 0
+    state = checkpoint.load(key) if resume else None
+    if state is not None :
+        engine.merge(state["partial"])
+        first_task, first_entry = state["position"]
+        print("Resuming from checkpoint", path, "at file", first_task, "entry", first_entry)
+    elif resume :
+        print("No checkpoint", path, "to resume from, starting from the first file")
+    print("Begin processing for", len(tasks), "files, checkpoint every", every, "s in", path)
+
+    # set up the progress bar
+    widgets = [ 'Files: ',
+                pb.Percentage(), ' ',
+                pb.Bar( marker = '=', left = '[', right = ']' ), ' ',
+                pb.ETA() ]
+    pbar = pb.ProgressBar( widgets = widgets, maxval = len(tasks), term_width = 80 )
+    pbar.start()
+    print("")
+
+    for itask in range(first_task, len(tasks)) :
+        fileType, schema, infile = tasks[itask]
+        engine.set_schema(schema)
+        reader = engine.reader([infile], entry_start=first_entry if itask == first_task else 0)
+        for chunk in engine.profiler.timed("read", reader) :
+            engine.process_chunk(fileType, chunk)
+            if checkpoint.due() :
+                checkpoint.save(key, engine, (itask, chunk.entry_start + chunk.nentries))
+        pbar.update(itask + 1)
+    pbar.finish()
+    checkpoint.remove()
@@ -0,0 +1,294 @@
+import os
+import json
+import numpy as np
+
+from NCQE_Layout import tree_branches, tree_nfloat, nNN_in_NTag, n_computed
+from NCQE_Cut import categories
+
+# Columns of the selected events: the NCQETree branches, then the engine extras
+COLUMNS = dict([ (branch, np.float32) for branch in tree_branches[:tree_nfloat] ] +
+               [ (branch, np.int32)   for branch in tree_branches[tree_nfloat:] ] +
+               [ ("weight", np.float64), ("channel", np.int8), ("flavor", np.int8) ])
+
+# Columns of the NTag candidates of the selected events: NTag branches, computed features,
+# truth label and category, row of the selected event and its weight
+CANDIDATE_COLUMNS = dict([ (name, np.float32) for name in ['FitT', 'DPrompt', 'fvx', 'fvy', 'fvz'] + n_computed + nNN_in_NTag ] +
+                         [ ("Label", np.int32), ("category", np.int8), ("event", np.int64), ("weight", np.float64) ])
+
+
+def _open_columns(path, names, sizes=None):
+    """
+    Opens the column files of a store for writing: new files, or, with the {name: bytes} sizes
+    of a checkpoint, the files of an interrupted run cut back to those sizes.
+    """
+    os.makedirs(path, exist_ok=True)
+    if os.path.exists(os.path.join(path, "meta.json")) :
+        os.remove(os.path.join(path, "meta.json"))
+    if sizes is None :
+        return { name : open(os.path.join(path, name + ".bin"), "wb") for name in names }
+    files = {}
+    for name in names :
+        fout = open(os.path.join(path, name + ".bin"), "r+b")
+        if os.fstat(fout.fileno()).st_size < sizes[ name ] :
+            raise IOError(f"{fout.name} is shorter than at its checkpoint ({sizes[ name ]} bytes)")
+        fout.truncate(sizes[ name ])
+        fout.seek(0, os.SEEK_END)
+        files[ name ] = fout
+    return files
+
+
+def _sizes(files):
+    """
+    Flushes the column files and returns their {name: bytes} sizes.
+    """
+    for fout in files.values() :
+        fout.flush()
+    return { name : fout.tell() for name, fout in files.items() }
+
+
+def _append(fout, values, dtype):
+    fout.write(np.ascontiguousarray(values, dtype=np.dtype(dtype).newbyteorder("<")).tobytes())
+
+
+def _close_columns(path, files, meta):
+    """
+    Closes the column files and writes meta.json, which marks the store as complete.
+    """
+    for fout in files.values() :
+        fout.close()
+    with open(os.path.join(path, "meta.json"), "w") as fout :
+        json.dump(meta, fout, indent=1)
+
+
+def _read_meta(path):
+    with open(os.path.join(path, "meta.json")) as fin :
+        return json.load(fin)
+
+
+def _dtypes(columns):
+    return { name : np.dtype(dtype).newbyteorder("<").str for name, dtype in columns.items() }
+
+
+class NCQE_Column_Store:
+
+    kind = "columns"   # key of its checkpoint() state
+
+    def __init__(self, path, channels, flavors, config="", resume=None):
+        """
+        Chunked NumPy store of the selected events, readable without ROOT.
+
+        Parameters:
+        - path (str): Output directory.
+        - channels (list): Names of the channel codes (NCQE_Cut.channels).
+        - flavors (list): Names of the flavor codes (neutrino flavors of T2K).
+        - config (str): Config fingerprint of the output.
+        - resume (dict): checkpoint() state of the store of an interrupted run, appended to from there.
+
+        Each column is a raw little-endian binary file <name>.bin, appended chunk by chunk,
+        and meta.json (written by close()) holds the number of rows, the column dtypes and
+        the code names, so load_columns maps every column without a copy.
+        """
+        self.path     = path
+        self.channels = list(channels)
+        self.flavors  = list(flavors)
+        self.config   = config
+        self.nevents  = 0 if resume is None else resume["nevents"]
+        self.files    = _open_columns(path, COLUMNS, None if resume is None else resume["sizes"])
+
+    def fill_arrays(self, columns):
+        """
+        Appends a chunk of selected events.
+
+        Parameters:
+        - columns (list): The arrays of the COLUMNS (one value per event), in order.
+        """
+        if len(columns[0]) == 0 :
+            return
+        for (name, dtype), column in zip(COLUMNS.items(), columns) :
+            _append(self.files[ name ], column, dtype)
+        self.nevents += len(columns[0])
+
+    def checkpoint(self):
+        """
+        Returns the state to resume the store from (the rows and file sizes so far).
+        """
+        return { "nevents" : self.nevents, "sizes" : _sizes(self.files) }
+
+    def write(self):
+        for fout in self.files.values() :
+            fout.flush()
+
+    def close(self):
+        _close_columns(self.path, self.files,
+                       { "nevents"  : self.nevents,
+                         "nrows"    : self.nevents,
+                         "columns"  : _dtypes(COLUMNS),
+                         "channels" : self.channels,
+                         "flavors"  : self.flavors,
+                         "config"   : self.config })
+
+
+class NCQE_Candidate_Store:
+
+    kind = "candidates"   # key of its checkpoint() state
+
+    def __init__(self, path, config="", resume=None):
+        """
+        Chunked NumPy store of the NTag candidates of the selected events, as flat columns
+        (CANDIDATE_COLUMNS) with per-event offsets.
+
+        Parameters:
+        - path (str): Output directory.
+        - config (str): Config fingerprint of the output.
+        - resume (dict): checkpoint() state of the store of an interrupted run, appended to from there.
+
+        The candidates of the selected event of row i (NCQETree entry and column store row)
+        are the rows offsets[i]:offsets[i+1] of the candidate columns; their "event" column is i.
+        """
+        self.path        = path
+        self.config      = config
+        if resume is None :
+            self.nevents     = 0
+            self.ncandidates = 0
+            self.files       = _open_columns(path, list(CANDIDATE_COLUMNS) + [ "offsets" ])
+            _append(self.files[ "offsets" ], [ 0 ], np.int64)
+        else :
+            self.nevents     = resume["nevents"]
+            self.ncandidates = resume["ncandidates"]
+            self.files       = _open_columns(path, list(CANDIDATE_COLUMNS) + [ "offsets" ], resume["sizes"])
+
+    def fill_arrays(self, columns):
+        """
+        Appends the candidates of a chunk of selected events.
+
+        Parameters:
+        - columns (list): The selected event columns, followed by the candidate record of the
+          chunk: {name: flat array} with "counts", the number of candidates of each event
+          (NCQE_Engine.candidate_columns).
+        """
+        cand   = columns[ len(COLUMNS) ]
+        counts = cand["counts"]
+        if len(counts) == 0 :
+            return
+        cand = dict(cand, event=self.nevents + np.repeat(np.arange(len(counts)), counts))
+        for name, dtype in CANDIDATE_COLUMNS.items() :
+            _append(self.files[ name ], cand[ name ], dtype)
+        _append(self.files[ "offsets" ], self.ncandidates + np.cumsum(counts), np.int64)
+        self.nevents     += len(counts)
+        self.ncandidates += int(counts.sum())
+
+    def checkpoint(self):
+        """
+        Returns the state to resume the store from (the rows and file sizes so far).
+        """
+        return { "nevents" : self.nevents, "ncandidates" : self.ncandidates, "sizes" : _sizes(self.files) }
+
+    def write(self):
+        for fout in self.files.values() :
+            fout.flush()
+
+    def close(self):
+        _close_columns(self.path, self.files,
+                       { "nevents"    : self.nevents,
+                         "nrows"      : self.ncandidates,
+                         "columns"    : _dtypes(CANDIDATE_COLUMNS),
+                         "offsets"    : np.dtype(np.int64).newbyteorder("<").str,
+                         "categories" : categories,
+                         "config"     : self.config })
+
+
+class NCQE_Selected_Outputs:
+
+    def __init__(self, *outputs):
+        """
+        Fills several outputs of the selected events (e.g. the NCQETree and a column store)
+        with the same chunks.
+        """
+        self.outputs = outputs
+
+    def fill_arrays(self, columns):
+        for output in self.outputs :
+            output.fill_arrays(columns)
+
+    def write(self):
+        for output in self.outputs :
+            output.write()
+
+    def close(self):
+        for output in self.outputs :
+            output.close()
+
+
+def load_columns(path, columns=None):
+    """
+    Returns the ({name: array}, meta) of a column or candidate store. The arrays are
+    read-only memory maps of the column files (no copy, pages are read on access).
+    A candidate store also gives "offsets", nevents + 1 candidate row offsets.
+
+    Parameters:
+    - path (str): Store directory written by NCQE_Column_Store or NCQE_Candidate_Store.
+    - columns (list): Names of the columns to map (default: all).
+
+    Example:
+        arrays, meta = load_columns("ncqe_selected_mc.columns")
+        nuncqe = arrays["channel"] == meta["channels"].index("nuncqe")
+        np.histogram(arrays["erec"][nuncqe], weights=arrays["weight"][nuncqe])
+    """
+    meta   = _read_meta(path)
+    shapes = { name : meta["nrows"] for name in meta["columns"] }
+    dtypes = dict(meta["columns"])
+    if "offsets" in meta :
+        shapes["offsets"] = meta["nevents"] + 1
+        dtypes["offsets"] = meta["offsets"]
+    arrays = {}
+    for name in columns or shapes :
+        if shapes[ name ] == 0 :
+            arrays[ name ] = np.zeros(0, dtype=dtypes[ name ])
+        else :
+            arrays[ name ] = np.memmap(os.path.join(path, name + ".bin"), dtype=dtypes[ name ],
+                                       mode="r", shape=(shapes[ name ],))
+    return arrays, meta
+
+
+def merge_stores(outpath, inpaths, check_config=True):
+    """
+    Concatenates column stores, or candidate stores, in order into a new store (the merge of
+    the stores of sharded jobs). The "event" column and the offsets of a candidate store are
+    shifted by the events and candidates of the stores before it.
+
+    Parameters:
+    - outpath (str): Output store directory.
+    - inpaths (list): Store directories, all of the same kind (written by close()).
+    - check_config (bool): Also require the same config fingerprint.
+
+    Returns the meta of the merged store.
+    """
+    metas = [ _read_meta(path) for path in inpaths ]
+    first = metas[0]
+    for path, meta in zip(inpaths[1:], metas[1:]) :
+        where = f"{path} and {inpaths[0]}"
+        for key in sorted(set(meta) | set(first)) :
+            if key in ("nevents", "nrows") or ( key == "config" and not check_config ) :
+                continue
+            if meta.get(key) != first.get(key) :
+                raise ValueError(f"Stores {where} differ in {key}: {meta.get(key)} != {first.get(key)}")
+    if os.path.abspath(outpath) in map(os.path.abspath, inpaths) :
+        raise ValueError(f"{outpath} is one of the stores to merge")
+
+    candidates = "offsets" in first
+    names = list(first["columns"]) + ( [ "offsets" ] if candidates else [] )
+    files = _open_columns(outpath, names)
+    nevents = nrows = 0
+    for istore, (path, meta) in enumerate(zip(inpaths, metas)) :
+        arrays, _ = load_columns(path)
+        for name, dtype in first["columns"].items() :
+            values = arrays[ name ] + nevents if candidates and name == "event" else arrays[ name ]
+            _append(files[ name ], values, dtype)
+        if candidates :
+            offsets = arrays[ "offsets" ] + nrows
+            _append(files[ "offsets" ], offsets if istore == 0 else offsets[1:], first["offsets"])
+        nevents += meta["nevents"]
+        nrows   += meta["nrows"]
+    meta = dict(first, nevents=nevents, nrows=nrows)
+    _close_columns(outpath, files, meta)
+    return meta
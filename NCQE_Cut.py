@@ -1,9 +1,19 @@
+import numpy as np
+
+# Truth classification of the NTag candidates
+label_map  = { 0: 'Noise', 2: 'H', 3: 'Gd' }
+categories = ['all', 'Gd', 'H', 'Noise']
+
 class NCQE_Cut:
     def __init__(self, run, anamode):
         self.run = str(run)
         self.anamode = int(anamode)
         self.lowecut = self._set_loweBGcut(run)
         self.aopt, self.bopt = self._set_ChereAngleCut(anamode)
+        # Selection stages in cut order, see last_stage()
+        self.stages = ["nocut", "postact", "wallfv", "dwall", "effwall", "ovaq", "angle"]
+        self.channels = ["nuncqe", "nubarncqe", "nc1pi", "ncother", "ccqe", "ccqe2p2h", "ccother", "others"]
+        self.channel_lut, self.channel_lut_max = self._set_channel_lut()
      
     def _set_loweBGcut(self, run):
         cuts = {
@@ -105,6 +115,13 @@ class NCQE_Cut:
             raise ValueError(f"Unknown anamode: {self.run_number}")
         return aopt, bopt
 
+    def _set_channel_lut(self, mode_max=100):
+        ## Channel code (index in self.channels) of every NEUT mode in [-mode_max, mode_max]
+        ## |mode| > 30 is "ncother" beyond the table, so clipping to the edges is exact
+        modes = range(-mode_max, mode_max + 1)
+        lut = np.array([self.channels.index(self.channel(mode)) for mode in modes], dtype=np.int8)
+        return lut, mode_max
+
     def cut_val(self, var, run, energy ) :
         m, b = self.lowecut[(var, str(run))]
         return m * energy + b
@@ -147,8 +164,65 @@ class NCQE_Cut:
         else : return "others"
 
 
+    def last_stage(self, Erec, dwall, effwall, ovaq, angle):
+        ## Index in self.stages of the last selection stage the event passes (cuts of is_NCQE, in order)
+        ## 1. Energy cut; "postact" as the pre-activity cut is only for Data
+        if Erec >= 30 : return 0
+        if Erec < 4   : return 0
 
+        ## 3. Fiducial volume cut
+        if dwall < 200   : return 1
+        if effwall < 200 : return 1
 
+        ## 4. Fit quality cut  * dwall/effwall/ovaQ are optimized
+        if dwall    < self.cut_val("dwall",    self.run, Erec ) : return 2
+        if effwall  < self.cut_val("effwall", self.run, Erec ) : return 3
+        if ovaq     < self.cut_val("ovaQ",    self.run, Erec ) : return 4
 
-
-
+        ## 6. Cherenkov angle cut (Selection: thetaC >= 34 deg)
+        if angle < self.aopt * Erec + self.bopt : return 5
+
+        return 6
+
+    def last_stage_array(self, Erec, dwall, effwall, ovaq, angle):
+        """
+        Array version of last_stage, returns the index in self.stages of the last stage each event passes.
+        Each cut is applied as "not failing", as the early returns do, so NaN behaves the same.
+        """
+        Erec    = np.asarray(Erec,    dtype=np.float64)
+        dwall   = np.asarray(dwall,   dtype=np.float64)
+        effwall = np.asarray(effwall, dtype=np.float64)
+        ovaq    = np.asarray(ovaq,    dtype=np.float64)
+        angle   = np.asarray(angle,   dtype=np.float64)
+
+        cuts = [
+            ## 1. Energy cut (Selection: 4 <= Erec < 30 MeV)
+            ~(Erec >= 30) & ~(Erec < 4),
+            ## 3. Fiducial volume cut
+            ~(dwall < 200) & ~(effwall < 200),
+            ## 4. Fit quality cut  * dwall/effwall/ovaQ are optimized
+            ~(dwall   < self.cut_val("dwall",   self.run, Erec)),
+            ~(effwall < self.cut_val("effwall", self.run, Erec)),
+            ~(ovaq    < self.cut_val("ovaQ",    self.run, Erec)),
+            ## 6. Cherenkov angle cut (Selection: thetaC >= 34 deg)
+            ~(angle < self.aopt * Erec + self.bopt),
+        ]
+        stage  = np.zeros(len(Erec), dtype=np.int64)
+        passed = np.ones(len(Erec), dtype=bool)
+        for cut in cuts :
+            passed &= cut
+            stage  += passed
+        return stage
+
+    def is_NCQE_array(self, Erec, dwall, effwall, ovaq, angle):
+        """
+        Array version of is_NCQE, returns the boolean mask of selected events.
+        """
+        return self.last_stage_array(Erec, dwall, effwall, ovaq, angle) == len(self.stages) - 1
+
+    def channel_array(self, Neutmode):
+        """
+        Array version of channel, returns the channel codes (index in self.channels).
+        """
+        Neutmode = np.clip(np.asarray(Neutmode, dtype=np.int64), -self.channel_lut_max, self.channel_lut_max)
+        return self.channel_lut[Neutmode + self.channel_lut_max]
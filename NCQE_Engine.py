@@ -0,0 +1,539 @@
+from math import sqrt
+import numpy as np
+import progressbar as pb
+from ROOT import TH1D
+
+from NCQE_Reader import NCQE_Chunk_Reader, element
+from NCQE_Schema import SCHEMAS, nNN_in_NTag, branch_manifest
+from NCQE_Skim import NCQE_Skim_Reader, skim_incomplete_stages
+from NCQE_Reweight import NCQE_Osc_Reweighter
+from NCQE_Profile import NCQE_Profiler
+from NCQE_IOStats import NCQE_IO_Stats
+from NCQE_Cut import label_map, categories
+
+# Match neutron variable name with histogram name
+nfeature_mapping = {'FitT': 'hntag_Tds', 'DPrompt': 'hntag_Dist',
+                    'beamcos' : 'hntag_BeamCos',
+                    'gammacos': 'hntag_GaCos',
+                    'DistL' : 'hntag_DistL',
+                    'DistT' : 'hntag_DistT',
+                    'fvx': 'hntag_x', 'fvy': 'hntag_y',
+                    'fvz': 'hntag_z',  'r2': 'hntag_r2' }
+
+# Match neutron NN variable name with histogram name
+nfeatureNN_mapping = {'NHits': 'hntag_NHits', 'NResHits': 'hntag_NResHits',
+                      'TRMS' : 'hntag_TRMS',  'DWall' : 'hntag_DWall',
+                      'DWallMeanDir': 'hntag_DWallDir', 'Beta1': 'hntag_B1',
+                      'Beta2': 'hntag_B2', 'Beta3': 'hntag_B3',
+                      'Beta4': 'hntag_B4', 'Beta5': 'hntag_B5',
+                      'OpeningAngleMean': 'hntag_AngleMean',
+                      'OpeningAngleSkew': 'hntag_AngleSkew',
+                      'OpeningAngleStdev':'hntag_AngleStdev',
+                      'MeanDirAngleMean': 'hntag_DirAngleMean',
+                      'MeanDirAngleRMS':  'hntag_DirAngleRMS',
+                      'BurstRatio': "hntag_BRatio",
+                      'FitGoodness':"hntag_FitGood",
+                      'DarkLikelihood':"hntag_DarkLikl",
+                      'TagOut':"hntag_TagOut"}
+
+
+class NCQE_Engine:
+
+    def __init__(self, t2k, ncqe_cut, hist_gamma, hist_neutron, selected,
+                 schema="SKDETSIM", n_gen=100*1000, chunk_size=10000, run_breakdown=False, from_skim=False,
+                 scan=None, osc_record=False, tag_scan=None, candidate_record=False, profiler=None,
+                 io_stats=False):
+        """
+        Columnar event loop: reads the input trees chunk by chunk as NumPy arrays
+        and runs the NCQE selection, weighting and filling on those chunks.
+
+        Parameters:
+        - t2k (T2K): Run, POT, flux tuning and oscillation settings.
+        - ncqe_cut (NCQE_Cut): Selection cuts and channel definition.
+        - hist_gamma (NCQE_Gamma_Histo): Gamma histograms to fill.
+        - hist_neutron (NCQE_Neutron_Histo): Neutron histograms to fill.
+        - selected (NCQE__mc): Tree of selected events to fill (or NCQE_Selected_Outputs).
+        - schema (str): Input naming convention, a key of SCHEMAS (can be changed per process call).
+        - n_gen (int): Number of generated events per file for normalization.
+        - chunk_size (int): Number of entries read at once.
+        - run_breakdown (bool): Also keep the weighted yield of each run per channel.
+        - from_skim (bool): Input files are skim files (NCQE_Skim) instead of ROOT files; the cut flow
+          of the stages before the skim pre-cut is not printed.
+        - scan (NCQE_Cut_Scan): Cut variations also evaluated on every event (optional).
+        - osc_record (bool): Keep the record of the filled events for oscillation re-weighting (NCQE_Reweight).
+        - tag_scan (NCQE_TagOut_Scan): TagOut thresholds also evaluated on the selected events (optional).
+        - candidate_record (bool): Also pass the NTag candidates of the selected events to selected
+          (see candidate_columns and NCQE_Columnar.NCQE_Candidate_Store).
+        - profiler (NCQE_Profiler): Timer of the reading and processing stages (default: disabled).
+        - io_stats (bool): Keep per-file and per-branch I/O counters of the ROOT inputs (NCQE_IOStats).
+        """
+        self.t2k          = t2k
+        self.flavors      = list(t2k.ncel_scales)   # flavor codes of the selected events
+        self.ncqe_cut     = ncqe_cut
+        self.hist_gamma   = hist_gamma
+        self.hist_neutron = hist_neutron
+        self.selected     = selected
+        self.set_schema(schema)
+        self.n_gen        = n_gen
+        self.chunk_size   = int(chunk_size)
+        self.run_breakdown = run_breakdown
+        self.from_skim    = from_skim
+        self.scan         = scan
+        self.reweighter   = NCQE_Osc_Reweighter(t2k, self.accumulators()) if osc_record else None
+        self.tag_scan     = tag_scan
+        self.candidate_record = candidate_record
+        self.profiler     = profiler if profiler is not None else NCQE_Profiler(enabled=False)
+        self.io_stats     = NCQE_IO_Stats() if io_stats else None
+        # Per-run weighted yield and sum of squared weights, [run, channel] with channel 0 = "all"
+        self.run_yields   = np.zeros((len(t2k.runs), len(ncqe_cut.channels) + 1))
+        self.run_yields2  = np.zeros((len(t2k.runs), len(ncqe_cut.channels) + 1))
+        # Weighted yield and sum of squared weights by last stage passed, [stage, channel] with channel 0 = "all"
+        self.cutflow      = np.zeros((len(ncqe_cut.stages), len(ncqe_cut.channels) + 1))
+        self.cutflow2     = np.zeros((len(ncqe_cut.stages), len(ncqe_cut.channels) + 1))
+
+    def branches(self):
+        """
+        Returns the {treename: [branch, ...]} needed by the selection, weighting and filling.
+        """
+        return branch_manifest(self.schema_name)
+
+    def accumulators(self):
+        """
+        Returns the histogram accumulators filled by the engine, by name.
+        """
+        return { "gamma"     : self.hist_gamma.accumulator,
+                 "neutron"   : self.hist_neutron.accumulator,
+                 "neutronNN" : self.hist_neutron.accumulatorNN }
+
+    def reset(self):
+        """
+        Clears the histogram accumulators, the per-run yields, the cut flow, the cut and TagOut scans,
+        the oscillation record, the profile and the I/O counters.
+        """
+        for accumulator in self.accumulators().values() :
+            accumulator.reset()
+        self.run_yields[...]  = 0.
+        self.run_yields2[...] = 0.
+        self.cutflow[...]     = 0.
+        self.cutflow2[...]    = 0.
+        if self.scan is not None :
+            self.scan.reset()
+        if self.reweighter is not None :
+            self.reweighter.reset()
+        if self.tag_scan is not None :
+            self.tag_scan.reset()
+        self.profiler.reset()
+        if self.io_stats is not None :
+            self.io_stats.reset()
+
+    def partial(self):
+        """
+        Returns the accumulated histogram, per-run yield, cut-flow, scan and oscillation record arrays
+        and the profile and I/O counters (picklable).
+        """
+        return { "accumulators" : { name : accumulator.state() for name, accumulator in self.accumulators().items() },
+                 "run_yields"   : self.run_yields.copy(),
+                 "run_yields2"  : self.run_yields2.copy(),
+                 "cutflow"      : self.cutflow.copy(),
+                 "cutflow2"     : self.cutflow2.copy(),
+                 "scan"         : self.scan.state() if self.scan is not None else None,
+                 "reweight"     : self.reweighter.state() if self.reweighter is not None else None,
+                 "tag_scan"     : self.tag_scan.state() if self.tag_scan is not None else None,
+                 "profile"      : self.profiler.state() if self.profiler.enabled else None,
+                 "io_stats"     : self.io_stats.state() if self.io_stats is not None else None }
+
+    def merge(self, partial):
+        """
+        Adds a partial() result of another engine with the same configuration.
+        """
+        for name, accumulator in self.accumulators().items() :
+            accumulator.merge(partial["accumulators"][name])
+        self.run_yields  += partial["run_yields"]
+        self.run_yields2 += partial["run_yields2"]
+        self.cutflow     += partial["cutflow"]
+        self.cutflow2    += partial["cutflow2"]
+        if self.scan is not None :
+            self.scan.merge(partial["scan"])
+        if self.reweighter is not None :
+            self.reweighter.merge(partial["reweight"])
+        if self.tag_scan is not None :
+            self.tag_scan.merge(partial["tag_scan"])
+        if self.profiler.enabled and partial.get("profile") is not None :
+            self.profiler.merge(partial["profile"])
+        if self.io_stats is not None and partial.get("io_stats") is not None :
+            self.io_stats.merge(partial["io_stats"])
+
+    def reader(self, infiles, entry_start=0, entry_stop=None):
+        """
+        Returns the chunk reader of the entries [entry_start, entry_stop) of the input files (ROOT or skim files).
+        """
+        if self.from_skim :
+            return NCQE_Skim_Reader(infiles, self.branches(), chunk_size=self.chunk_size,
+                                    entry_start=entry_start, entry_stop=entry_stop)
+        return NCQE_Chunk_Reader(infiles, self.branches(), chunk_size=self.chunk_size,
+                                 entry_start=entry_start, entry_stop=entry_stop, io_stats=self.io_stats)
+
+    def set_schema(self, schema):
+        """
+        Selects the input branch naming (a key of SCHEMAS) of the next files.
+        """
+        self.schema_name = schema
+        self.schema      = SCHEMAS[schema]
+
+    def process(self, fileType, infiles, schema=None, progress=True):
+        """
+        Runs the analysis over all entries of the files of one neutrino flavor (and one schema).
+        """
+        if schema is not None :
+            self.set_schema(schema)
+        reader = self.reader(infiles)
+        if not progress :
+            for chunk in self.profiler.timed("read", reader) :
+                self.process_chunk(fileType, chunk)
+            return
+
+        maxev = reader.num_entries()
+        print("Begin processing for", len(reader.infiles), fileType, "files")
+
+        # set up the progress bar
+        widgets = [ 'Events: ',
+                    pb.Percentage(), ' ',
+                    pb.Bar( marker = '=', left = '[', right = ']' ), ' ',
+                    pb.ETA() ]
+        pbar = pb.ProgressBar( widgets = widgets, maxval = maxev, term_width = 80 )
+        pbar.start()
+        print("")
+
+        for chunk in self.profiler.timed("read", reader) :
+            pbar.update(chunk.entry_start)
+            self.process_chunk(fileType, chunk)
+        pbar.finish()
+
+    def process_chunk(self, fileType, chunk):
+        """
+        Selects the NCQE events of one chunk and fills the tree and histograms.
+        """
+        self.profiler.count(fileType, chunk.nentries, chunk.counts["ntag"].sum())
+        h1    = chunk["h1"]
+        event = chunk["event"]
+        nudir = self.t2k.nudir
+        angle_tree, angle_branch = self.schema["angle"]
+
+        # Features
+        enu      = element(h1["pnu"], 0)          # nu energy [MeV]
+        erec     = element(h1["erec"], 0) - 0.51  # visible energy [MeV]
+        dwall    = element(h1["wall"], 0)         # dwall   [cm]
+        effwall  = element(h1["effwall"], 0)      # effwall [cm]
+        ovaq     = element(h1["ovaq"], 0)         # ovaQ    [arb]
+        angle    = element(chunk[angle_tree][angle_branch], 0) # Cherenkov angle [degree]
+        # Bonsai Vertex [m]
+        pos_x    = element(h1["pos"], 0)/100
+        pos_y    = element(h1["pos"], 1)/100
+        pos_z    = element(h1["pos"], 2)/100
+        pos_r2   = (pos_x*pos_x + pos_y*pos_y)
+        # MC truth Vertex [m]
+        posvx    = element(h1["posv"], 0)/100
+        posvy    = element(h1["posv"], 1)/100
+        posvz    = element(h1["posv"], 2)/100
+        # Bonsai Direction
+        bdir_x   = element(h1["bdir"], 0)
+        bdir_y   = element(h1["bdir"], 1)
+        bdir_z   = element(h1["bdir"], 2)
+        cosb     = bdir_x*nudir[0] + bdir_y*nudir[1] + bdir_z*nudir[2]
+
+        # Place NCQE selection (last selection stage passed) and check channel for the whole chunk
+        stage        = self.ncqe_cut.last_stage_array(erec, dwall, effwall, ovaq, angle)
+        interactions = self.ncqe_cut.channel_array(h1[self.schema["neutmode"]])
+        last_stage   = len(self.ncqe_cut.stages) - 1
+        self.profiler.lap("selection")
+
+        # Event weight summed over runs (weights of each run in run_wgts[:, irun])
+        run_wgts = self.t2k.run_weights(fileType, enu, self.n_gen)
+        wgts     = run_wgts.sum(axis=1)
+        self.add_cutflow(stage, interactions, wgts)
+        self.profiler.lap("weighting")
+        if self.scan is not None :
+            self.scan.add(erec, dwall, effwall, ovaq, angle, interactions, wgts)
+            self.profiler.lap("cut_scan")
+
+        # Record index of the events entering a histogram, for the oscillation re-weighting
+        events = None
+        if self.reweighter is not None :
+            first_stage = min(self.hist_gamma.first_stage(), self.hist_neutron.first_stage())
+            events = self.reweighter.add_events(enu, wgts, stage >= first_stage)
+            self.profiler.lap("osc_record")
+
+        selected = np.flatnonzero(stage == last_stage)
+        if len(selected) > 0 :
+            columns = [enu, erec, dwall, effwall, ovaq, angle,
+                       pos_x, pos_y, pos_z, pos_r2, posvx, posvy, posvz,
+                       bdir_x, bdir_y, bdir_z, cosb,
+                       event["NTrueN"], event["NTaggableN"], event["NTaggedN"],
+                       wgts, interactions, np.full(len(enu), self.flavors.index(fileType), dtype=np.int8)]
+            if self.run_breakdown :
+                self.add_run_yields(interactions[selected], run_wgts[selected])
+                self.profiler.lap("weighting")
+
+            ### Fill NCQE mc info (tree branches, then weight, channel and flavor code) into TTree, the whole chunk at once
+            columns = [column[selected] for column in columns]
+            if self.candidate_record :
+                columns.append(self.candidate_columns(chunk, selected,
+                                                      np.stack([pos_x, pos_y, pos_z], axis=1)[selected],
+                                                      np.stack([bdir_x, bdir_y, bdir_z], axis=1)[selected],
+                                                      wgts[selected]))
+                self.profiler.lap("neutron")
+            self.selected.fill_arrays(columns)
+            self.profiler.lap("fill_tree")
+
+            ### Tagged multiplicity and composition at each TagOut threshold
+            if self.tag_scan is not None :
+                parent, index = self.candidate_index(chunk, selected)
+                self.tag_scan.add(chunk["ntag"]["TagOut"][index].astype(np.float64),
+                                  self.candidate_category(chunk, index), parent,
+                                  interactions[selected], wgts[selected])
+                self.profiler.lap("tagout_scan")
+
+        # Events passing at least the first stage with a requested histogram
+        filled = np.flatnonzero(stage >= self.hist_gamma.first_stage())
+        if len(filled) > 0 :
+            variables = [enu, erec, dwall, effwall, ovaq, angle, cosb,
+                         pos_x, pos_y, pos_z, pos_r2,
+                         event["NTrueN"], event["NTaggableN"], event["NTaggedN"]]
+            self.fill_gamma([variable[filled] for variable in variables],
+                            wgts[filled], interactions[filled], stage[filled],
+                            events[filled] if events is not None else None)
+            self.profiler.lap("fill_gamma")
+
+        ### Neutron Tagging details, all candidates of the events at once
+        filled = np.flatnonzero(stage >= self.hist_neutron.first_stage())
+        if len(filled) > 0 :
+            cand = self.neutron_candidates(chunk, filled,
+                                           np.stack([pos_x, pos_y, pos_z], axis=1)[filled],
+                                           np.stack([bdir_x, bdir_y, bdir_z], axis=1)[filled])
+            self.profiler.lap("neutron")
+            self.fill_neutron(cand, wgts[filled], interactions[filled], stage[filled],
+                              events[filled] if events is not None else None)
+            self.profiler.lap("fill_neutron")
+
+    def neutron_candidates(self, chunk, selected, pos, bdir):
+        """
+        Flattens the NTag candidates of some events of a chunk.
+
+        Parameters:
+        - chunk (NCQE_Chunk): Chunk holding the flat ntag arrays and their counts.
+        - selected (ndarray): Indices of the events in the chunk.
+        - pos (ndarray): (nselected, 3) Bonsai vertex [m] of the events.
+        - bdir (ndarray): (nselected, 3) Bonsai direction of the events.
+
+        Returns:
+        - dict of flat arrays over the candidates (index < NCandidates) of the events:
+          "parent" (index in selected), "category" (index in categories, -1 if not Gd/H/Noise),
+          "tagged" (TagOut > 0.7), the ntag branches and the computed n_computed features.
+        """
+        ntag    = chunk["ntag"]
+        nudir   = self.t2k.nudir
+        fv_div  = self.schema["fv_div"]
+
+        parent, index = self.candidate_index(chunk, selected)
+        cand = { name : ntag[name][index].astype(np.float64) for name in ntag if name != "Label" }
+        cand["parent"]   = parent
+        cand["tagged"]   = cand["TagOut"] > 0.7
+        cand["category"] = self.candidate_category(chunk, index)
+
+        # neutron direction are not included in NTag, calculated here
+        diff   = np.stack([cand["fvx"]/fv_div, cand["fvy"]/fv_div, cand["fvz"]/fv_div], axis=1) - pos[parent]
+        ndir   = n_dirs(diff)
+        cand["gammacos"] = ndir[:, 0]*bdir[parent, 0] + ndir[:, 1]*bdir[parent, 1] + ndir[:, 2]*bdir[parent, 2]
+        cand["beamcos"]  = ndir[:, 0]*nudir[0] + ndir[:, 1]*nudir[1] + ndir[:, 2]*nudir[2]
+        cand["DistL"]    = cand["DPrompt"] * cand["beamcos"]
+        cand["DistT"]    = cand["DPrompt"] * cand["gammacos"]
+        cand["r2"]       = (cand["fvx"]/100)**2 + (cand["fvy"]/100)**2
+        return cand
+
+    def candidate_columns(self, chunk, selected, pos, bdir, wgts):
+        """
+        Returns the candidate record of some events of a chunk: neutron_candidates with the
+        truth Label and the event weight of every candidate, and "counts", the number of
+        candidates of each event.
+        """
+        cand = self.neutron_candidates(chunk, selected, pos, bdir)
+        parent, index  = self.candidate_index(chunk, selected)
+        cand["Label"]  = chunk["ntag"]["Label"][index]
+        cand["weight"] = wgts[parent]
+        cand["counts"] = np.bincount(parent, minlength=len(selected))
+        return cand
+
+    def candidate_index(self, chunk, selected):
+        """
+        Returns the (index in selected, index in the flat ntag arrays) of the candidates
+        (index < NCandidates) of some events of a chunk.
+        """
+        starts  = chunk.offsets("ntag")[selected]
+        counts  = np.minimum(chunk["event"]["NCandidates"][selected], chunk.counts["ntag"][selected])
+        parent  = np.repeat(np.arange(len(selected)), counts)
+        local   = np.arange(len(parent)) - np.repeat(np.cumsum(counts) - counts, counts)
+        return parent, np.repeat(starts, counts) + local
+
+    def candidate_category(self, chunk, index):
+        """
+        Returns the index in categories of some candidates (-1 if not Gd/H/Noise).
+        """
+        category = np.full(len(index), -1, dtype=np.int64)
+        for label, name in label_map.items() :
+            category[chunk["ntag"]["Label"][index] == label] = categories.index(name)
+        return category
+
+    def fill_gamma(self, variables, wgts, codes, stages, events=None):
+        """
+        Fills the gamma histograms with the events of a chunk, once per event at its last stage.
+
+        Parameters:
+        - variables (list): Arrays of the events, in the order of hist_gamma.features.
+        - wgts (ndarray): Weight of each event (summed over runs).
+        - codes (ndarray): Channel code of each event.
+        - stages (ndarray): Last selection stage (index in NCQE_Cut.stages) passed by each event.
+        - events (ndarray): Oscillation record index of each event (None if not recorded).
+        """
+        hist_gamma  = self.hist_gamma
+        accumulator = hist_gamma.accumulator
+        iselname = hist_gamma.selnames.index("ncgamma")
+        icutname = self.stage_index(hist_gamma.cutnames)[stages]
+        iall     = hist_gamma.intnames.index("all")
+        ichannel = self.channel_index(hist_gamma.intnames)[codes]
+
+        # Fill NCQE gamma info into histograms
+        for ifeature, values in enumerate(variables):
+            accumulator.fill(ifeature, iselname, icutname, ichannel, values, wgts, events)
+            accumulator.fill(ifeature, iselname, icutname, iall,     values, wgts, events)
+        accumulator.flush()
+
+    def fill_neutron(self, cand, wgts, codes, stages, events=None):
+        """
+        Fills the neutron histograms with the tagged Gd/H/Noise candidates of a chunk.
+
+        Parameters:
+        - cand (dict): Output of neutron_candidates.
+        - wgts (ndarray): Weight of each event.
+        - codes (ndarray): Channel code of each event.
+        - stages (ndarray): Last selection stage passed by each event.
+        - events (ndarray): Oscillation record index of each event (None if not recorded).
+        """
+        hist_neutron = self.hist_neutron
+        accumulator  = hist_neutron.accumulator
+        iall     = hist_neutron.intnames.index("all")
+        icatall  = hist_neutron.catagories.index("all")
+
+        use       = cand["tagged"] & (cand["category"] >= 0)
+        parent    = cand["parent"][use]
+        wgt       = wgts[parent]
+        event     = events[parent] if events is not None else None
+        icutname  = self.stage_index(hist_neutron.cutnames)[stages[parent]]
+        ichannel  = self.channel_index(hist_neutron.intnames)[codes[parent]]
+        icatagory = np.array([hist_neutron.catagories.index(category) for category in categories])[cand["category"][use]]
+        if len(wgt) == 0 :
+            return
+
+        # Fill NCQE neutron info into histogram, in its category and in "all"
+        features = [feature["name"] for feature in hist_neutron.features]
+        for n_record in self.schema["n_in_NTag"]:
+            ifeature = features.index(nfeature_mapping[n_record])
+            values   = cand[n_record][use]
+            for icat in (icatagory, icatall):
+                accumulator.fill(ifeature, icat, icutname, ichannel, values, wgt, event)
+                accumulator.fill(ifeature, icat, icutname, iall,     values, wgt, event)
+        accumulator.flush()
+
+        # Fill NCQE neutron NN info into histogram (filled twice, as in the TChain loop)
+        accumulator = hist_neutron.accumulatorNN
+        features = [feature["name"] for feature in hist_neutron.featuresNN]
+        for n_record in nNN_in_NTag:
+            ifeature = features.index(nfeatureNN_mapping[n_record])
+            values   = cand[n_record][use]
+            for icat in (icatagory, icatall):
+                accumulator.fill(ifeature, icat, icutname, 0, values, wgt, event)
+                accumulator.fill(ifeature, icat, icutname, 0, values, wgt, event)
+        accumulator.flush()
+
+    def stage_index(self, cutnames):
+        """
+        Returns the array mapping selection stages (NCQE_Cut.stages) to indices in cutnames.
+        """
+        return np.array([cutnames.index(stage) for stage in self.ncqe_cut.stages])
+
+    def add_cutflow(self, stages, codes, wgts):
+        """
+        Adds the events of a chunk to the weighted yield of each stage (by last stage passed).
+        """
+        nstage   = len(self.ncqe_cut.stages)
+        nchannel = len(self.ncqe_cut.channels)
+        index    = stages * (nchannel + 1)
+        for offset in (0, 1 + codes) :
+            self.cutflow  += np.bincount(index + offset, weights=wgts,    minlength=self.cutflow.size).reshape(nstage, -1)
+            self.cutflow2 += np.bincount(index + offset, weights=wgts**2, minlength=self.cutflow.size).reshape(nstage, -1)
+
+    def cutflow_yields(self):
+        """
+        Returns the weighted yield passing each stage, [stage, channel] with channel 0 = "all".
+        """
+        return np.flip(np.cumsum(np.flip(self.cutflow, axis=0), axis=0), axis=0)
+
+    def print_cutflow(self):
+        """
+        Prints the cut-flow table: weighted yield per selection stage and channel.
+        """
+        yields   = self.cutflow_yields()
+        channels = ["all"] + self.ncqe_cut.channels
+        print("*** Cut flow (weighted events) ***")
+        print(f"{'stage':>8s}" + "".join(f"{channel:>11s}" for channel in channels))
+        for istage, stage in enumerate(self.ncqe_cut.stages) :
+            if self.from_skim and stage in skim_incomplete_stages :
+                # only the events inside the skim pre-cut
+                print(f"{stage:>8s}" + f"{'(skim pre-cut)':>22s}")
+                continue
+            print(f"{stage:>8s}" + "".join(f"{value:11.4g}" for value in yields[istage]))
+
+    def channel_index(self, intnames):
+        """
+        Returns the array mapping channel codes (NCQE_Cut.channels) to indices in intnames.
+        """
+        return np.array([intnames.index(channel) for channel in self.ncqe_cut.channels])
+
+    def add_run_yields(self, codes, run_wgts):
+        """
+        Adds the selected events of a chunk to the per-run yields.
+        """
+        nchannel = len(self.ncqe_cut.channels)
+        for irun in range(run_wgts.shape[1]) :
+            self.run_yields[irun, 0]   += run_wgts[:, irun].sum()
+            self.run_yields2[irun, 0]  += (run_wgts[:, irun]**2).sum()
+            self.run_yields[irun, 1:]  += np.bincount(codes, weights=run_wgts[:, irun], minlength=nchannel)
+            self.run_yields2[irun, 1:] += np.bincount(codes, weights=run_wgts[:, irun]**2, minlength=nchannel)
+
+    def run_breakdown_histograms(self):
+        """
+        Returns one TH1D per channel holding the weighted yield of each run (bin labels = run).
+        """
+        histograms = []
+        runs = self.t2k.runs
+        for ich, intname in enumerate(["all"] + self.ncqe_cut.channels) :
+            hist = TH1D("_".join(["hrun", "ncgamma", "angle", intname]), "; Run; Events", len(runs), 0, len(runs))
+            for irun, run in enumerate(runs) :
+                hist.GetXaxis().SetBinLabel(irun + 1, run)
+                hist.SetBinContent(irun + 1, self.run_yields[irun, ich])
+                hist.SetBinError(irun + 1, sqrt(self.run_yields2[irun, ich]))
+            histograms.append(hist)
+        return histograms
+
+def n_dir( fvx, fvy, fvz, pfvx, pfvy, pfvz ):
+    diff = [fvx - pfvx, fvy - pfvy, fvz - pfvz]
+    vecmod = sqrt(sum(d ** 2 for d in diff))
+    if vecmod == 0 : # candidate at the prompt vertex: no direction, cosines 0
+        return [0., 0., 0.]
+    return [d / vecmod for d in diff]
+
+def n_dirs( diff ): # array version of n_dir, diff (n, 3) candidate - prompt vertex
+    vecmod = np.sqrt(diff[:, 0]**2 + diff[:, 1]**2 + diff[:, 2]**2)
+    return np.divide(diff, vecmod[:, None], out=np.zeros_like(diff), where=vecmod[:, None] > 0)
+
+def r2( fvx, fvy): # input cm, output m
+    return (fvx/100)**2 + (fvy/100)**2
@@ -1,11 +1,20 @@
+import numpy as np
 from ROOT import TH1D
+from NCQE_Accumulator import NCQE_Hist_Accumulator
+from NCQE_Output import default_output, hist_name, is_requested
 
 class NCQE_Gamma_Histo:
-    def __init__(self):
+    def __init__(self, output=default_output["gamma"], skip_cuts=()):
+        """
+        Parameters:
+        - output (list): Name patterns of the histograms to produce (see NCQE_Output).
+        - skip_cuts (list): Cuts whose histograms are not produced even if they match output
+          (e.g. NCQE_Skim.skim_incomplete_stages on skims).
+        """
         # Define selection, cut, and interaction names
         self.selnames = ["ncgamma"]
-        self.cutnames = ["angle"]
-        #self.cutnames = ["nocut", "postact", "wallfv", "dwall", "effwall", "ovaq", "angle"]
+        # Selection stages (NCQE_Cut.stages), filled cumulatively: an event enters every stage it passes
+        self.cutnames = ["nocut", "postact", "wallfv", "dwall", "effwall", "ovaq", "angle"]
         self.intnames = ["all", "nuncqe", "nubarncqe", "nc1pi", "ncother", "ccqe", "ccqe2p2h", "ccother", "others"]
 
         # Define feature properties (name, x-axis label, binning)
@@ -25,38 +34,103 @@ class NCQE_Gamma_Histo:
             {"name": "htaggable_n","label":"Taggable MultiN","bins": ( 15,  -0.50,   14.50)},
             {"name": "htagged_n",  "label":"Tagged MultiN",  "bins": ( 15,  -0.50,   14.50)}
         ]
+        self.feature_map = { feature["name"] : feature for feature in self.features }
 
-        # Initialize dictionaries for histograms
+        # Histograms are booked on first use: histograms[feature][selname][cutname][intname]
         self.histograms = {}
 
-        # Call the method to set up the histograms
-        self._initialize_histograms()
+        # Array-backed sum of weights, copied into the histograms by update_histograms()
+        self.accumulator = NCQE_Hist_Accumulator(self.features, self.selnames, self.cutnames, self.intnames,
+                                                 cumulative=True)
 
-    def _initialize_histograms(self):
+        # Requested histograms; the others are neither booked, filled nor written
+        self.output    = list(output)
+        self.skip_cuts = list(skip_cuts)
+        self.accumulator.requested[...] = np.reshape([ is_requested(name, self.output) for name in self._names() ],
+                                                     self.accumulator.requested.shape)
+        self.accumulator.requested[:, :, [ self.cutnames.index(cutname) for cutname in self.skip_cuts ]] = False
+        self.requested = { name for name, requested in zip(self._names(), self.accumulator.requested.ravel())
+                           if requested }
+        # Histograms filled by the TChain loop at the last stage of each event: the ones
+        # feeding a requested histogram of the same or an earlier stage (see sum_stages())
+        self.filled = { name for name, fed in zip(self._names(),
+                                                  np.logical_or.accumulate(self.accumulator.requested, axis=2).ravel())
+                        if fed }
+
+    def _names(self):
         """
-        Initialize histograms and store them in the dictionaries.
+        Returns every histogram name, in [feature, selname, cutname, intname] order.
         """
-        for feature in self.features:
-            feature_name = feature["name"]
-            feature_label = feature["label"]
-            feature_bins = feature["bins"]
+        return [ hist_name(feature["name"], selname, cutname, intname)
+                 for feature in self.features for selname in self.selnames
+                 for cutname in self.cutnames for intname in self.intnames ]
+
+    def first_stage(self):
+        """
+        Returns the index of the first cut with a requested histogram (len(cutnames) if none):
+        events failing an earlier stage do not enter any histogram.
+        """
+        stages = np.flatnonzero(self.accumulator.requested.any(axis=(0, 1, 3)))
+        return stages[0] if len(stages) else len(self.cutnames)
 
-            # Initialize the feature in the histogram dictionary
-            self.histograms[feature_name] = {}
+    def get_histogram(self, feature_name, selname, cutname, intname):
+        """
+        Returns the requested histogram based on feature_name, selname, cutname, and intname
+        (booked on the first call).
+        """
+        hists = self.histograms.setdefault(feature_name, {}).setdefault(selname, {}).setdefault(cutname, {})
+        if intname not in hists :
+            feature = self.feature_map[feature_name]
+            hists[intname] = TH1D(hist_name(feature_name, selname, cutname, intname),
+                                  f"; {feature['label']}; Events", *feature["bins"])
+            hists[intname].SetDirectory(0)
+        return hists[intname]
+
+    def fill(self, feature_name, selname, cutname, intname, value, wgt):
+        """
+        Fills a histogram of the last stage (cutname) an event passes, skipped if it feeds
+        no requested histogram. sum_stages() adds it to the earlier stages.
+        """
+        if hist_name(feature_name, selname, cutname, intname) in self.filled :
+            self.get_histogram(feature_name, selname, cutname, intname).Fill(value, wgt)
 
+    def sum_stages(self):
+        """
+        Adds the histograms of each stage to those of the earlier stages (after the fill() calls,
+        before writing them), so a stage histogram holds every event passing it.
+        """
+        for feature in self.features:
             for selname in self.selnames:
-                self.histograms[feature_name][selname] = {}
-                for cutname in self.cutnames:
-                    self.histograms[feature_name][selname][cutname] = {}
-                    for intname in self.intnames:
-                        # Construct the histogram name
-                        hist_name = "_".join([feature_name, selname, cutname, intname])
-                        self.histograms[feature_name][selname][cutname][intname] = \
-                            TH1D(hist_name, f"; {feature_label}; Events", *feature_bins)
+                for intname in self.intnames:
+                    later = None
+                    for cutname in reversed(self.cutnames):
+                        if hist_name(feature["name"], selname, cutname, intname) not in self.filled :
+                            break
+                        hist = self.get_histogram(feature["name"], selname, cutname, intname)
+                        if later is not None :
+                            hist.Add(later)
+                        later = hist
 
-    def get_histogram(self, feature_name, selname, cutname, intname):
+    def update_histograms(self):
         """
-        Returns the requested histogram based on feature_name, selname, cutname, and intname.
+        Copies the accumulator content into the requested TH1D histograms (before writing them).
         """
-        return self.histograms[feature_name][selname][cutname][intname]
+        for ifeature, feature in enumerate(self.features):
+            for iselname, selname in enumerate(self.selnames):
+                for icutname, cutname in enumerate(self.cutnames):
+                    for iintname, intname in enumerate(self.intnames):
+                        if hist_name(feature["name"], selname, cutname, intname) not in self.requested :
+                            continue
+                        self.accumulator.to_histogram(self.get_histogram(feature["name"], selname, cutname, intname),
+                                                      ifeature, iselname, icutname, iintname)
 
+    def write(self):
+        """
+        Writes the requested histograms into the current directory.
+        """
+        for feature in self.features:
+            for selname in self.selnames:
+                for cutname in self.cutnames:
+                    for intname in self.intnames:
+                        if hist_name(feature["name"], selname, cutname, intname) in self.requested :
+                            self.get_histogram(feature["name"], selname, cutname, intname).Write()
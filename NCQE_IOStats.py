@@ -0,0 +1,150 @@
+import json
+import time
+from bisect import bisect_left, bisect_right
+
+class NCQE_IO_Stats:
+
+    def __init__(self):
+        """
+        Opt-in I/O counters of the input reading, per input file and per branch.
+
+        Columnar reader (one record per file):
+        - read calls (tree.arrays), source requests and bytes requested from the file;
+        - per branch, the baskets read and the compressed (read) and uncompressed
+          (decompressed) bytes of those baskets;
+        - time in tree.arrays (read + decompress + interpretation), in the conversion to
+          NumPy, and the rest of the file wall time (analysis of the chunks in Python).
+        uproot keeps no basket cache, so a basket straddling two chunks is read and
+        decompressed twice: the re-read fraction of the baskets is the hit rate a basket
+        cache would reach (lower it with a chunk size matching the baskets).
+
+        TChain loop: one TTreePerfStats record per chain (flavor, schema and tree).
+        """
+        self.files   = []
+        self.chains  = []
+        self.current = None
+
+    def reset(self):
+        self.files   = []
+        self.chains  = []
+        self.current = None
+
+    def open_file(self, infile, fin):
+        """
+        Starts the record of an input file opened with uproot.
+        """
+        source = fin.file.source
+        self.current = { "file"       : infile,
+                         "file_bytes" : int(source.num_bytes),
+                         "entries"    : 0,
+                         "chunks"     : 0,
+                         "read_calls" : 0,
+                         "read_time"  : 0.,
+                         "convert_time" : 0.,
+                         "branches"   : {} }
+        self._source = source
+        self._start  = ( time.perf_counter(), source.num_requests, source.num_requested_chunks,
+                         source.num_requested_bytes )
+        self._last   = {}
+        self.files.append(self.current)
+
+    def add_chunk(self, nentries):
+        self.current["entries"] += nentries
+        self.current["chunks"]  += 1
+
+    def add_read(self, treename, tree, names, start, stop, read_time, convert_time):
+        """
+        Counts one tree.arrays call of the entries [start, stop) of the branches names.
+        """
+        record = self.current
+        record["read_calls"]   += 1
+        record["read_time"]    += read_time
+        record["convert_time"] += convert_time
+        for name in names :
+            branch  = tree[name]
+            offsets = branch.entry_offsets
+            first   = max(bisect_right(offsets, start) - 1, 0)
+            last    = min(bisect_left(offsets, stop), branch.num_baskets)
+            key     = f"{treename}/{name}"
+            stats   = record["branches"].setdefault(key, { "baskets_read" : 0, "unique_baskets" : 0,
+                                                           "compressed_bytes" : 0, "uncompressed_bytes" : 0 })
+            # chunks move forward in the file: a basket index not above the last one was read before
+            stats["baskets_read"]   += int(last - first)
+            stats["unique_baskets"] += int(max(0, last - max(first, self._last.get(key, 0))))
+            self._last[key] = max(last, self._last.get(key, 0))
+            for ibasket in range(first, last) :
+                stats["compressed_bytes"]   += int(branch.basket_compressed_bytes(ibasket))
+                stats["uncompressed_bytes"] += int(branch.basket_uncompressed_bytes(ibasket))
+
+    def close_file(self):
+        """
+        Ends the record of the current file (before the file is closed).
+        """
+        record = self.current
+        wall, requests, chunks, nbytes = self._start
+        source = self._source
+        record["requests"]         = int(source.num_requests - requests)
+        record["requested_chunks"] = int(source.num_requested_chunks - chunks)
+        record["requested_bytes"]  = int(source.num_requested_bytes - nbytes)
+        record["wall"]        = time.perf_counter() - wall
+        record["python_time"] = record["wall"] - record["read_time"] - record["convert_time"]
+        baskets_read = sum(stats["baskets_read"] for stats in record["branches"].values())
+        unique       = sum(stats["unique_baskets"] for stats in record["branches"].values())
+        record["basket_reread_fraction"] = 1. - unique / baskets_read if baskets_read > 0 else 0.
+        self.current = None
+
+    def add_perfstats(self, fileType, schema, treename, perfstats, nfiles):
+        """
+        Adds the TTreePerfStats of a chain of the TChain loop.
+        """
+        self.chains.append({ "fileType"    : fileType,
+                             "schema"      : schema,
+                             "tree"        : treename,
+                             "files"       : nfiles,
+                             "bytes_read"  : perfstats.GetBytesRead(),
+                             "bytes_read_extra" : perfstats.GetBytesReadExtra(),
+                             "read_calls"  : perfstats.GetReadCalls(),
+                             "disk_time"   : perfstats.GetDiskTime(),
+                             "unzip_time"  : perfstats.GetUnzipTime(),
+                             "real_time"   : perfstats.GetRealTime(),
+                             "cpu_time"    : perfstats.GetCpuTime(),
+                             "tree_cache_size" : perfstats.GetTreeCacheSize() })
+
+    def state(self):
+        return { "files" : list(self.files), "chains" : list(self.chains) }
+
+    def merge(self, state):
+        """
+        Appends the state() of another reader (e.g. of a worker process).
+        """
+        self.files  += state["files"]
+        self.chains += state["chains"]
+
+    def write(self, filename):
+        with open(filename, "w") as fout :
+            json.dump(self.state(), fout, indent=1)
+
+    def print_report(self, maxbranches=10):
+        """
+        Prints the totals per file and the branches with the most bytes read.
+        """
+        print(f"*** I/O: {len(self.files)} files, {len(self.chains)} chains ***")
+        if self.files :
+            print(f"{'file':>40}{'MB read':>9}{'requests':>9}{'read [s]':>9}{'conv [s]':>9}{'py [s]':>9}{'reread':>8}")
+        branches = {}
+        for record in self.files :
+            print(f"{record['file'][-40:]:>40}{record['requested_bytes'] / 1e6:9.2f}{record['requests']:9d}"
+                  f"{record['read_time']:9.2f}{record['convert_time']:9.2f}{record['python_time']:9.2f}"
+                  f"{record['basket_reread_fraction']:8.2f}")
+            for key, stats in record["branches"].items() :
+                total = branches.setdefault(key, [0, 0])
+                total[0] += stats["compressed_bytes"]
+                total[1] += stats["uncompressed_bytes"]
+        if branches :
+            print(f"{'branch':>40}{'MB read':>9}{'MB unzip':>9}")
+            for key, (compressed, uncompressed) in sorted(branches.items(), key=lambda item: -item[1][0])[:maxbranches] :
+                print(f"{key:>40}{compressed / 1e6:9.2f}{uncompressed / 1e6:9.2f}")
+        for record in self.chains :
+            print(f"{record['fileType']:>8} {record['schema']:>8} {record['tree']:>8}: "
+                  f"{record['bytes_read'] / 1e6:.2f} MB in {record['read_calls']} reads, "
+                  f"disk {record['disk_time']:.2f} s, unzip {record['unzip_time']:.2f} s")
@@ -0,0 +1,244 @@
+import os
+import json
+import pickle
+import hashlib
+import numpy as np
+import progressbar as pb
+
+from NCQE_Parallel import file_tasks, map_partials
+from NCQE_Skim import file_checksum
+
+# Format of the cached partial files (3: selected events as chunks of branch arrays,
+# with weight, channel and flavor; 4: histogram statistics sum(w*x) and sum(w*x^2))
+PARTIAL_FORMAT = 4
+
+
+def config_fingerprint(engine, fileType, schema):
+    """
+    Returns the sha256 of every setting the partial result of one input file depends on.
+
+    Parameters:
+    - engine (NCQE_Engine): Engine holding the T2K settings, NCQE cuts and histogram definitions.
+    - fileType (str): Neutrino flavor of the input file.
+    - schema (str): Input branch naming of the input file.
+
+    Only the settings of this flavor and of the cut run enter, so e.g. a new flux tune
+    of another flavor leaves the partials of this flavor valid.
+    """
+    t2k      = engine.t2k
+    ncqe_cut = engine.ncqe_cut
+    config = {
+        "anamode"    : t2k.anamode,
+        "runs"       : t2k.runs,
+        "pot"        : { run : t2k.pot[ run ] for run in t2k.runs },
+        "ncel_scale" : t2k.ncel_scales[ fileType ],
+        "flux"       : { run : { key : np.asarray(value).tolist()
+                                 for key, value in t2k.flux_tables[ run ][ fileType ].items() }
+                         for run in t2k.runs if fileType in t2k.flux_tables[ run ] },
+        "nudir"      : list(t2k.nudir),
+        "cut"        : { "run"      : ncqe_cut.run,
+                         "anamode"  : ncqe_cut.anamode,
+                         "lowecut"  : { var : ncqe_cut.lowecut[(var, ncqe_cut.run)]
+                                        for var in ("dwall", "effwall", "ovaQ") },
+                         "aopt"     : ncqe_cut.aopt,
+                         "bopt"     : ncqe_cut.bopt,
+                         "channels" : ncqe_cut.channels },
+        "gamma"      : [ engine.hist_gamma.features, engine.hist_gamma.selnames,
+                         engine.hist_gamma.cutnames, engine.hist_gamma.intnames,
+                         sorted(engine.hist_gamma.requested) ],
+        "neutron"    : [ engine.hist_neutron.features, engine.hist_neutron.featuresNN,
+                         engine.hist_neutron.catagories, engine.hist_neutron.cutnames,
+                         engine.hist_neutron.intnames,
+                         sorted(engine.hist_neutron.requested), sorted(engine.hist_neutron.requestedNN) ],
+        "n_gen"      : engine.n_gen,
+        "schema"     : schema,
+        "fileType"   : fileType,
+        "run_breakdown" : engine.run_breakdown,
+        "from_skim"  : engine.from_skim,
+        "scan"       : None if engine.scan is None else
+                       [ { name : values.tolist() for name, values in engine.scan.points.items() }, engine.scan.signal ],
+        "osc_record" : engine.reweighter is not None,
+        "tag_scan"   : None if engine.tag_scan is None else engine.tag_scan.thresholds.tolist(),
+        "candidate_record" : engine.candidate_record,
+    }
+    return hashlib.sha256(json.dumps(config, sort_keys=True).encode()).hexdigest()
+
+
+def output_fingerprint(t2k, ncqe_cut, hist_gamma, hist_neutron, n_gen, **settings):
+    """
+    Returns the sha256 of the settings shared by the partial outputs of one production
+    (written into the output files, checked by NCQE_Merge).
+
+    Parameters:
+    - t2k (T2K): T2K settings (runs, POT, MC scales, flux tune files and histograms).
+    - ncqe_cut (NCQE_Cut): NCQE cuts.
+    - hist_gamma (NCQE_Gamma_Histo), hist_neutron (NCQE_Neutron_Histo): Histogram definitions.
+    - n_gen (int): Number of generated events per file for normalization.
+    - settings: Other options changing the outputs (e.g. run_breakdown).
+
+    Unlike config_fingerprint, it does not depend on the input files, so every shard of a
+    production has the same fingerprint.
+    """
+    config = {
+        "anamode"    : t2k.anamode,
+        "runs"       : t2k.runs,
+        "pot"        : { run : t2k.pot[ run ] for run in t2k.runs },
+        "ncel_scale" : t2k.ncel_scales,
+        "flux"       : [ { run : os.path.basename( t2k.tunefiles[ run ] ) for run in t2k.runs }, t2k.tunehists ],
+        "nudir"      : list(t2k.nudir),
+        "cut"        : { "run"      : ncqe_cut.run,
+                         "anamode"  : ncqe_cut.anamode,
+                         "lowecut"  : { var : ncqe_cut.lowecut[(var, ncqe_cut.run)]
+                                        for var in ("dwall", "effwall", "ovaQ") },
+                         "aopt"     : ncqe_cut.aopt,
+                         "bopt"     : ncqe_cut.bopt,
+                         "channels" : ncqe_cut.channels },
+        "gamma"      : [ hist_gamma.features, hist_gamma.selnames, hist_gamma.cutnames, hist_gamma.intnames,
+                         sorted(hist_gamma.requested) ],
+        "neutron"    : [ hist_neutron.features, hist_neutron.featuresNN, hist_neutron.catagories,
+                         hist_neutron.cutnames, hist_neutron.intnames,
+                         sorted(hist_neutron.requested), sorted(hist_neutron.requestedNN) ],
+        "n_gen"      : n_gen,
+        "settings"   : settings,
+    }
+    return hashlib.sha256(json.dumps(config, sort_keys=True).encode()).hexdigest()
+
+
+class NCQE_Manifest:
+
+    def __init__(self, cachedir):
+        """
+        Record of the input files already processed and of their cached partial results.
+
+        Parameters:
+        - cachedir (str): Directory holding manifest.json and the partials/ files.
+
+        Each input file (absolute path) maps to its sha256, size, mtime, entry count and the
+        config fingerprint of its last partial. Partial files are named after the file hash
+        and the fingerprint, so an unchanged file with an unchanged config finds its partial
+        again even if it was moved or renamed.
+        """
+        self.cachedir = cachedir
+        self.path     = os.path.join(cachedir, "manifest.json")
+        self.files    = {}
+        if os.path.exists(self.path) :
+            with open(self.path) as fin :
+                self.files = json.load(fin)
+
+    def file_record(self, infile):
+        """
+        Returns the {sha256, size, mtime} of an input file; the hash is only recomputed
+        when the size or the modification time differs from the manifest.
+        """
+        stat   = os.stat(infile)
+        record = self.files.get(os.path.abspath(infile), {})
+        if record.get("size") == stat.st_size and record.get("mtime") == stat.st_mtime :
+            return { "sha256" : record["sha256"], "size" : stat.st_size, "mtime" : stat.st_mtime }
+        return { "sha256" : file_checksum(infile), "size" : stat.st_size, "mtime" : stat.st_mtime }
+
+    def partial_path(self, record, fingerprint):
+        return os.path.join(self.cachedir, "partials",
+                            f"{record['sha256'][:24]}_{fingerprint[:24]}_v{PARTIAL_FORMAT}.pkl")
+
+    def update(self, infile, record, fingerprint, entries):
+        self.files[os.path.abspath(infile)] = dict(record, fingerprint=fingerprint, entries=entries)
+
+    def save(self):
+        """
+        Writes the manifest, then removes the partial files it no longer references
+        (those of changed input files or of older settings).
+        """
+        os.makedirs(self.cachedir, exist_ok=True)
+        with open(self.path + ".tmp", "w") as fout :
+            json.dump(self.files, fout, indent=1, sort_keys=True)
+        os.replace(self.path + ".tmp", self.path)
+        self.prune()
+
+    def prune(self):
+        """
+        Removes the partial files that no manifest entry references and returns their names.
+        """
+        partialdir = os.path.join(self.cachedir, "partials")
+        if not os.path.isdir(partialdir) :
+            return []
+        referenced = { os.path.basename(self.partial_path(record, record["fingerprint"]))
+                       for record in self.files.values() }
+        removed = sorted( name for name in os.listdir(partialdir)
+                          if name.endswith(".pkl") and name not in referenced )
+        for name in removed :
+            os.remove(os.path.join(partialdir, name))
+        return removed
+
+
+def process_incremental(engine, groupedFiles, schemas, cachedir, jobs=1):
+    """
+    Processes only the new or changed input files (or those whose config changed) and merges
+    them with the cached partial results of the others into engine.
+
+    Parameters:
+    - engine (NCQE_Engine): Engine of the main process; holds the merged histograms and tree.
+    - groupedFiles (dict): {fileType: [infile, ...]} input files per neutrino flavor.
+    - schemas (dict): {infile: schema} input branch naming of each file.
+    - cachedir (str): Directory of the manifest and partial results.
+    - jobs (int): Number of worker processes for the files to (re)process.
+
+    The results are merged in the same file order as the serial loop, so the output is
+    the same as a full reprocessing with --incremental (and equal to the serial loop up to
+    floating-point summation order, see process_parallel).
+    """
+    manifest = NCQE_Manifest(cachedir)
+    tasks    = file_tasks(groupedFiles, schemas)
+    records  = []
+    todo     = []
+    for task in tasks :
+        fileType, schema, infile = task
+        record      = manifest.file_record(infile)
+        fingerprint = config_fingerprint(engine, fileType, schema)
+        partialfile = manifest.partial_path(record, fingerprint)
+        records.append((record, fingerprint, partialfile))
+        if not os.path.exists(partialfile) :
+            todo.append(task)
+    print("Incremental processing:", len(todo), "of", len(tasks), "files to process,",
+          len(tasks) - len(todo), "cached in", cachedir)
+
+    if len(todo) > 0 :
+        # set up the progress bar
+        widgets = [ 'Files: ',
+                    pb.Percentage(), ' ',
+                    pb.Bar( marker = '=', left = '[', right = ']' ), ' ',
+                    pb.ETA() ]
+        pbar = pb.ProgressBar( widgets = widgets, maxval = len(todo), term_width = 80 )
+        pbar.start()
+        print("")
+        os.makedirs(os.path.join(cachedir, "partials"), exist_ok=True)
+        partialfiles = { task : partialfile for task, (record, fingerprint, partialfile) in zip(tasks, records) }
+        # the profile and I/O counters of this run are merged once, not cached with the partials
+        measured = []
+        for itask, (partial, chunks) in enumerate(map_partials(engine, todo, jobs)) :
+            partialfile = partialfiles[ todo[itask] ]
+            measured.append({ "profile" : partial["profile"], "io_stats" : partial["io_stats"] })
+            with open(partialfile + ".tmp", "wb") as fout :
+                pickle.dump({ "partial" : dict(partial, profile=None, io_stats=None), "chunks" : chunks },
+                            fout, protocol=pickle.HIGHEST_PROTOCOL)
+            os.replace(partialfile + ".tmp", partialfile)
+            pbar.update(itask + 1)
+        pbar.finish()
+        for partial in measured :
+            if partial["profile"] is not None :
+                engine.profiler.merge(partial["profile"])
+            if partial["io_stats"] is not None :
+                engine.io_stats.merge(partial["io_stats"])
+
+    for (fileType, schema, infile), (record, fingerprint, partialfile) in zip(tasks, records) :
+        with open(partialfile, "rb") as fin :
+            cached = pickle.load(fin)
+        engine.merge(cached["partial"])
+        for columns in cached["chunks"] :
+            engine.selected.fill_arrays(columns)
+        previous = manifest.files.get(os.path.abspath(infile), {})
+        if previous.get("sha256") == record["sha256"] and "entries" in previous :
+            entries = previous["entries"]
+        else :
+            entries = engine.reader([infile]).num_entries()
+        manifest.update(infile, record, fingerprint, entries)
+    manifest.save()
@@ -0,0 +1,19 @@
+# Layout of the selected-event outputs, without ROOT or uproot: the NCQETree (NCQE_Tree),
+# the column and candidate stores (NCQE_Columnar) share it, so the stores can be read
+# with NumPy only.
+
+# Branches of the selected-event tree, in the NCQE__mc.fill() argument order
+tree_branches = ["enu", "erec", "dwall", "effwall", "ovaq", "angle",
+                 "pos_x", "pos_y", "pos_z", "pos_r2", "posvx", "posvy", "posvz",
+                 "bdir_x", "bdir_y", "bdir_z", "cosb", "Ntrue", "Ntaggable", "Ntagged"]
+tree_nfloat   = 17   # float branches first, then the integer multiplicities
+
+# Variable name in NTag Output for the NN features
+nNN_in_NTag = ['NHits', 'NResHits', 'TRMS',  'DWall', 'DWallMeanDir',
+               'Beta1', 'Beta2',    'Beta3', 'Beta4', 'Beta5',
+               'OpeningAngleMean','OpeningAngleSkew','OpeningAngleStdev',
+               'MeanDirAngleMean','MeanDirAngleRMS',
+               'BurstRatio','FitGoodness','DarkLikelihood', 'TagOut']
+
+# NTag candidate features computed in the analysis rather than read from the tree
+n_computed = ['beamcos', 'gammacos', 'DistL', 'DistT', 'r2']
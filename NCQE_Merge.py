@@ -0,0 +1,240 @@
+#!/usr/bin/python
+#------------------------------------------------------------------------------
+#  Merge of the partial outputs of sharded jobs (histogram or selected files).
+#  Usage: python NCQE_Merge.py -j 16 -o ncqe_histogram_mc.root part*/ncqe_histogram_mc.root
+#         python NCQE_Merge.py -j 16 -o ncqe_selected_mc.root part*/ncqe_selected_mc.root
+#         python NCQE_Merge.py -o ncqe_selected_mc.columns part*/ncqe_selected_mc.columns
+#------------------------------------------------------------------------------
+import os
+import re
+import sys
+import multiprocessing as mp
+from glob import glob
+from optparse import OptionParser
+import numpy as np
+import uproot
+from ROOT import TFile, TH1D, TNamed
+
+from NCQE_Tree import NCQE__mc
+from NCQE_Columnar import merge_stores
+from NCQE_Gamma_Hist import NCQE_Gamma_Histo
+from NCQE_Neutron_Hist import NCQE_Neutron_Histo
+
+treename = "NCQETree"
+confname = "ncqe_config"
+
+
+def natural_key(path):
+    """
+    Sort key of the input paths with their numbers compared as numbers (part2 before part10),
+    which keeps the shard order of the glob matches.
+    """
+    return [ int(token) if token.isdigit() else token for token in re.split(r"(\d+)", path) ]
+
+
+def feature_bins():
+    """
+    Returns {feature name: (nbins, xmin, xmax)} of the gamma and neutron histogram definitions.
+    The histograms are named feature_selection_cut_channel (gamma) and feature_category_cut_channel (neutron).
+    """
+    hist_gamma   = NCQE_Gamma_Histo([])
+    hist_neutron = NCQE_Neutron_Histo([], [])
+    return { feature["name"] : tuple(feature["bins"])
+             for feature in hist_gamma.features + hist_neutron.features + hist_neutron.featuresNN }
+
+
+def check_binning(infile, name, edges, bins):
+    """
+    Checks the binning of a histogram against the definition of its feature (longest matching prefix).
+    Histograms of other families (e.g. hrun, htagged_n_tagout) are only checked between inputs.
+    """
+    features = [ feature for feature in bins if name.startswith(feature + "_") ]
+    if not features :
+        return
+    nbins, xmin, xmax = bins[ max(features, key=len) ]
+    if len(edges) != nbins + 1 or not np.isclose(edges[0], xmin) or not np.isclose(edges[-1], xmax) :
+        raise ValueError(f"{infile}: {name} has {len(edges) - 1} bins in [{edges[0]}, {edges[-1]}], "
+                         f"expected {nbins} bins in [{xmin}, {xmax}]")
+
+
+def read_partial(infile, bins=None):
+    """
+    Reads the histograms (sum of weights, Sumw2 and entries incl. under/overflow, statistics), the NCQETree
+    columns and the config fingerprint of one output file.
+    """
+    partial = { "files" : [ infile ], "config" : None, "hists" : {}, "tree" : None }
+    with uproot.open(infile) as fin :
+        for name, classname in fin.classnames(cycle=False).items() :
+            if classname == "TNamed" and name == confname :
+                partial["config"] = fin[name].member("fTitle")
+            elif classname == "TTree" and name == treename :
+                tree = fin[name]
+                if list(tree.keys()) != NCQE__mc.branches :
+                    raise ValueError(f"{infile}: {treename} branches {list(tree.keys())} differ from NCQE__mc")
+                partial["tree"] = tree.arrays(NCQE__mc.branches, library="np")
+            elif classname.startswith("TH1") :
+                hist  = fin[name]
+                axis  = hist.axis()
+                edges = axis.edges()
+                if bins is not None :
+                    check_binning(infile, name, edges, bins)
+                partial["hists"][name] = { "edges"   : edges,
+                                           "labels"  : axis.labels(),
+                                           "title"   : hist.member("fTitle"),
+                                           "xtitle"  : axis.member("fTitle"),
+                                           "ytitle"  : hist.member("fYaxis").member("fTitle"),
+                                           "sumw"    : hist.values(flow=True),
+                                           "sumw2"   : hist.variances(flow=True),
+                                           "entries" : hist.member("fEntries"),
+                                           "stats"   : np.array([ hist.member(member) for member in
+                                                                  ("fTsumw", "fTsumw2", "fTsumwx", "fTsumwx2") ]) }
+    return partial
+
+
+def merge_partials(partials, check_config=True):
+    """
+    Merges partial outputs, in order: sums the histograms, their Sumw2 and statistics, concatenates the trees.
+    The inputs must hold the same histograms with the same binning, and the same config fingerprint.
+    """
+    merged = partials[0]
+    for partial in partials[1:] :
+        where = f"{partial['files'][0]} and {merged['files'][0]}"
+        if check_config and partial["config"] != merged["config"] :
+            raise ValueError(f"Config fingerprints of {where} differ: {partial['config']} != {merged['config']}")
+        if set(partial["hists"]) != set(merged["hists"]) :
+            names = sorted(set(partial["hists"]) ^ set(merged["hists"]))
+            raise ValueError(f"Histograms of {where} differ: {names[:5]}")
+        if (partial["tree"] is None) != (merged["tree"] is None) :
+            raise ValueError(f"Only one of {where} holds {treename}")
+
+        hists = {}
+        for name, hist in merged["hists"].items() :
+            other = partial["hists"][name]
+            if not np.array_equal(hist["edges"], other["edges"]) :
+                raise ValueError(f"Binning of {name} differs in {where}")
+            hists[name] = dict(hist, sumw    = hist["sumw"]  + other["sumw"],
+                                     sumw2   = hist["sumw2"] + other["sumw2"],
+                                     entries = hist["entries"] + other["entries"],
+                                     stats   = hist["stats"]   + other["stats"])
+        tree = None
+        if merged["tree"] is not None :
+            tree = { branch : np.concatenate([ merged["tree"][branch], partial["tree"][branch] ])
+                     for branch in NCQE__mc.branches }
+        merged = { "files" : merged["files"] + partial["files"], "config" : merged["config"],
+                   "hists" : hists, "tree" : tree }
+    return merged
+
+
+def tree_reduce(infiles, jobs=1, fanin=2, check_config=True):
+    """
+    Reads the input files and merges them by a tree reduction over local processes:
+    each level merges groups of fanin consecutive partials in parallel.
+
+    The groups only depend on the input order and fanin, so the sums (and the tree order)
+    do not depend on the number of jobs.
+    """
+    bins = feature_bins()
+    if jobs > 1 :
+        pool    = mp.get_context("fork").Pool(processes=jobs)
+        mapping = pool.map
+    else :
+        pool    = None
+        mapping = lambda function, items: list(map(function, items))
+    try :
+        partials = mapping(_read, [ (infile, bins) for infile in infiles ])
+        level = 0
+        while len(partials) > 1 :
+            level += 1
+            groups   = [ (partials[i:i + fanin], check_config) for i in range(0, len(partials), fanin) ]
+            partials = mapping(_merge, groups)
+            print("Merge level", level, ":", len(partials), "partial outputs left")
+    finally :
+        if pool is not None :
+            pool.close()
+            pool.join()
+    return partials[0]
+
+
+def _read(args):
+    return read_partial(*args)
+
+
+def _merge(args):
+    return merge_partials(*args)
+
+
+def write_merged(outfile, merged):
+    """
+    Writes the merged histograms (with Sumw2, entries and statistics), tree and config fingerprint.
+    """
+    selected = None
+    if merged["tree"] is not None :
+        selected = NCQE__mc(outfile, treename=treename, attach=True)
+        selected.fill_arrays([ merged["tree"][branch] for branch in NCQE__mc.branches ])
+        fout = selected.file
+    else :
+        fout = TFile(outfile, "RECREATE")
+    fout.cd()
+    for name, hist in merged["hists"].items() :
+        edges = hist["edges"]
+        th1   = TH1D(name, f"{hist['title']};{hist['xtitle']};{hist['ytitle']}", len(edges) - 1, edges[0], edges[-1])
+        th1.Sumw2()
+        sumw2 = th1.GetSumw2()
+        for ibin in range(len(edges) + 1) :
+            th1.SetBinContent(ibin, hist["sumw"][ibin])
+            sumw2.SetAt(hist["sumw2"][ibin], ibin)
+        for ibin, label in enumerate(hist["labels"] or []) :
+            th1.GetXaxis().SetBinLabel(ibin + 1, label)
+        th1.PutStats(hist["stats"])   # after SetBinContent, which resets them
+        th1.SetEntries(hist["entries"])
+        th1.Write()
+    if selected is not None :
+        selected.write()
+    if merged["config"] is not None :
+        TNamed(confname, merged["config"]).Write()
+    fout.Close()
+
+
+def main():
+    #------------------------------------------------------------------------------
+    usage = "usage: %prog [options] infiles1 infiles2 ..."
+    parser = OptionParser( usage = usage )
+    parser.add_option("-o", "--output", dest="output", default="", metavar="FILE",
+                      help="Merged output ROOT file")
+    parser.add_option("-j", "--jobs", type="int",
+                      dest="jobs", default=1, metavar="N",
+                      help="Number of local processes (default: %default)")
+    parser.add_option("--fanin", type="int",
+                      dest="fanin", default=2, metavar="K",
+                      help="Partial outputs merged together at each level of the reduction (default: %default)")
+    parser.add_option("--no-config-check", action="store_false",
+                      dest="check_config", default=True,
+                      help="Merge inputs with different (or without) config fingerprints")
+    ( options, args ) = parser.parse_args()
+    infiles = [ fname for arg in args for fname in sorted(glob( arg ), key=natural_key) ]
+    if not options.output or len(infiles) == 0 :
+        parser.error("--output and input files are needed")
+    if options.fanin < 2 :
+        parser.error("--fanin must be at least 2")
+
+    # Column and candidate stores (directories of NCQE_Columnar) are concatenated on their own
+    stores = [ fname for fname in infiles if os.path.isdir(fname) ]
+    if stores and len(stores) != len(infiles) :
+        parser.error("inputs mix column stores and ROOT files; merge them separately")
+    if stores :
+        print("Merging", len(stores), "column stores into", options.output)
+        meta = merge_stores(options.output, stores, options.check_config)
+        print("Wrote", meta["nrows"], "rows of", meta["nevents"], "events to", options.output)
+        return
+
+    print("Merging", len(infiles), "files with", options.jobs, "jobs into", options.output)
+    merged = tree_reduce(infiles, options.jobs, options.fanin, options.check_config)
+    if options.check_config and merged["config"] is None :
+        sys.exit(f"{infiles[0]} has no {confname} fingerprint; use --no-config-check to merge it anyway")
+    write_merged(options.output, merged)
+    nrows = 0 if merged["tree"] is None else len(merged["tree"][NCQE__mc.branches[0]])
+    print("Wrote", len(merged["hists"]), "histograms and", nrows, treename, "entries to", options.output)
+
+
+if __name__ == "__main__":
+    main()
@@ -1,12 +1,22 @@
+import numpy as np
 from ROOT import TH1D
+from NCQE_Accumulator import NCQE_Hist_Accumulator
+from NCQE_Output import default_output, hist_name, is_requested
 
 class NCQE_Neutron_Histo:
 
-    def __init__(self):
+    def __init__(self, output=default_output["neutron"], outputNN=default_output["neutronNN"], skip_cuts=()):
+        """
+        Parameters:
+        - output (list): Name patterns of the histograms to produce (see NCQE_Output).
+        - outputNN (list): Name patterns of the NN histograms to produce.
+        - skip_cuts (list): Cuts whose histograms (NN ones included) are not produced even if they
+          match output (e.g. NCQE_Skim.skim_incomplete_stages on skims).
+        """
         # Define selection, cut, and interaction names
         self.catagories = ["all", "Gd", "H", "Noise"]
-        self.cutnames = ["angle"]
-        #self.cutnames = ["nocut", "postact", "wallfv", "dwall", "effwall", "ovaq", "angle"]
+        # Selection stages (NCQE_Cut.stages), filled cumulatively: an event enters every stage it passes
+        self.cutnames = ["nocut", "postact", "wallfv", "dwall", "effwall", "ovaq", "angle"]
         self.intnames = ["all", "nuncqe", "nubarncqe", "nc1pi", "ncother", "ccqe", "ccqe2p2h", "ccother", "others"]
 
         # Define feature properties (name, x-axis label, binning)
@@ -45,66 +55,173 @@ class NCQE_Neutron_Histo:
             {"name": "hntag_TagOut",    "label":"NN TagOut",            "bins": (20,    0.0,    1.0)}
         ]
 
-        # Initialize dictionaries for histograms
+        self.feature_map   = { feature["name"] : feature for feature in self.features }
+        self.feature_mapNN = { feature["name"] : feature for feature in self.featuresNN }
+
+        # Histograms are booked on first use:
+        # histograms[feature][catagory][cutname][intname] and histogramsNN[feature][catagory][cutname]
         self.histograms = {}
         self.histogramsNN = {}
 
-        # Call the method to set up the histograms
-        self._initialize_histograms()
-        self._initialize_histogramsNN()
+        # Array-backed sum of weights, copied into the histograms by update_histograms()
+        # (NN histograms have no interaction channel)
+        self.accumulator   = NCQE_Hist_Accumulator(self.features, self.catagories, self.cutnames, self.intnames,
+                                                   cumulative=True)
+        self.accumulatorNN = NCQE_Hist_Accumulator(self.featuresNN, self.catagories, self.cutnames, ["all"],
+                                                   cumulative=True)
+
+        # Requested histograms; the others are neither booked, filled nor written
+        self.output    = list(output)
+        self.outputNN  = list(outputNN)
+        self.skip_cuts = list(skip_cuts)
+        skipped = [ self.cutnames.index(cutname) for cutname in self.skip_cuts ]
+        self.accumulator.requested[...]   = np.reshape([ is_requested(name, self.output) for name in self._names() ],
+                                                       self.accumulator.requested.shape)
+        self.accumulatorNN.requested[...] = np.reshape([ is_requested(name, self.outputNN) for name in self._namesNN() ],
+                                                       self.accumulatorNN.requested.shape)
+        self.accumulator.requested[:, :, skipped]   = False
+        self.accumulatorNN.requested[:, :, skipped] = False
+        self.requested   = { name for name, requested in zip(self._names(), self.accumulator.requested.ravel())
+                             if requested }
+        self.requestedNN = { name for name, requested in zip(self._namesNN(), self.accumulatorNN.requested.ravel())
+                             if requested }
+        # Histograms filled by the TChain loop at the last stage of each event: the ones
+        # feeding a requested histogram of the same or an earlier stage (see sum_stages())
+        self.filled   = { name for name, fed in zip(self._names(),
+                                                    np.logical_or.accumulate(self.accumulator.requested, axis=2).ravel())
+                          if fed }
+        self.filledNN = { name for name, fed in zip(self._namesNN(),
+                                                    np.logical_or.accumulate(self.accumulatorNN.requested, axis=2).ravel())
+                          if fed }
+
+    def _names(self):
+        """
+        Returns every histogram name, in [feature, catagory, cutname, intname] order.
+        """
+        return [ hist_name(feature["name"], catagory, cutname, intname)
+                 for feature in self.features for catagory in self.catagories
+                 for cutname in self.cutnames for intname in self.intnames ]
 
-    def _initialize_histograms(self):
+    def _namesNN(self):
         """
-        Initialize histograms and store them in the dictionaries.
+        Returns every NN histogram name, in [feature, catagory, cutname] order.
         """
-        for feature in self.features:
-            feature_name  = feature["name"]
-            feature_label = feature["label"]
-            feature_bins  = feature["bins"]
+        return [ hist_name(feature["name"], catagory, cutname)
+                 for feature in self.featuresNN for catagory in self.catagories for cutname in self.cutnames ]
 
-            # Initialize the feature in the histogram dictionary
-            self.histograms[feature_name] = {}
+    def first_stage(self):
+        """
+        Returns the index of the first cut with a requested histogram, NN ones included
+        (len(cutnames) if none): the candidates of events failing an earlier stage are not used.
+        """
+        stages = np.flatnonzero(self.accumulator.requested.any(axis=(0, 1, 3)) |
+                                self.accumulatorNN.requested.any(axis=(0, 1, 3)))
+        return stages[0] if len(stages) else len(self.cutnames)
 
-            for catagory in self.catagories:
-                self.histograms[feature_name][catagory] = {}
-                for cutname in self.cutnames:
-                    self.histograms[feature_name][catagory][cutname] = {}
-                    for intname in self.intnames:
-                        # Construct the histogram name
-                        hist_name = "_".join([feature_name, catagory, cutname, intname])
-                        self.histograms[feature_name][catagory][cutname][intname] = \
-                            TH1D(hist_name, f"; {feature_label}; Events", *feature_bins)
+    def get_histogram(self, feature_name, catagory, cutname, intname):
+        """
+        Returns the requested TH1D histogram based on feature_name, catagory, cutname, and intname
+        (booked on the first call).
+        """
+        hists = self.histograms.setdefault(feature_name, {}).setdefault(catagory, {}).setdefault(cutname, {})
+        if intname not in hists :
+            feature = self.feature_map[feature_name]
+            hists[intname] = TH1D(hist_name(feature_name, catagory, cutname, intname),
+                                  f"; {feature['label']}; Events", *feature["bins"])
+            hists[intname].SetDirectory(0)
+        return hists[intname]
 
-    def _initialize_histogramsNN(self):
+    def get_histogramNN(self, feature_name, catagory, cutname):
         """
-        Initialize NN histograms and store them in the dictionaries.
+        Returns the requested TH1D histogram based on feature_name, catagory, cutname for NN feaature
+        (booked on the first call).
         """
-        for feature in self.featuresNN:
-            feature_name  = feature["name"]
-            feature_label = feature["label"]
-            feature_bins  = feature["bins"]
+        hists = self.histogramsNN.setdefault(feature_name, {}).setdefault(catagory, {})
+        if cutname not in hists :
+            feature = self.feature_mapNN[feature_name]
+            hists[cutname] = TH1D(hist_name(feature_name, catagory, cutname),
+                                  f"; {feature['label']}; Events", *feature["bins"])
+            hists[cutname].SetDirectory(0)
+        return hists[cutname]
+
+    def fill(self, feature_name, catagory, cutname, intname, value, wgt):
+        """
+        Fills a histogram of the last stage (cutname) an event passes, skipped if it feeds
+        no requested histogram. sum_stages() adds it to the earlier stages.
+        """
+        if hist_name(feature_name, catagory, cutname, intname) in self.filled :
+            self.get_histogram(feature_name, catagory, cutname, intname).Fill(value, wgt)
 
-            # Initialize the feature in the histogram dictionary
-            self.histogramsNN[feature_name] = {}
+    def fillNN(self, feature_name, catagory, cutname, value, wgt):
+        """
+        Fills a NN histogram of the last stage (cutname) an event passes, skipped if it feeds
+        no requested histogram.
+        """
+        if hist_name(feature_name, catagory, cutname) in self.filledNN :
+            self.get_histogramNN(feature_name, catagory, cutname).Fill(value, wgt)
 
+    def sum_stages(self):
+        """
+        Adds the histograms of each stage to those of the earlier stages (after the fill() calls,
+        before writing them), so a stage histogram holds every candidate of the events passing it.
+        """
+        for feature in self.features:
             for catagory in self.catagories:
-                self.histogramsNN[feature_name][catagory] = {}
-                for cutname in self.cutnames:
-                    # Construct the histogram name
-                    hist_name = "_".join([feature_name, catagory, cutname])
-                    self.histogramsNN[feature_name][catagory][cutname] = \
-                        TH1D(hist_name, f"; {feature_label}; Events", *feature_bins)
+                for intname in self.intnames:
+                    later = None
+                    for cutname in reversed(self.cutnames):
+                        if hist_name(feature["name"], catagory, cutname, intname) not in self.filled :
+                            break
+                        hist = self.get_histogram(feature["name"], catagory, cutname, intname)
+                        if later is not None :
+                            hist.Add(later)
+                        later = hist
 
-
-    def get_histogram(self, feature_name, catagory, cutname, intname):
+        for feature in self.featuresNN:
+            for catagory in self.catagories:
+                later = None
+                for cutname in reversed(self.cutnames):
+                    if hist_name(feature["name"], catagory, cutname) not in self.filledNN :
+                        break
+                    hist = self.get_histogramNN(feature["name"], catagory, cutname)
+                    if later is not None :
+                        hist.Add(later)
+                    later = hist
+
+    def update_histograms(self):
         """
-        Returns the requested TH1D histogram based on feature_name, catagory, cutname, and intname.
+        Copies the accumulator content into the requested TH1D histograms (before writing them).
         """
-        return self.histograms[feature_name][catagory][cutname][intname]
-
-    def get_histogramNN(self, feature_name, catagory, cutname):
+        for ifeature, feature in enumerate(self.features):
+            for icatagory, catagory in enumerate(self.catagories):
+                for icutname, cutname in enumerate(self.cutnames):
+                    for iintname, intname in enumerate(self.intnames):
+                        if hist_name(feature["name"], catagory, cutname, intname) not in self.requested :
+                            continue
+                        self.accumulator.to_histogram(self.get_histogram(feature["name"], catagory, cutname, intname),
+                                                      ifeature, icatagory, icutname, iintname)
+
+        for ifeature, feature in enumerate(self.featuresNN):
+            for icatagory, catagory in enumerate(self.catagories):
+                for icutname, cutname in enumerate(self.cutnames):
+                    if hist_name(feature["name"], catagory, cutname) not in self.requestedNN :
+                        continue
+                    self.accumulatorNN.to_histogram(self.get_histogramNN(feature["name"], catagory, cutname),
+                                                    ifeature, icatagory, icutname, 0)
+
+    def write(self):
         """
-        Returns the requested TH1D histogram based on feature_name, catagory, cutname for NN feaature.
+        Writes the requested histograms into the current directory.
         """
-        return self.histogramsNN[feature_name][catagory][cutname]
+        for feature in self.features:
+            for catagory in self.catagories:
+                for cutname in self.cutnames:
+                    for intname in self.intnames:
+                        if hist_name(feature["name"], catagory, cutname, intname) in self.requested :
+                            self.get_histogram(feature["name"], catagory, cutname, intname).Write()
 
+        for feature in self.featuresNN:
+            for catagory in self.catagories:
+                for cutname in self.cutnames:
+                    if hist_name(feature["name"], catagory, cutname) in self.requestedNN :
+                        self.get_histogramNN(feature["name"], catagory, cutname).Write()
@@ -0,0 +1,39 @@
+import json
+from fnmatch import fnmatchcase
+
+# Histograms produced by default, as name patterns per histogram family
+# (e.g. "herec_ncgamma_angle_*", "hntag_Tds_Gd_angle_all"): the gamma and neutron
+# histograms of the selected events (angle stage). The histograms of the earlier stages
+# and the NN histograms are not written by default, so they are not filled either.
+default_output = { "gamma"     : ["*_ncgamma_angle_*"],
+                   "neutron"   : ["*_angle_*"],
+                   "neutronNN" : [] }
+
+
+def load_output_spec(path=""):
+    """
+    Returns the output spec {family: [pattern, ...]}, read from a JSON file if given.
+    Families missing in the file keep their default patterns.
+    """
+    spec = { family : list(patterns) for family, patterns in default_output.items() }
+    if path :
+        with open(path) as fin :
+            for family, patterns in json.load(fin).items() :
+                if family not in spec :
+                    raise ValueError(f"Unknown histogram family in {path}: {family}")
+                spec[ family ] = list(patterns)
+    return spec
+
+
+def hist_name(*keys):
+    """
+    Returns the histogram name of a feature/selection/cut/channel combination.
+    """
+    return "_".join(keys)
+
+
+def is_requested(name, patterns):
+    """
+    Returns whether a histogram name matches one of the output patterns.
+    """
+    return any(fnmatchcase(name, pattern) for pattern in patterns)
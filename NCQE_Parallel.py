@@ -0,0 +1,105 @@
+import multiprocessing as mp
+import numpy as np
+import progressbar as pb
+
+from NCQE_Schema import split_by_schema
+
+class NCQE_Selected_Buffer:
+
+    def __init__(self):
+        """
+        Stands in for NCQE__mc in a worker process: keeps the chunks of selected events
+        (lists of branch arrays) so that the main process fills them into the tree in input order.
+        """
+        self.chunks = []
+
+    def fill(self, *values):
+        self.chunks.append([ np.array([value]) for value in values ])
+
+    def fill_arrays(self, columns):
+        self.chunks.append(list(columns))
+
+
+# Engine of the main process, inherited by the forked workers
+_engine = None
+
+def process_parallel(engine, groupedFiles, schemas, jobs):
+    """
+    Processes every input file in a pool of worker processes and merges the results into engine.
+
+    Parameters:
+    - engine (NCQE_Engine): Engine of the main process; holds the merged histograms and tree.
+    - groupedFiles (dict): {fileType: [infile, ...]} input files per neutrino flavor.
+    - schemas (dict): {infile: schema} input branch naming of each file.
+    - jobs (int): Number of worker processes.
+
+    Each worker runs a copy of the engine on one file at a time and returns its histogram
+    accumulators, per-run yields and selected events. The results are merged in input file
+    order, so the output does not depend on the number of jobs (> 1) or on which worker ran
+    a file. The serial loop sums the chunks into one accumulator instead of adding per-file
+    sums, so it gives the same selected events and histograms equal up to floating-point
+    summation order (last-bit rounding of the sums).
+    """
+    tasks = file_tasks(groupedFiles, schemas)
+    print("Begin processing for", len(tasks), "files with", jobs, "jobs")
+
+    # set up the progress bar
+    widgets = [ 'Files: ',
+                pb.Percentage(), ' ',
+                pb.Bar( marker = '=', left = '[', right = ']' ), ' ',
+                pb.ETA() ]
+    pbar = pb.ProgressBar( widgets = widgets, maxval = len(tasks), term_width = 80 )
+    pbar.start()
+    print("")
+
+    for itask, (partial, chunks) in enumerate(map_partials(engine, tasks, jobs)) :
+        engine.merge(partial)
+        for columns in chunks :
+            engine.selected.fill_arrays(columns)
+        pbar.update(itask + 1)
+    pbar.finish()
+
+
+def file_tasks(groupedFiles, schemas):
+    """
+    Returns the (fileType, schema, infile) tasks in the file order of the serial loop:
+    per flavor, then per schema.
+    """
+    return [ (fileType, schema, infile) for fileType, infiles in groupedFiles.items()
+             for schema, files in split_by_schema(infiles, schemas).items() for infile in files ]
+
+
+def map_partials(engine, tasks, jobs):
+    """
+    Yields the (engine.partial(), selected event chunks) of each (fileType, schema, infile) task, in task order.
+
+    With jobs > 1 the tasks run in forked worker processes and engine is left untouched.
+    With jobs == 1 they run on engine itself: its accumulators are reset for each task,
+    so nothing must be merged into engine before the last result is yielded.
+    """
+    global _engine
+    _engine = engine
+    try :
+        if jobs > 1 :
+            context = mp.get_context("fork")
+            with context.Pool(processes=jobs) as pool :
+                yield from pool.imap(_process_file, tasks)
+        else :
+            selected = engine.selected
+            try :
+                for task in tasks :
+                    yield _process_file(task)
+            finally :
+                engine.reset()
+                engine.selected = selected
+    finally :
+        _engine = None
+
+
+def _process_file(task):
+    fileType, schema, infile = task
+    engine = _engine
+    engine.reset()
+    engine.selected = NCQE_Selected_Buffer()
+    engine.process(fileType, [infile], schema, progress=False)
+    return engine.partial(), engine.selected.chunks
@@ -0,0 +1,200 @@
+import json
+import time
+import resource
+from contextlib import contextmanager, nullcontext
+
+class NCQE_Profiler:
+
+    def __init__(self, enabled=True):
+        """
+        Cumulative wall and CPU time of the analysis stages, and events/candidates per flavor.
+
+        Parameters:
+        - enabled (bool): Time the stages; when False, every method but report() returns at once.
+
+        The stage times of the chunks of a flavor (including the reading of the chunks)
+        are also summed per flavor for the events/s and candidates/s rates. Profiles of
+        worker processes are merged like the histogram accumulators, so their stage times
+        are summed over the workers.
+        """
+        self.enabled = enabled
+        self.start   = ( time.perf_counter(), time.process_time() )
+        self.reset()
+
+    def reset(self):
+        self.stages  = {}       # name: [wall, cpu, calls]
+        self.flavors = {}       # flavor: [events, candidates, wall, cpu]
+        self.pending = [0., 0.] # times not yet given to a flavor (reading of the next chunk)
+        self.current = None
+        self.mark    = None
+
+    def stage(self, name):
+        """
+        Returns a context timing one call of the stage name (not counted in any flavor,
+        e.g. the writing of the outputs).
+        """
+        if not self.enabled :
+            return nullcontext()
+        return self._stage(name)
+
+    @contextmanager
+    def _stage(self, name):
+        wall, cpu = time.perf_counter(), time.process_time()
+        try :
+            yield
+        finally :
+            self._add(name, time.perf_counter() - wall, time.process_time() - cpu, flavor=False)
+
+    def _add(self, name, wall, cpu, flavor=True):
+        record = self.stages.setdefault(name, [0., 0., 0])
+        record[0] += wall
+        record[1] += cpu
+        record[2] += 1
+        target = self.flavors[ self.current ] if flavor and self.current is not None else None
+        if target is not None :
+            target[2] += wall
+            target[3] += cpu
+        else :
+            self.pending[0] += wall
+            self.pending[1] += cpu
+
+    def timed(self, name, iterable):
+        """
+        Yields the items of iterable (e.g. the chunks of a reader), timing each next() as stage name.
+        The time is given to the flavor of the next count() call.
+        """
+        if not self.enabled :
+            yield from iterable
+            return
+        iterator = iter(iterable)
+        while True :
+            wall, cpu = time.perf_counter(), time.process_time()
+            try :
+                item = next(iterator)
+            except StopIteration :
+                return
+            finally :
+                self._add(name, time.perf_counter() - wall, time.process_time() - cpu, flavor=False)
+            yield item
+
+    def count(self, flavor, nevents, ncandidates):
+        """
+        Counts a chunk of a flavor; the following stage times go to this flavor
+        and the first lap() starts now.
+        """
+        if not self.enabled :
+            return
+        record = self.flavors.setdefault(flavor, [0, 0, 0., 0.])
+        record[0] += int(nevents)
+        record[1] += int(ncandidates)
+        record[2] += self.pending[0]
+        record[3] += self.pending[1]
+        self.pending = [0., 0.]
+        self.current = flavor
+        self.mark    = ( time.perf_counter(), time.process_time() )
+
+    def lap(self, name):
+        """
+        Adds the time since the last lap() (or count()) to the stage name, e.g. between
+        the steps of a chunk without nesting them in stage() blocks.
+        """
+        if not self.enabled :
+            return
+        wall, cpu = time.perf_counter(), time.process_time()
+        self._add(name, wall - self.mark[0], cpu - self.mark[1])
+        self.mark = ( wall, cpu )
+
+    def state(self):
+        return { "stages" : { name : list(record) for name, record in self.stages.items() },
+                 "flavors" : { flavor : list(record) for flavor, record in self.flavors.items() } }
+
+    def merge(self, state):
+        """
+        Adds the state() of another profiler (e.g. of a worker process).
+        """
+        for name, record in state["stages"].items() :
+            mine = self.stages.setdefault(name, [0., 0., 0])
+            for i in range(3) :
+                mine[i] += record[i]
+        for flavor, record in state["flavors"].items() :
+            mine = self.flavors.setdefault(flavor, [0, 0, 0., 0.])
+            for i in range(4) :
+                mine[i] += record[i]
+
+    def report(self):
+        """
+        Returns the profile as a dict: total wall/CPU time of the main process, stage times,
+        events and candidates per flavor with their rates, and peak RSS of the main process
+        and of its (finished) worker processes [MB].
+        """
+        flavors = {}
+        for flavor, (nevents, ncandidates, wall, cpu) in self.flavors.items() :
+            flavors[ flavor ] = { "events" : nevents, "candidates" : ncandidates, "wall" : wall, "cpu" : cpu,
+                                  "events_per_s"     : nevents / wall if wall > 0 else None,
+                                  "candidates_per_s" : ncandidates / wall if wall > 0 else None }
+        return { "wall"   : time.perf_counter() - self.start[0],
+                 "cpu"    : time.process_time() - self.start[1],
+                 "stages" : { name : { "wall" : wall, "cpu" : cpu, "calls" : calls }
+                              for name, (wall, cpu, calls) in self.stages.items() },
+                 "flavors" : flavors,
+                 "peak_rss_mb"          : resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024.,
+                 "peak_rss_children_mb" : resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss / 1024. }
+
+    def write(self, filename, **settings):
+        """
+        Writes the report() (with the given run settings) as JSON.
+        """
+        with open(filename, "w") as fout :
+            json.dump(dict(self.report(), settings=settings), fout, indent=1)
+
+    def print_report(self):
+        report = self.report()
+        print(f"*** Profile: wall {report['wall']:.1f} s, CPU {report['cpu']:.1f} s, "
+              f"peak RSS {report['peak_rss_mb']:.0f} MB (workers {report['peak_rss_children_mb']:.0f} MB) ***")
+        print(f"{'stage':>14}{'wall [s]':>11}{'cpu [s]':>11}{'calls':>9}")
+        for name, record in sorted(report["stages"].items(), key=lambda item: -item[1]["wall"]) :
+            print(f"{name:>14}{record['wall']:11.2f}{record['cpu']:11.2f}{record['calls']:9d}")
+        print(f"{'flavor':>14}{'events':>11}{'cand.':>11}{'events/s':>11}{'cand./s':>11}")
+        for flavor, record in report["flavors"].items() :
+            print(f"{flavor:>14}{record['events']:11d}{record['candidates']:11d}"
+                  f"{record['events_per_s'] or 0.:11.0f}{record['candidates_per_s'] or 0.:11.0f}")
+
+
+class NCQE_Throttle:
+
+    def __init__(self, pbar, interval=0.5, stride=1000):
+        """
+        Forwards the updates of a per-entry loop to a progress bar at most once every interval [s].
+
+        Parameters:
+        - pbar (ProgressBar): Progress bar to update.
+        - interval (float): Minimum time between two updates [s].
+        - stride (int): Number of update() calls between two reads of the clock.
+        """
+        self.pbar     = pbar
+        self.interval = interval
+        self.stride   = stride
+        self.ncalls   = 0
+        self.last     = time.monotonic()
+        self.value    = None   # last value passed to update()
+
+    def update(self, value):
+        self.value   = value
+        self.ncalls += 1
+        if self.ncalls < self.stride :
+            return
+        self.ncalls = 0
+        now = time.monotonic()
+        if now - self.last >= self.interval :
+            self.last = now
+            self.pbar.update(value)
+
+    def finish(self, value=None):
+        """
+        Pushes the final value (default: the last one passed to update(), which the throttling
+        may have held back) to the progress bar and finishes it.
+        """
+        value = self.value if value is None else value
+        if value is not None :
+            self.pbar.update(value)
+        self.pbar.finish()
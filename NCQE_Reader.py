@@ -0,0 +1,131 @@
+import time
+import numpy as np
+import awkward as ak
+import uproot
+
+class NCQE_Chunk:
+
+    def __init__(self, entry_start, nentries, columns, counts):
+        """
+        One block of consecutive entries read from the input trees as NumPy arrays.
+
+        Parameters:
+        - entry_start (int): Index of the first entry of the chunk in the whole file list.
+        - nentries (int): Number of entries in the chunk.
+        - columns (dict): {treename: {branch: ndarray}}. Jagged trees hold flat arrays.
+        - counts (dict): {treename: ndarray} number of elements per entry for jagged trees.
+        """
+        self.entry_start = entry_start
+        self.nentries    = nentries
+        self.columns     = columns
+        self.counts      = counts
+
+    def __getitem__(self, treename):
+        return self.columns[treename]
+
+    def offsets(self, treename):
+        """
+        Returns the (nentries + 1) offsets of a jagged tree into its flat arrays.
+        """
+        offsets = np.zeros(self.nentries + 1, dtype=np.int64)
+        np.cumsum(self.counts[treename], out=offsets[1:])
+        return offsets
+
+
+class NCQE_Chunk_Reader:
+
+    def __init__(self, infiles, branches, jagged=("ntag",), chunk_size=10000, entry_start=0, entry_stop=None,
+                 io_stats=None):
+        """
+        Reads the requested branches of several aligned trees chunk by chunk.
+
+        Parameters:
+        - infiles (list): Input ROOT files, processed in the given order (same as TChain.Add).
+        - branches (dict): {treename: [branch, ...]} branches to read from each tree.
+        - jagged (tuple): Trees storing one variable-length array per entry (e.g. NTag candidates).
+        - chunk_size (int): Number of entries per chunk.
+        - entry_start (int): First entry to read, over the whole file list; the chunks of a file
+          start at this entry, so a chunk boundary keeps the chunks of a full read.
+        - entry_stop (int): Entry after the last one to read, over the whole file list (None: all).
+        - io_stats (NCQE_IO_Stats): Per-file and per-branch I/O counters to fill (optional).
+        """
+        self.infiles    = list(infiles)
+        self.branches   = branches
+        self.jagged     = tuple(jagged)
+        self.chunk_size = int(chunk_size)
+        self.entry_start = int(entry_start)
+        self.entry_stop  = entry_stop
+        self.io_stats    = io_stats
+
+    def num_entries(self):
+        """
+        Returns the total number of entries of the first tree over all input files.
+        """
+        treename = next(iter(self.branches))
+        total = 0
+        for infile in self.infiles :
+            with uproot.open(infile) as fin :
+                total += fin[treename].num_entries
+        return total
+
+    def __iter__(self):
+        entry_offset = 0
+        for infile in self.infiles :
+            if self.entry_stop is not None and entry_offset >= self.entry_stop :
+                break
+            with uproot.open(infile) as fin :
+                if self.io_stats is not None :
+                    self.io_stats.open_file(infile, fin)
+                try :
+                    trees = { treename : fin[treename] for treename in self.branches }
+                    nentries = min(tree.num_entries for tree in trees.values())
+                    last     = nentries if self.entry_stop is None else min(nentries, self.entry_stop - entry_offset)
+                    for start in range(max(0, self.entry_start - entry_offset), last, self.chunk_size) :
+                        stop = min(start + self.chunk_size, last)
+                        yield self._read(trees, start, stop, entry_offset)
+                finally :
+                    if self.io_stats is not None :
+                        self.io_stats.close_file()
+            entry_offset += nentries
+
+    def _read(self, trees, start, stop, entry_offset):
+        columns = {}
+        counts  = {}
+        for treename, tree in trees.items() :
+            names = self.branches[treename]
+            columns[treename] = {}
+            if len(names) == 0 :
+                continue
+            tic    = time.perf_counter()
+            arrays = tree.arrays(names, entry_start=start, entry_stop=stop, library="ak")
+            toc    = time.perf_counter()
+            for name in names :
+                if treename in self.jagged :
+                    columns[treename][name] = ak.to_numpy(ak.flatten(arrays[name], axis=1))
+                    if treename not in counts :
+                        counts[treename] = ak.to_numpy(ak.num(arrays[name], axis=1))
+                else :
+                    columns[treename][name] = _to_numpy(arrays[name])
+            if self.io_stats is not None :
+                self.io_stats.add_read(treename, tree, names, start, stop, toc - tic, time.perf_counter() - toc)
+        if self.io_stats is not None :
+            self.io_stats.add_chunk(stop - start)
+        return NCQE_Chunk(entry_offset + start, stop - start, columns, counts)
+
+
+def _to_numpy(array):
+    # Fixed-size arrays (e.g. pos[3]) become 2D; variable-size ones (e.g. pnu[npar]) are zero-padded
+    try :
+        return ak.to_numpy(array)
+    except ValueError :
+        width = int(ak.max(ak.num(array, axis=1)))
+        return ak.to_numpy(ak.fill_none(ak.pad_none(array, width, axis=1, clip=True), 0))
+
+
+def element(array, index):
+    """
+    Returns the index-th element of each entry as float64 (the PyROOT double view of a leaf).
+    """
+    if array.ndim == 1 :
+        return array.astype(np.float64)
+    return array[:, index].astype(np.float64)
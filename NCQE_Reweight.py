@@ -0,0 +1,198 @@
+#!/usr/bin/python
+#------------------------------------------------------------------------------
+#  Oscillation re-weighting of the recorded histogram fills.
+#  Usage: python NCQE_Reweight.py -r record.pkl -p points.json [-o output.root]
+#------------------------------------------------------------------------------
+import json
+import pickle
+from optparse import OptionParser
+import numpy as np
+
+from NCQE_Accumulator import NCQE_Hist_Accumulator
+
+class NCQE_Osc_Reweighter:
+
+    def __init__(self, t2k, accumulators):
+        """
+        Keeps a slim record of the events entering the histograms, to refill every histogram
+        for other oscillation hypotheses without reading the events again.
+
+        Parameters:
+        - t2k (T2K): Oscillation baseline and nominal parameters.
+        - accumulators (dict): Histogram accumulators to record, by name (NCQE_Engine.accumulators()).
+
+        Each event keeps its neutrino energy and base weight (flux tuned, POT normalized,
+        without oscillation, as the nominal histograms); each accumulator records the flat
+        bin index, event and value of every fill. The weight of a hypothesis is the base weight
+        times P(numu->nue) + P(numu->numu) at that hypothesis. The nominal histograms carry
+        no oscillation factor (the TChain loop computes it but does not apply it), so even the
+        nominal point differs from them by this factor; a point without oscillation (e.g. L=0)
+        gives the nominal histograms.
+        """
+        self.t2k          = t2k
+        self.accumulators = accumulators
+        self.enu  = []
+        self.wgts = []
+        self.nevents = 0
+        for accumulator in accumulators.values() :
+            accumulator.recorded = []
+
+    def add_events(self, enu, wgts, recorded):
+        """
+        Records the events of a chunk with recorded True (the ones entering a histogram).
+        Returns the record index of every event of the chunk (-1 if not recorded).
+        """
+        index = np.full(len(enu), -1, dtype=np.int64)
+        nrecorded = np.count_nonzero(recorded)
+        index[recorded] = np.arange(self.nevents, self.nevents + nrecorded)
+        self.enu.append(np.asarray(enu, dtype=np.float64)[recorded])
+        self.wgts.append(np.asarray(wgts, dtype=np.float64)[recorded])
+        self.nevents += nrecorded
+        return index
+
+    def state(self):
+        """
+        Returns the recorded events and fills as arrays (picklable).
+        """
+        fills = {}
+        for name, accumulator in self.accumulators.items() :
+            fills[name] = ( np.concatenate([ index  for index, events, values in accumulator.recorded ] or [ np.zeros(0, dtype=np.int64) ]),
+                            np.concatenate([ events for index, events, values in accumulator.recorded ] or [ np.zeros(0, dtype=np.int64) ]),
+                            np.concatenate([ values for index, events, values in accumulator.recorded ] or [ np.zeros(0) ]) )
+        return { "enu"   : np.concatenate(self.enu)  if self.enu  else np.zeros(0),
+                 "wgts"  : np.concatenate(self.wgts) if self.wgts else np.zeros(0),
+                 "fills" : fills }
+
+    def merge(self, state):
+        """
+        Appends the state() of another reweighter with the same accumulators.
+        """
+        offset = self.nevents
+        self.enu.append(state["enu"])
+        self.wgts.append(state["wgts"])
+        self.nevents += len(state["enu"])
+        for name, accumulator in self.accumulators.items() :
+            index, events, values = state["fills"][name]
+            accumulator.recorded.append((index, events + offset, values))
+
+    def reset(self):
+        """
+        Clears the recorded events and fills.
+        """
+        self.enu  = []
+        self.wgts = []
+        self.nevents = 0
+        for accumulator in self.accumulators.values() :
+            accumulator.recorded = []
+
+    def osc_factors(self, points):
+        """
+        Returns the oscillation factor P(numu->nue) + P(numu->numu) of every recorded event
+        for each point, [point, event] (1 without oscillation, as in the nominal histograms).
+
+        Parameters:
+        - points (list): Oscillation hypotheses, dicts of T2K.osc_para arguments
+          (sinth13, sinth23, deltam32, L; missing ones are nominal).
+        """
+        enu  = np.concatenate(self.enu) if self.enu else np.zeros(0)
+        para = np.array([ self.t2k.osc_para(**point) for point in points ])
+        pmutoe, pmutomu = self.t2k.osc_prob(enu, tuple(para[:, [i]] for i in range(4)))
+        return pmutoe + pmutomu
+
+    def reweight(self, points):
+        """
+        Yields, for each oscillation point, the {name: state} of every accumulator
+        (as NCQE_Hist_Accumulator.state) with the weights of that point.
+        """
+        state   = self.state()
+        factors = self.osc_factors(points)
+        for ipoint in range(len(points)) :
+            wgts = state["wgts"] * factors[ipoint]
+            yield { name : self._accumulate(accumulator, *state["fills"][name], wgts)
+                    for name, accumulator in self.accumulators.items() }
+
+    def _accumulate(self, accumulator, index, events, values, wgts):
+        refill = NCQE_Hist_Accumulator(accumulator.features, accumulator.groups,
+                                       accumulator.cutnames, accumulator.intnames)
+        refill.add(index, wgts[events], values)
+        return refill.state()
+
+    def load(self, states):
+        """
+        Replaces the content of the accumulators with the reweight() result of one point
+        (e.g. before update_histograms and write of the histogram classes).
+        """
+        for name, accumulator in self.accumulators.items() :
+            accumulator.reset()
+            accumulator.merge(states[name])
+
+
+def save_record(filename, reweighter, anamode, output, skip_cuts=()):
+    """
+    Saves the record of a reweighter with the settings needed to reweight it later
+    (analysis mode, histogram output spec and skipped cuts).
+    """
+    with open(filename, "wb") as fout :
+        pickle.dump({ "anamode" : anamode, "output" : output, "skip_cuts" : list(skip_cuts),
+                      "state" : reweighter.state() }, fout)
+
+
+def write_osc_histograms(filename, reweighter, points, hist_gamma, hist_neutron):
+    """
+    Writes the requested histograms of each oscillation point into the directory osc_<index>
+    (titled with the point) of a ROOT file. The accumulators keep the last point afterwards.
+    """
+    from ROOT import TFile
+    fout = TFile(filename, "RECREATE")
+    for ipoint, states in enumerate(reweighter.reweight(points)) :
+        reweighter.load(states)
+        hist_gamma.update_histograms()
+        hist_neutron.update_histograms()
+        fout.mkdir(f"osc_{ipoint:03d}", json.dumps(points[ipoint])).cd()
+        hist_gamma.write()
+        hist_neutron.write()
+    fout.Close()
+
+
+def load_osc_points(filename):
+    """
+    Reads the oscillation points from a JSON file, e.g. [{"sinth23": 0.45}, {"sinth23": 0.55, "deltam32": 2.5e-3}].
+    """
+    with open(filename) as fin :
+        return json.load(fin)
+
+
+def main():
+    #------------------------------------------------------------------------------
+    usage = "usage: %prog [options]"
+    parser = OptionParser( usage = usage )
+    parser.add_option("-r", "--record", dest="record", default="", metavar="FILE",
+                      help="Oscillation record written by main_NCQE.py --osc-record")
+    parser.add_option("-p", "--points", dest="points", default="", metavar="FILE",
+                      help="JSON list of oscillation points, e.g. [{\"sinth23\": 0.5, \"deltam32\": 2.5e-3}]")
+    parser.add_option("-o", "--output", dest="output", default="ncqe_histogram_osc.root", metavar="FILE",
+                      help="Output ROOT file, one directory per point (default: %default)")
+    ( options, args ) = parser.parse_args()
+    if not options.record or not options.points :
+        parser.error("--record and --points are needed")
+
+    from T2K_Config import T2K
+    from NCQE_Gamma_Hist import NCQE_Gamma_Histo
+    from NCQE_Neutron_Hist import NCQE_Neutron_Histo
+    with open(options.record, "rb") as fin :
+        record = pickle.load(fin)
+    skip_cuts    = record.get("skip_cuts", [])
+    hist_gamma   = NCQE_Gamma_Histo(record["output"]["gamma"], skip_cuts=skip_cuts)
+    hist_neutron = NCQE_Neutron_Histo(record["output"]["neutron"], record["output"]["neutronNN"], skip_cuts=skip_cuts)
+    reweighter   = NCQE_Osc_Reweighter(T2K(anamode=record["anamode"]),
+                                       { "gamma"     : hist_gamma.accumulator,
+                                         "neutron"   : hist_neutron.accumulator,
+                                         "neutronNN" : hist_neutron.accumulatorNN })
+    reweighter.merge(record["state"])
+    points = load_osc_points(options.points)
+    write_osc_histograms(options.output, reweighter, points, hist_gamma, hist_neutron)
+    print("Wrote", len(points), "oscillation points of", reweighter.nevents, "events to", options.output)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,278 @@
+import json
+import numpy as np
+from ROOT import TH1D
+from NCQE_Accumulator import NCQE_Hist_Accumulator
+from NCQE_Output import hist_name
+
+class NCQE_Cut_Scan:
+
+    def __init__(self, ncqe_cut, grid, block_size=4000000, reference="nocut"):
+        """
+        Evaluates a grid of NCQE_Cut variations in the same pass over the events.
+
+        Parameters:
+        - ncqe_cut (NCQE_Cut): Nominal cuts (run, anamode, channels).
+        - grid (dict): Values scanned on each axis, the grid is their Cartesian product:
+            "aopt", "bopt"            : Cherenkov angle cut coefficients (default: nominal),
+            "dwall", "effwall", "ovaQ": offsets added to the linear cut of the run (default: 0),
+            "signal"                  : signal channels (default: nuncqe and nubarncqe).
+        - block_size (int): Maximum number of event x grid point mask elements held at once.
+        - reference (str): Stage the signal efficiency is relative to: "nocut" (all events), or
+          "wallfv" (events passing the energy window and the fiducial volume), exact on skims
+          whose pre-cut drops events before it (NCQE_Skim.check_precut).
+
+        The energy window and the 200 cm fiducial volume cuts are not scanned.
+        """
+        if reference not in ("nocut", "wallfv") :
+            raise ValueError(f"Unknown cut scan reference stage: {reference}")
+        self.reference = reference
+        self.ncqe_cut = ncqe_cut
+        self.signal   = list(grid.get("signal", ["nuncqe", "nubarncqe"]))
+        axes = { "aopt"    : grid.get("aopt",    [ncqe_cut.aopt]),
+                 "bopt"    : grid.get("bopt",    [ncqe_cut.bopt]),
+                 "dwall"   : grid.get("dwall",   [0.]),
+                 "effwall" : grid.get("effwall", [0.]),
+                 "ovaQ"    : grid.get("ovaQ",    [0.]) }
+        unknown = set(grid) - set(axes) - {"signal"}
+        if unknown :
+            raise ValueError(f"Unknown cut scan axes: {sorted(unknown)}")
+        mesh = np.meshgrid(*[ np.asarray(values, dtype=np.float64) for values in axes.values() ], indexing="ij")
+        self.points  = { name : values.ravel() for name, values in zip(axes, mesh) }
+        self.npoints = len(self.points["aopt"])
+        self.block_size = int(block_size)
+
+        # Weighted yield and sum of squared weights passing each grid point, [point, channel]
+        nchannel = len(ncqe_cut.channels)
+        self.yields  = np.zeros((self.npoints, nchannel))
+        self.yields2 = np.zeros((self.npoints, nchannel))
+        # Weighted yield at the reference stage, [channel]
+        self.total   = np.zeros(nchannel)
+
+    def add(self, Erec, dwall, effwall, ovaq, angle, codes, wgts):
+        """
+        Adds the events of a chunk: builds the events x grid points pass mask block by block
+        and sums the weights of the passing events per grid point and channel.
+        Same cuts and arithmetic as NCQE_Cut.is_NCQE_array, so the nominal point gives its selection.
+        """
+        ncqe_cut = self.ncqe_cut
+        nchannel = len(ncqe_cut.channels)
+
+        ## 1. Energy cut and 3. Fiducial volume cut do not depend on the grid point
+        base = ~(Erec >= 30) & ~(Erec < 4) & ~(dwall < 200) & ~(effwall < 200)
+        if self.reference == "nocut" :
+            self.total += np.bincount(codes, weights=wgts, minlength=nchannel)
+        else :
+            self.total += np.bincount(codes[base], weights=wgts[base], minlength=nchannel)
+        index = np.flatnonzero(base)
+        nblock = max(1, self.block_size // self.npoints)
+        for start in range(0, len(index), nblock) :
+            block = index[start:start + nblock]
+            E = Erec[block][:, None]
+            ## 4. Fit quality cut, with the offsets of each grid point
+            mask  = ~(dwall[block][:, None]   < ncqe_cut.cut_val("dwall",   ncqe_cut.run, E) + self.points["dwall"])
+            mask &= ~(effwall[block][:, None] < ncqe_cut.cut_val("effwall", ncqe_cut.run, E) + self.points["effwall"])
+            mask &= ~(ovaq[block][:, None]    < ncqe_cut.cut_val("ovaQ",    ncqe_cut.run, E) + self.points["ovaQ"])
+            ## 6. Cherenkov angle cut of each grid point
+            mask &= ~(angle[block][:, None] < self.points["aopt"] * E + self.points["bopt"])
+
+            # [event, channel] weights, summed over the passing events of each point
+            wgt = np.zeros((len(block), nchannel))
+            wgt[np.arange(len(block)), codes[block]] = wgts[block]
+            mask = mask.T.astype(np.float64)
+            self.yields  += mask @ wgt
+            self.yields2 += mask @ (wgt * wgts[block][:, None])
+
+    def state(self):
+        return { "yields" : self.yields.copy(), "yields2" : self.yields2.copy(), "total" : self.total.copy() }
+
+    def merge(self, state):
+        self.yields  += state["yields"]
+        self.yields2 += state["yields2"]
+        self.total   += state["total"]
+
+    def reset(self):
+        self.yields[...]  = 0.
+        self.yields2[...] = 0.
+        self.total[...]   = 0.
+
+    def report(self):
+        """
+        Returns one dict per grid point: cut values, signal yield, background per channel,
+        total background, signal efficiency (w.r.t. the reference stage, "efficiency" for no cut and
+        "efficiency_wallfv" for the fiducial volume) and purity.
+        """
+        channels   = self.ncqe_cut.channels
+        isignal    = [ channels.index(channel) for channel in self.signal ]
+        ibkg       = [ ichannel for ichannel in range(len(channels)) if ichannel not in isignal ]
+        signal     = self.yields[:, isignal].sum(axis=1)
+        background = self.yields[:, ibkg].sum(axis=1)
+        total      = self.total[isignal].sum()
+        rows = []
+        for ipoint in range(self.npoints) :
+            row = { name : values[ipoint] for name, values in self.points.items() }
+            row["signal"]     = signal[ipoint]
+            row["signal_err"] = np.sqrt(self.yields2[ipoint, isignal].sum())
+            for ichannel in ibkg :
+                row[channels[ichannel]] = self.yields[ipoint, ichannel]
+            row["background"] = background[ipoint]
+            row[self.efficiency_name()] = signal[ipoint] / total if total > 0 else 0.
+            row["purity"]     = signal[ipoint] / (signal[ipoint] + background[ipoint]) if signal[ipoint] + background[ipoint] > 0 else 0.
+            rows.append(row)
+        return rows
+
+    def efficiency_name(self):
+        """
+        Returns the report column of the signal efficiency, named after the reference stage.
+        """
+        return "efficiency" if self.reference == "nocut" else f"efficiency_{self.reference}"
+
+    def write_report(self, filename):
+        """
+        Writes the report as a CSV table, one line per grid point.
+        """
+        rows = self.report()
+        with open(filename, "w") as fout :
+            fout.write(",".join(rows[0]) + "\n")
+            for row in rows :
+                fout.write(",".join(f"{value:.8g}" for value in row.values()) + "\n")
+
+    def print_report(self, maxrows=50):
+        """
+        Prints the report, limited to the maxrows points of highest signal x purity.
+        """
+        rows  = self.report()
+        order = sorted(range(len(rows)), key=lambda ipoint: -rows[ipoint]["signal"] * rows[ipoint]["purity"])
+        print(f"*** Cut scan: {len(rows)} grid points (signal: {', '.join(self.signal)}) ***")
+        header = [ "aopt", "bopt", "dwall", "effwall", "ovaQ", "signal", "background", self.efficiency_name(), "purity" ]
+        widths = [ max(11, len(name) + 1) for name in header ]
+        print("".join(f"{name:>{width}s}" for name, width in zip(header, widths)))
+        for ipoint in order[:maxrows] :
+            print("".join(f"{rows[ipoint][name]:{width}.4g}" for name, width in zip(header, widths)))
+        if len(rows) > maxrows :
+            print(f"... {len(rows) - maxrows} more points in the CSV report")
+
+
+def load_scan_grid(filename):
+    """
+    Reads a cut scan grid from a JSON file, e.g. {"aopt": [1.6, 1.7], "bopt": [14, 15, 16], "dwall": [-20, 0, 20]}.
+    """
+    with open(filename) as fin :
+        return json.load(fin)
+
+
+class NCQE_TagOut_Scan:
+
+    def __init__(self, thresholds, channels, categories=("all", "Gd", "H", "Noise")):
+        """
+        Tagged neutron multiplicity and candidate composition of the selected events
+        for several TagOut thresholds, in the same pass over the events.
+
+        Parameters:
+        - thresholds (list): TagOut thresholds, a candidate is tagged if TagOut > threshold.
+        - channels (list): Interaction channel names (NCQE_Cut.channels).
+        - categories (list): Truth categories of the candidates, "all" first (NCQE_Cut.categories).
+        """
+        self.thresholds = np.unique(np.asarray(thresholds, dtype=np.float64))
+        self.channels   = list(channels)
+        self.categories = list(categories)
+        self.intnames   = ["all"] + self.channels
+
+        # Tagged multiplicity histograms, one feature per threshold (binning of htagged_n)
+        self.features = [ { "name"  : "htagged_n_tagout" + f"{threshold:.3f}".replace(".", "p"),
+                            "label" : f"Tagged MultiN (TagOut > {threshold:g})",
+                            "bins"  : (15, -0.50, 14.50) } for threshold in self.thresholds ]
+        self.accumulator = NCQE_Hist_Accumulator(self.features, ["ncgamma"], ["angle"], self.intnames)
+
+        # Weighted number of tagged candidates, [threshold, category] with category 0 = "all"
+        self.tagged = np.zeros((len(self.thresholds), len(self.categories)))
+
+    def add(self, tagout, category, parent, codes, wgts):
+        """
+        Adds the candidates of the selected events of a chunk.
+
+        Parameters:
+        - tagout (ndarray): TagOut of each candidate.
+        - category (ndarray): Index in categories of each candidate (-1 if not a truth category).
+        - parent (ndarray): Index of the event of each candidate.
+        - codes (ndarray): Channel code of each event.
+        - wgts (ndarray): Weight of each event.
+        """
+        nthreshold = len(self.thresholds)
+        nevent     = len(wgts)
+        # Number of thresholds below the TagOut of each candidate (NaN is never tagged):
+        # the candidate is tagged at the thresholds 0 .. npassed-1
+        npassed = np.searchsorted(self.thresholds, tagout, side="left")
+        npassed[np.isnan(tagout)] = 0
+
+        # Tagged candidates of each event at each threshold, [event, threshold], by cumulative counts
+        counts = np.bincount(parent * (nthreshold + 1) + npassed,
+                             minlength=nevent * (nthreshold + 1)).reshape(nevent, nthreshold + 1)
+        multiplicity = np.flip(np.cumsum(np.flip(counts, axis=1), axis=1), axis=1)[:, 1:]
+        ichannel = 1 + np.asarray(codes, dtype=np.int64)
+        for ithreshold in range(nthreshold) :
+            self.accumulator.fill(ithreshold, 0, 0, ichannel, multiplicity[:, ithreshold], wgts)
+            self.accumulator.fill(ithreshold, 0, 0, 0,        multiplicity[:, ithreshold], wgts)
+        self.accumulator.flush()
+
+        # Weighted candidates by number of thresholds passed and category, then per threshold
+        ncategory = len(self.categories)
+        known     = category > 0
+        index     = np.concatenate([ npassed * ncategory, npassed[known] * ncategory + category[known] ])
+        wgt       = np.concatenate([ wgts[parent], wgts[parent[known]] ])
+        tagged = np.bincount(index, weights=wgt, minlength=(nthreshold + 1) * ncategory).reshape(nthreshold + 1, ncategory)
+        self.tagged += np.flip(np.cumsum(np.flip(tagged, axis=0), axis=0), axis=0)[1:]
+
+    def state(self):
+        return { "accumulator" : self.accumulator.state(), "tagged" : self.tagged.copy() }
+
+    def merge(self, state):
+        self.accumulator.merge(state["accumulator"])
+        self.tagged += state["tagged"]
+
+    def reset(self):
+        self.accumulator.reset()
+        self.tagged[...] = 0.
+
+    def purities(self):
+        """
+        Returns the fraction of the tagged candidates in each category, [threshold, category]
+        (1 for "all"; candidates without truth category are in "all" only).
+        """
+        total = self.tagged[:, :1]
+        return np.divide(self.tagged, total, out=np.zeros_like(self.tagged), where=total > 0)
+
+    def histograms(self):
+        """
+        Returns the tagged multiplicity TH1D histograms of every threshold and channel.
+        """
+        hists = []
+        for ifeature, feature in enumerate(self.features) :
+            for iintname, intname in enumerate(self.intnames) :
+                hist = TH1D(hist_name(feature["name"], "ncgamma", "angle", intname),
+                            f"; {feature['label']}; Events", *feature["bins"])
+                hist.SetDirectory(0)
+                hists.append(self.accumulator.to_histogram(hist, ifeature, 0, 0, iintname))
+        return hists
+
+    def print_report(self):
+        """
+        Prints the weighted tagged candidates, mean multiplicity and category purities per threshold.
+        """
+        sumw, sumw2, entries = self.accumulator.totals()
+        nbins    = self.features[0]["bins"][0]
+        centers  = np.arange(-1, nbins + 1, dtype=np.float64)   # bin i holds multiplicity i-1, overflow counted as nbins
+        purities = self.purities()
+        print("*** TagOut scan (selected events) ***")
+        print(f"{'TagOut >':>9s}{'tagged':>11s}{'<MultiN>':>11s}" + "".join(f"{category:>11s}" for category in self.categories[1:]))
+        for ithreshold, threshold in enumerate(self.thresholds) :
+            events = sumw[ithreshold, 0, 0, 0]
+            mean   = (events * centers).sum() / events.sum() if events.sum() > 0 else 0.
+            print(f"{threshold:9.3f}{self.tagged[ithreshold, 0]:11.4g}{mean:11.4g}"
+                  + "".join(f"{purity:11.4f}" for purity in purities[ithreshold, 1:]))
+
+
+def parse_thresholds(text):
+    """
+    Parses a comma-separated list of TagOut thresholds, e.g. "0.5,0.6,0.7,0.8".
+    """
+    return [ float(value) for value in text.split(",") if value.strip() ]
@@ -0,0 +1,142 @@
+import os
+from glob import glob
+from collections import defaultdict
+import uproot
+
+from NCQE_Layout import nNN_in_NTag, n_computed   # shared with the candidate store
+
+# Input tree naming of the two detector simulations
+#  - angle     : (tree, branch) holding the Cherenkov angle [degree]
+#  - neutmode  : NEUT interaction mode branch in h1
+#  - fv_div    : divisor bringing NTag fvx/fvy/fvz to the prompt vertex unit [m]
+#  - n_in_NTag : per-candidate neutron features filled into histograms
+SCHEMAS = {
+    "SKDETSIM" : { "angle"     : ("h1", "angle"),
+                   "neutmode"  : "Neutmode",
+                   "fv_div"    : 100,
+                   "n_in_NTag" : ['FitT', 'DPrompt', 'beamcos', 'gammacos',
+                                  'DistL', 'DistT', 'fvx', 'fvy', 'fvz', 'r2'] },
+    "SKG4"     : { "angle"     : ("event", "CherenkovAngle"),
+                   "neutmode"  : "NEUTMode",
+                   "fv_div"    : 1,
+                   "n_in_NTag" : ['FitT', 'DPrompt', 'beamcos', 'gammacos',
+                                  'fvx', 'fvy', 'fvz', 'r2'] }
+}
+
+# Branches read by each analysis stage, as (tree, branch).
+# "angle", "neutmode" and "n_in_NTag" are resolved with the schema.
+# The taggable tree is not used by any stage, so it is never opened.
+STAGES = {
+    "selection" : [ ("h1", "erec"), ("h1", "wall"), ("h1", "effwall"), ("h1", "ovaq"), "angle" ],
+    "channel"   : [ "neutmode" ],
+    "weighting" : [ ("h1", "pnu") ],
+    "tree"      : [ ("h1", "pnu"), ("h1", "erec"), ("h1", "wall"), ("h1", "effwall"), ("h1", "ovaq"), "angle",
+                    ("h1", "pos"), ("h1", "posv"), ("h1", "bdir"),
+                    ("event", "NTrueN"), ("event", "NTaggableN"), ("event", "NTaggedN") ],
+    "gamma"     : [ ("h1", "pnu"), ("h1", "erec"), ("h1", "wall"), ("h1", "effwall"), ("h1", "ovaq"), "angle",
+                    ("h1", "pos"), ("h1", "bdir"),
+                    ("event", "NTrueN"), ("event", "NTaggableN"), ("event", "NTaggedN") ],
+    "neutron"   : [ ("h1", "pos"), ("h1", "bdir"), ("event", "NCandidates"),
+                    ("ntag", "TagOut"), ("ntag", "Label"), ("ntag", "fvx"), ("ntag", "fvy"), ("ntag", "fvz"),
+                    ("ntag", "DPrompt"), "n_in_NTag" ],
+    "neutronNN" : [ ("event", "NCandidates"), ("ntag", "TagOut"), ("ntag", "Label") ]
+                  + [ ("ntag", feature) for feature in nNN_in_NTag ],
+}
+
+
+def branch_manifest(schema, stages=None, extra=None):
+    """
+    Returns the {treename: [branch, ...]} read by the given analysis stages.
+
+    Parameters:
+    - schema (str): Input naming convention, a key of SCHEMAS.
+    - stages (list): Keys of STAGES (default: all of them).
+    - extra (dict): Additional {treename: [branch, ...]}, e.g. to open the taggable tree.
+
+    Trees without any branch are left out, so they are not opened.
+    """
+    names = SCHEMAS[schema]
+    manifest = {}
+
+    def add(treename, branch):
+        manifest.setdefault(treename, [])
+        if branch not in manifest[treename] :
+            manifest[treename].append(branch)
+
+    for stage in (stages if stages is not None else STAGES) :
+        for item in STAGES[stage] :
+            if item == "angle" :
+                add(*names["angle"])
+            elif item == "neutmode" :
+                add("h1", names["neutmode"])
+            elif item == "n_in_NTag" :
+                for feature in names["n_in_NTag"] :
+                    if feature not in n_computed :
+                        add("ntag", feature)
+            else :
+                add(*item)
+    for treename, branches in (extra or {}).items() :
+        for branch in branches :
+            add(treename, branch)
+    return manifest
+
+
+def set_branch_status(chain, branches):
+    """
+    Enables only the given branches of a TChain so that no other basket is read.
+    """
+    chain.SetBranchStatus("*", 0)
+    for branch in branches :
+        chain.SetBranchStatus(branch, 1)
+
+
+def detect_schema(infile):
+    """
+    Returns the SCHEMAS key matching the branch list of an input file.
+    """
+    with uproot.open(infile) as fin :
+        branches = { treename : set(fin[treename].keys()) for treename in ("h1", "event") }
+    matches = [ schema for schema, names in SCHEMAS.items()
+                if names["neutmode"] in branches["h1"] and names["angle"][1] in branches[names["angle"][0]] ]
+    if len(matches) != 1 :
+        raise ValueError(f"Cannot tell the input schema of {infile}: matches {matches}")
+    return matches[0]
+
+
+def group_files(patterns):
+    """
+    Returns {fileType: [infile, ...]}, the files matching the patterns grouped by neutrino flavor.
+    """
+    groupedFiles = defaultdict( list )
+    # Input file name example
+    # File name = lentp_nuebar.ncgamma_flux13a_neut533.030.root
+    # Split with ".", [lentp_nuebar, ncgamma_flux13a_neut533, 030, root]
+    # Split with "-", [lentp, nuebar, ncgamma, flux13a, neut533, 030, root]
+    # Choose the [1] element, the neutrion flavor info.
+    for arg in patterns :  # Iterate through arguments
+        for fname in glob( arg ) :  # Get files in directory arg
+            ftle = os.path.basename( fname ).split( "." )[ 0 ]
+            ft = ftle.split( "_" )[ 1 ]  # get neutrino flavor
+            groupedFiles[ ft ] += [ fname ]
+    return groupedFiles
+
+
+def file_schemas(groupedFiles, schema="auto"):
+    """
+    Returns {infile: schema} for every input file, detected unless a schema is forced.
+    """
+    schemas = {}
+    for infiles in groupedFiles.values() :
+        for infile in infiles :
+            schemas[ infile ] = detect_schema( infile ) if schema == "auto" else schema
+    return schemas
+
+
+def split_by_schema(infiles, schemas):
+    """
+    Splits a file list into {schema: [infile, ...]}, keeping the input order.
+    """
+    files = {}
+    for infile in infiles :
+        files.setdefault(schemas[ infile ], []).append( infile )
+    return files
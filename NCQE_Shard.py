@@ -0,0 +1,230 @@
+#!/usr/bin/python
+#------------------------------------------------------------------------------
+#  Shard plan of the input entries for batch clusters.
+#  Usage: python NCQE_Shard.py -n 100 -o plan.json [inputfile]
+#         python main_NCQE.py --shard-plan plan.json --shard 7/100
+#------------------------------------------------------------------------------
+import json
+from optparse import OptionParser
+import numpy as np
+import uproot
+import progressbar as pb
+
+from NCQE_Schema import SCHEMAS, branch_manifest, group_files, file_schemas
+from NCQE_Skim import read_skim_meta, skim_schemas
+from NCQE_Parallel import file_tasks
+
+
+def file_entries(infile, schema, from_skim=False):
+    """
+    Returns the number of entries of an input file, from the tree headers only
+    (the smallest tree read by the analysis, as NCQE_Chunk_Reader).
+    """
+    if from_skim :
+        return read_skim_meta(infile)["nentries"]
+    with uproot.open(infile) as fin :
+        return min(fin[treename].num_entries for treename in branch_manifest(schema))
+
+
+def file_candidates(infile, nentries, from_skim=False):
+    """
+    Returns the number of NTag candidates of each entry of an input file (event/NCandidates,
+    a single integer branch), or None if it cannot be read.
+
+    The tree headers only give the entry count of a file, not how its candidates are spread
+    over the entries, so balancing on candidates needs this branch: all its baskets are read
+    and decompressed (about 4 bytes per entry, no other branch). Used only with
+    NCQE_Shard.py --balance-candidates.
+    """
+    try :
+        if from_skim :
+            with np.load(infile) as skim :
+                return np.asarray(skim["event/NCandidates"][:nentries], dtype=np.int64)
+        with uproot.open(infile) as fin :
+            return np.asarray(fin["event"]["NCandidates"].array(entry_stop=nentries, library="np"), dtype=np.int64)
+    except (KeyError, ValueError) :
+        return None
+
+
+def parse_shard(text):
+    """
+    Parses "i/N" (shard i of N, 0 <= i < N) into (i, N).
+    """
+    ishard, nshards = ( int(value) for value in text.split("/") )
+    if nshards < 1 or not 0 <= ishard < nshards :
+        raise ValueError(f"Bad shard {text}: expected i/N with 0 <= i < N")
+    return ishard, nshards
+
+
+def entry_ranges(tasks, entries, entry_start, entry_stop):
+    """
+    Returns the (fileType, schema, infile, start, stop) file ranges of the entries
+    [entry_start, entry_stop) counted over the tasks (serial file order).
+
+    Parameters:
+    - tasks (list): (fileType, schema, infile) of each file, see NCQE_Parallel.file_tasks.
+    - entries (list): Number of entries of each file.
+    """
+    ranges = []
+    offset = 0
+    for (fileType, schema, infile), nentries in zip(tasks, entries) :
+        start = max(entry_start, offset) - offset
+        stop  = min(entry_stop, offset + nentries) - offset
+        if start < stop :
+            ranges.append((fileType, schema, infile, start, stop))
+        offset += nentries
+    return ranges
+
+
+def plan_shards(tasks, entries, candidates, nshards, candidate_cost=1.):
+    """
+    Splits the entries of the tasks into nshards contiguous entry ranges of about the same cost.
+
+    Parameters:
+    - tasks (list): (fileType, schema, infile) of each file.
+    - entries (list): Number of entries of each file.
+    - candidates (list): NTag candidates of each entry of each file (array), or None if unknown.
+    - nshards (int): Number of shards.
+    - candidate_cost (float): Cost of one candidate relative to one entry.
+
+    The cost of an entry is 1 + candidate_cost x its candidates (1 when unknown), so shards are
+    balanced over entries and candidates, and a large file is split over several shards.
+    Without any candidates the shards are the entry ranges of main_NCQE.py --shard i/N.
+    Returns the list of shards {"entry_start", "entry_stop", "cost", "ranges"}.
+    """
+    if all( ncand is None for ncand in candidates ) :
+        total  = sum(entries)
+        bounds = [ ishard * total // nshards for ishard in range(nshards + 1) ]
+        costs  = [ float(bounds[ishard + 1] - bounds[ishard]) for ishard in range(nshards) ]
+    else :
+        cost = np.concatenate([ np.ones(nentries) if ncand is None else 1. + candidate_cost * ncand
+                                for nentries, ncand in zip(entries, candidates) ])
+        cumulative = np.cumsum(cost)
+        total      = cumulative[-1] if len(cumulative) else 0.
+        bounds = [ 0 ] + [ int(np.searchsorted(cumulative, ishard * total / nshards, side="right"))
+                           for ishard in range(1, nshards) ] + [ len(cost) ]
+        costs  = [ float(cost[bounds[ishard]:bounds[ishard + 1]].sum()) for ishard in range(nshards) ]
+    shards = []
+    for ishard in range(nshards) :
+        start, stop = bounds[ishard], bounds[ishard + 1]
+        ranges = entry_ranges(tasks, entries, start, stop)
+        shards.append({ "entry_start" : start, "entry_stop" : stop,
+                        "cost"        : costs[ishard],
+                        "ranges"      : [ { "fileType" : fileType, "schema" : schema, "file" : infile,
+                                            "entry_start" : first, "entry_stop" : last }
+                                          for fileType, schema, infile, first, last in ranges ] })
+    return shards
+
+
+def write_plan(filename, tasks, entries, candidates, nshards, candidate_cost=1.):
+    """
+    Writes the shard plan of the tasks as JSON (input files with their counts, then the shards).
+    """
+    plan = { "candidate_cost" : candidate_cost,
+             "files"  : [ { "fileType" : fileType, "schema" : schema, "file" : infile, "entries" : nentries,
+                            "candidates" : None if ncand is None else int(ncand.sum()) }
+                          for (fileType, schema, infile), nentries, ncand in zip(tasks, entries, candidates) ],
+             "shards" : plan_shards(tasks, entries, candidates, nshards, candidate_cost) }
+    with open(filename, "w") as fout :
+        json.dump(plan, fout, indent=1)
+    return plan
+
+
+def load_plan(filename):
+    with open(filename) as fin :
+        return json.load(fin)
+
+
+def plan_files(plan):
+    """
+    Returns the {fileType: [infile, ...]} and {infile: schema} of the input files of a plan.
+    """
+    groupedFiles = {}
+    schemas      = {}
+    for record in plan["files"] :
+        groupedFiles.setdefault(record["fileType"], []).append(record["file"])
+        schemas[ record["file"] ] = record["schema"]
+    return groupedFiles, schemas
+
+
+def shard_ranges(plan, ishard):
+    """
+    Returns the (fileType, schema, infile, start, stop) file ranges of shard ishard of a plan.
+    """
+    if len(plan["shards"]) <= ishard :
+        raise ValueError(f"The shard plan has {len(plan['shards'])} shards, no shard {ishard}")
+    return [ (record["fileType"], record["schema"], record["file"], record["entry_start"], record["entry_stop"])
+             for record in plan["shards"][ishard]["ranges"] ]
+
+
+def process_ranges(engine, ranges):
+    """
+    Runs the analysis over the entry ranges [(fileType, schema, infile, start, stop), ...], in order.
+    """
+    maxev = sum(stop - start for fileType, schema, infile, start, stop in ranges)
+    print("Begin processing for", maxev, "entries of", len(ranges), "files")
+
+    # set up the progress bar
+    widgets = [ 'Events: ',
+                pb.Percentage(), ' ',
+                pb.Bar( marker = '=', left = '[', right = ']' ), ' ',
+                pb.ETA() ]
+    pbar = pb.ProgressBar( widgets = widgets, maxval = max(maxev, 1), term_width = 80 )
+    pbar.start()
+    print("")
+
+    done = 0
+    for fileType, schema, infile, start, stop in ranges :
+        engine.set_schema(schema)
+        for chunk in engine.profiler.timed("read", engine.reader([infile], entry_start=start, entry_stop=stop)) :
+            engine.process_chunk(fileType, chunk)
+            done += chunk.nentries
+            pbar.update(done)
+    pbar.finish()
+
+
+def main():
+    #------------------------------------------------------------------------------
+    usage = "usage: %prog [options] infiles1 infiles2 ..."
+    parser = OptionParser( usage = usage )
+    parser.add_option("-n", "--shards", type="int",
+                      dest="nshards", default=1, metavar="N",
+                      help="Number of shards (default: %default)")
+    parser.add_option("-o", "--output", dest="output", default="ncqe_shard_plan.json", metavar="FILE",
+                      help="Shard plan JSON file (default: %default)")
+    parser.add_option("-s", "--schema", type="choice", choices=["auto"] + list(SCHEMAS),
+                      dest="schema", default="auto",
+                      help="Input branch naming: auto (detected per file), SKDETSIM or SKG4 (default: %default)")
+    parser.add_option("--from-skim", action="store_true",
+                      dest="from_skim", default=False,
+                      help="Input files are skim files written with main_NCQE.py --skim")
+    parser.add_option("--balance-candidates", action="store_true",
+                      dest="balance_candidates", default=False,
+                      help="Also balance the shards on NTag candidates (reads the event/NCandidates branch "
+                           "of every file; by default the plan uses the tree headers only)")
+    parser.add_option("--candidate-cost", type="float",
+                      dest="candidate_cost", default=1., metavar="C",
+                      help="Cost of one NTag candidate relative to one entry (default: %default)")
+    ( options, args ) = parser.parse_args()
+    groupedFiles = group_files( args )
+    if len( groupedFiles ) == 0 :
+        parser.error("input files needed")
+    if options.nshards < 1 :
+        parser.error("--shards must be at least 1")
+
+    if options.from_skim :
+        schemas = skim_schemas(groupedFiles, options.schema)
+    else :
+        schemas = file_schemas(groupedFiles, options.schema)
+    tasks      = file_tasks(groupedFiles, schemas)
+    entries    = [ file_entries(infile, schema, options.from_skim) for fileType, schema, infile in tasks ]
+    candidates = [ file_candidates(infile, nentries, options.from_skim) if options.balance_candidates else None
+                   for (fileType, schema, infile), nentries in zip(tasks, entries) ]
+    plan  = write_plan(options.output, tasks, entries, candidates, options.nshards, options.candidate_cost)
+    costs = [ shard["cost"] for shard in plan["shards"] ]
+    print("Wrote", options.nshards, "shards of", sum(entries), "entries in", len(tasks), "files to", options.output)
+    print(f"Shard cost: min {min(costs):.0f}, mean {np.mean(costs):.0f}, max {max(costs):.0f}")
+
+
+if __name__ == "__main__":
+    main()
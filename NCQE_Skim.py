@@ -0,0 +1,263 @@
+import os
+import json
+import hashlib
+import numpy as np
+
+from NCQE_Reader import NCQE_Chunk, NCQE_Chunk_Reader, element
+
+# Loose pre-cut of the skim on the analysis variables (erec = energy - 0.51 MeV, dwall, effwall [cm]).
+# It must stay looser than the NCQE selection (4 <= Erec < 30 MeV, dwall/effwall >= 200 cm)
+# for the cuts re-tuned on the skim to give the same result as on the raw MC.
+default_precut = { "erec" : (3.0, 35.0), "dwall" : 150.0, "effwall" : 150.0 }
+# Bounds of the NCQE selection a pre-cut must keep (NCQE_Cut.last_stage)
+selection_bounds = { "erec" : (4.0, 30.0), "dwall" : 200.0, "effwall" : 200.0 }
+# Selection stages (NCQE_Cut.stages) whose events are not all in a skim: the events failing the
+# energy window or the fiducial volume are only kept inside the pre-cut. The later stages are exact.
+skim_incomplete_stages = ["nocut", "postact"]
+
+
+def parse_precut(text):
+    """
+    Reads a pre-cut given as "erec=3:35,dwall=150,effwall=150"; missing entries keep their default.
+    """
+    precut = dict(default_precut)
+    for item in filter(None, text.split(",")) :
+        name, value = item.split("=")
+        if name not in default_precut :
+            raise ValueError(f"Unknown skim pre-cut variable: {name}")
+        if name == "erec" :
+            low, high = value.split(":")
+            precut[name] = (float(low), float(high))
+        else :
+            precut[name] = float(value)
+    return precut
+
+
+def check_precut(precut, where="Skim pre-cut"):
+    """
+    Raises ValueError if a pre-cut is tighter than the NCQE selection (it would drop selected events).
+    The cut scan only varies the cuts after the fiducial volume, so a pre-cut passing this check
+    keeps the events of every grid point too.
+    """
+    low, high = precut["erec"]
+    tight = []
+    if low > selection_bounds["erec"][0] or high < selection_bounds["erec"][1] :
+        tight.append(f"erec={low:g}:{high:g}")
+    for name in ("dwall", "effwall") :
+        if precut[name] > selection_bounds[name] :
+            tight.append(f"{name}={precut[name]:g}")
+    if tight :
+        raise ValueError(f"{where} {', '.join(tight)} is tighter than the NCQE selection "
+                         f"(erec={selection_bounds['erec'][0]:g}:{selection_bounds['erec'][1]:g}, "
+                         f"dwall={selection_bounds['dwall']:g}, effwall={selection_bounds['effwall']:g})")
+
+
+def precut_mask(chunk, precut):
+    """
+    Returns the mask of the chunk entries passing the pre-cut.
+    Cuts are applied as "not failing", as in NCQE_Cut.is_NCQE_array, so no event selected there is lost.
+    """
+    h1      = chunk["h1"]
+    erec    = element(h1["erec"], 0) - 0.51
+    dwall   = element(h1["wall"], 0)
+    effwall = element(h1["effwall"], 0)
+    low, high = precut["erec"]
+    mask  = ~(erec >= high) & ~(erec < low)
+    mask &= ~(dwall < precut["dwall"]) & ~(effwall < precut["effwall"])
+    return mask
+
+
+def skim_chunk(chunk, mask, jagged=("ntag",)):
+    """
+    Returns the entries of a chunk where mask is True as a new NCQE_Chunk.
+    """
+    columns = {}
+    counts  = {}
+    for treename, branches in chunk.columns.items() :
+        if treename in jagged :
+            keep = np.repeat(mask, chunk.counts[treename])
+            columns[treename] = { name : array[keep] for name, array in branches.items() }
+            counts[treename]  = chunk.counts[treename][mask]
+        else :
+            columns[treename] = { name : array[mask] for name, array in branches.items() }
+    return NCQE_Chunk(chunk.entry_start, int(mask.sum()), columns, counts)
+
+
+def file_checksum(infile, blocksize=1 << 20):
+    """
+    Returns the sha256 of a file.
+    """
+    sha = hashlib.sha256()
+    with open(infile, "rb") as fin :
+        for block in iter(lambda: fin.read(blocksize), b"") :
+            sha.update(block)
+    return sha.hexdigest()
+
+
+def skim_name(skimdir, infile):
+    """
+    Returns the skim file of an input file, keeping its base name (and so its flavor).
+    """
+    base = os.path.basename(infile)
+    if base.endswith(".root") :
+        base = base[:-len(".root")]
+    return os.path.join(skimdir, base + ".skim.npz")
+
+
+def write_skim(outfile, fileType, schema, infile, branches, precut, chunk_size=10000):
+    """
+    Writes the entries of one input file passing the pre-cut to a npz skim file.
+
+    Parameters:
+    - outfile (str): Skim file to write.
+    - fileType (str): Neutrino flavor of the input file.
+    - schema (str): Input branch naming, a key of SCHEMAS.
+    - infile (str): Input ROOT file.
+    - branches (dict): {treename: [branch, ...]} read by the analysis (NCQE_Engine.branches()).
+    - precut (dict): Pre-cut, see default_precut.
+    - chunk_size (int): Number of entries read at once.
+
+    The arrays are stored as "<tree>/<branch>" (flat for ntag, with the counts per entry
+    in "<tree>/@counts") next to a "meta" JSON record with the provenance of the skim.
+    """
+    reader  = NCQE_Chunk_Reader([infile], branches, chunk_size=chunk_size)
+    nsource = 0
+    chunks  = []
+    for chunk in reader :
+        nsource += chunk.nentries
+        chunks.append(skim_chunk(chunk, precut_mask(chunk, precut), reader.jagged))
+
+    arrays = {}
+    for treename, names in branches.items() :
+        for name in names :
+            arrays[f"{treename}/{name}"] = _concatenate([chunk[treename][name] for chunk in chunks])
+        if treename in reader.jagged :
+            arrays[f"{treename}/@counts"] = np.concatenate([chunk.counts[treename] for chunk in chunks])
+
+    meta = { "source"   : os.path.abspath(infile),
+             "sha256"   : file_checksum(infile),
+             "size"     : os.path.getsize(infile),
+             "fileType" : fileType,
+             "schema"   : schema,
+             "precut"   : precut,
+             "branches" : branches,
+             "jagged"   : list(reader.jagged),
+             "nsource"  : nsource,
+             "nentries" : sum(chunk.nentries for chunk in chunks) }
+    os.makedirs(os.path.dirname(os.path.abspath(outfile)), exist_ok=True)
+    with open(outfile, "wb") as fout :
+        np.savez(fout, meta=np.array(json.dumps(meta)), **arrays)
+    return meta
+
+
+def write_skims(skimdir, groupedFiles, schemas, branches, precut, chunk_size=10000):
+    """
+    Writes one skim file per input file into skimdir.
+
+    Parameters:
+    - skimdir (str): Output directory.
+    - groupedFiles (dict): {fileType: [infile, ...]} input files per neutrino flavor.
+    - schemas (dict): {infile: schema} input branch naming of each file.
+    - branches (function): Returns the {treename: [branch, ...]} of a schema.
+    - precut (dict): Pre-cut, see default_precut; it must pass check_precut.
+    - chunk_size (int): Number of entries read at once.
+    """
+    check_precut(precut)
+    for fileType, infiles in groupedFiles.items() :
+        for infile in infiles :
+            outfile = skim_name(skimdir, infile)
+            meta = write_skim(outfile, fileType, schemas[ infile ], infile,
+                              branches(schemas[ infile ]), precut, chunk_size)
+            print("Skimmed", infile, ":", meta["nentries"], "/", meta["nsource"], "entries ->", outfile)
+
+
+def read_skim_meta(skimfile):
+    """
+    Returns the provenance record of a skim file.
+    """
+    with np.load(skimfile) as skim :
+        return json.loads(str(skim["meta"]))
+
+
+def skim_schemas(groupedFiles, schema="auto"):
+    """
+    Returns {skimfile: schema} from the skim provenance; a forced schema must match it
+    and the pre-cut of every skim must be looser than the NCQE selection (check_precut).
+    """
+    schemas = {}
+    for skimfiles in groupedFiles.values() :
+        for skimfile in skimfiles :
+            meta = read_skim_meta( skimfile )
+            check_precut(meta["precut"], f"{skimfile}: pre-cut")
+            schemas[ skimfile ] = meta["schema"]
+            if schema != "auto" and schema != schemas[ skimfile ] :
+                raise ValueError(f"{skimfile} was skimmed from {schemas[ skimfile ]} inputs, not {schema}")
+    return schemas
+
+
+class NCQE_Skim_Reader:
+
+    def __init__(self, skimfiles, branches, chunk_size=10000, entry_start=0, entry_stop=None):
+        """
+        Reads skim files written by write_skim chunk by chunk, as NCQE_Chunk_Reader does for ROOT files.
+
+        Parameters:
+        - skimfiles (list): Skim files, processed in the given order.
+        - branches (dict): {treename: [branch, ...]} branches to read from each tree.
+        - chunk_size (int): Number of entries per chunk.
+        - entry_start (int): First entry to read, over the whole skim file list.
+        - entry_stop (int): Entry after the last one to read, over the whole skim file list (None: all).
+        """
+        self.infiles    = list(skimfiles)
+        self.branches   = branches
+        self.chunk_size = int(chunk_size)
+        self.entry_start = int(entry_start)
+        self.entry_stop  = entry_stop
+
+    def num_entries(self):
+        """
+        Returns the total number of skimmed entries over all skim files.
+        """
+        return sum(read_skim_meta(skimfile)["nentries"] for skimfile in self.infiles)
+
+    def __iter__(self):
+        entry_offset = 0
+        for skimfile in self.infiles :
+            if self.entry_stop is not None and entry_offset >= self.entry_stop :
+                break
+            with np.load(skimfile) as skim :
+                meta   = json.loads(str(skim["meta"]))
+                jagged = meta["jagged"]
+                for treename, names in self.branches.items() :
+                    missing = [ name for name in names if f"{treename}/{name}" not in skim ]
+                    if missing :
+                        raise ValueError(f"{skimfile} does not hold {treename} branches {missing}")
+                arrays = { key : skim[key] for key in skim.files if key != "meta" }
+
+            nentries = meta["nentries"]
+            offsets  = { treename : np.concatenate([[0], np.cumsum(arrays[f"{treename}/@counts"])])
+                         for treename in jagged if treename in self.branches }
+            last     = nentries if self.entry_stop is None else min(nentries, self.entry_stop - entry_offset)
+            for start in range(max(0, self.entry_start - entry_offset), last, self.chunk_size) :
+                stop = min(start + self.chunk_size, last)
+                columns = {}
+                counts  = {}
+                for treename, names in self.branches.items() :
+                    if treename in offsets :
+                        cfirst, clast = offsets[treename][start], offsets[treename][stop]
+                        columns[treename] = { name : arrays[f"{treename}/{name}"][cfirst:clast] for name in names }
+                        counts[treename]  = arrays[f"{treename}/@counts"][start:stop]
+                    else :
+                        columns[treename] = { name : arrays[f"{treename}/{name}"][start:stop] for name in names }
+                yield NCQE_Chunk(entry_offset + start, stop - start, columns, counts)
+            entry_offset += nentries
+
+
+def _concatenate(arrays):
+    # Zero-padded variable-size arrays (e.g. pnu[npar]) may have a different width in each chunk
+    if len(arrays) == 0 :
+        return np.zeros(0)
+    if arrays[0].ndim == 2 :
+        width  = max(array.shape[1] for array in arrays)
+        arrays = [ np.pad(array, ((0, 0), (0, width - array.shape[1]))) for array in arrays ]
+    return np.concatenate(arrays)
@@ -1,9 +1,47 @@
 import ROOT
-from array import array
+import numpy as np
+
+from NCQE_Layout import tree_branches, tree_nfloat
+
+# Compression algorithms of ROOT::RCompressionSetting::EAlgorithm
+COMPRESSION = { "zlib" : 1, "lzma" : 2, "lz4" : 4, "zstd" : 5 }
+
+# Bulk fill of a chunk of events: copies each row of the column arrays into the
+# branch buffers and fills the tree, in one compiled loop instead of one Python call per event
+ROOT.gInterpreter.Declare("""
+void ncqe_bulk_fill(TTree* tree, const float* fcols, const int* icols, float* fbuf, int* ibuf,
+                    long nfloat, long nint, long nrows)
+{
+    for (long irow = 0; irow < nrows; ++irow) {
+        for (long icol = 0; icol < nfloat; ++icol) fbuf[icol] = fcols[icol * nrows + irow];
+        for (long icol = 0; icol < nint;   ++icol) ibuf[icol] = icols[icol * nrows + irow];
+        tree->Fill();
+    }
+}
+""")
+
+
+def compression_setting(text):
+    """
+    Returns the ROOT compression setting (100 x algorithm + level) of "algorithm:level",
+    e.g. "zstd:5" -> 505, "lz4:4" -> 404.
+    """
+    algorithm, _, level = text.partition(":")
+    if algorithm not in COMPRESSION or not level.isdigit() or not 0 <= int(level) <= 9 :
+        raise ValueError(f"Bad compression {text}: expected algorithm:level with algorithm in "
+                         f"{', '.join(COMPRESSION)} and level in 0-9")
+    return 100 * COMPRESSION[ algorithm ] + int(level)
+
 
 class NCQE__mc:
 
-    def __init__(self, filename="ncqe_selected_mc.root", treename="NCQETree", title="selected T2K NCQE MC"):
+    # Branches of the tree, in the fill() argument order (float branches first)
+    branches = tree_branches
+    nfloat   = tree_nfloat
+    kind     = "tree"   # key of its checkpoint() state
+
+    def __init__(self, filename="ncqe_selected_mc.root", treename="NCQETree", title="selected T2K NCQE MC",
+                 attach=False, basket_size=None, compression=None, autoflush=None, resume=None):
         """
         Initializes the EventTreeWriter by creating a ROOT file and TTree, and defining branches.
 
@@ -11,36 +49,66 @@ class NCQE__mc:
         - filename (str): Name of the output ROOT file.
         - treename (str): Name of the TTree.
         - title (str): Title of the TTree.
+        - attach (bool): Create the output file now and write the baskets into it while filling
+          (flat memory use), instead of keeping the tree in memory until it is written.
+        - basket_size (int): Basket size of every branch [bytes] (default: ROOT default).
+        - compression (int): ROOT compression setting of the file, see compression_setting
+          (default: ROOT default).
+        - autoflush (int): Entries (> 0) or bytes (< 0) between two flushes of the baskets
+          (default: ROOT default).
+        - resume (dict): checkpoint() state of the attached tree of an interrupted run: the tree
+          is reopened from filename at that state and filled after its last entry.
         """
-        #Create the output ROOT file
-        #self.file = ROOT.TFile(filename, "RECREATE")
-        #if self.file.IsZombie():
-        #    raise IOError(f"Could not create ROOT file: {filename}")
-        
+        # Create the output ROOT file
+        self.file  = None
+        self.cycle = None   # header cycle of the last checkpoint()
+        if resume is not None :
+            self._reopen(filename, treename, resume)
+        elif attach :
+            if compression is None :
+                self.file = ROOT.TFile(filename, "RECREATE")
+            else :
+                self.file = ROOT.TFile(filename, "RECREATE", "", compression)
+            if self.file.IsZombie():
+                raise IOError(f"Could not create ROOT file: {filename}")
+            self.file.cd()
+
         # Create the TTree
-        self.tree = ROOT.TTree(treename, title)
-
-        # Initialize branch variables as arrays
-        self.enu      = array('f', [0.0])  # nu energy [MeV]
-        self.erec     = array('f', [0.0])  # visible energy [MeV]
-        self.dwall    = array('f', [0.0])  # dwall [cm]
-        self.effwall  = array('f', [0.0])  # effwall [cm]
-        self.ovaq     = array('f', [0.0])  # ovaQ [arb]
-        self.angle    = array('f', [0.0])  # Cherenkov angle [degree]
-        self.pos_x    = array('f', [0.0])  # Bonsai Vertex X [m]
-        self.pos_y    = array('f', [0.0])  # Bonsai Vertex Y [m]
-        self.pos_z    = array('f', [0.0])  # Bonsai Vertex Z [m]
-        self.pos_r2   = array('f', [0.0])  # Radius squared [m^2]
-        self.posvx    = array('f', [0.0])  # MC truth Vertex X [m]
-        self.posvy    = array('f', [0.0])  # MC truth Vertex Y [m]
-        self.posvz    = array('f', [0.0])  # MC truth Vertex Z [m]
-        self.bdir_x   = array('f', [0.0])  # Bonsai Direction X
-        self.bdir_y   = array('f', [0.0])  # Bonsai Direction Y
-        self.bdir_z   = array('f', [0.0])  # Bonsai Direction Z
-        self.cosb     = array('f', [0.0])  # Cosine of angle
-        self.Ntrue    = array('i', [0])     # MC truth Nmulti
-        self.Ntaggable= array('i', [0])     # Pre-selection NMulti
-        self.Ntagged  = array('i', [0])     # NN-selected Nmulti
+        if resume is None :
+            self.tree = ROOT.TTree(treename, title)
+        if attach or resume is not None :
+            # histograms booked later stay in memory
+            ROOT.gROOT.cd()
+
+        # Initialize branch variables as views of one float and one integer buffer
+        self.fvalues  = np.zeros(self.nfloat, dtype=np.float32)
+        self.ivalues  = np.zeros(len(self.branches) - self.nfloat, dtype=np.int32)
+        self.enu      = self.fvalues[0:1]    # nu energy [MeV]
+        self.erec     = self.fvalues[1:2]    # visible energy [MeV]
+        self.dwall    = self.fvalues[2:3]    # dwall [cm]
+        self.effwall  = self.fvalues[3:4]    # effwall [cm]
+        self.ovaq     = self.fvalues[4:5]    # ovaQ [arb]
+        self.angle    = self.fvalues[5:6]    # Cherenkov angle [degree]
+        self.pos_x    = self.fvalues[6:7]    # Bonsai Vertex X [m]
+        self.pos_y    = self.fvalues[7:8]    # Bonsai Vertex Y [m]
+        self.pos_z    = self.fvalues[8:9]    # Bonsai Vertex Z [m]
+        self.pos_r2   = self.fvalues[9:10]   # Radius squared [m^2]
+        self.posvx    = self.fvalues[10:11]  # MC truth Vertex X [m]
+        self.posvy    = self.fvalues[11:12]  # MC truth Vertex Y [m]
+        self.posvz    = self.fvalues[12:13]  # MC truth Vertex Z [m]
+        self.bdir_x   = self.fvalues[13:14]  # Bonsai Direction X
+        self.bdir_y   = self.fvalues[14:15]  # Bonsai Direction Y
+        self.bdir_z   = self.fvalues[15:16]  # Bonsai Direction Z
+        self.cosb     = self.fvalues[16:17]  # Cosine of angle
+        self.Ntrue    = self.ivalues[0:1]    # MC truth Nmulti
+        self.Ntaggable= self.ivalues[1:2]    # Pre-selection NMulti
+        self.Ntagged  = self.ivalues[2:3]    # NN-selected Nmulti
+
+        if resume is not None :
+            # The reopened tree has the branches already
+            for branch in self.branches :
+                self.tree.SetBranchAddress(branch, getattr(self, branch))
+            return
 
         # Create branches in the TTree
         self.tree.Branch("enu", self.enu, "enu/F")
@@ -64,6 +132,11 @@ class NCQE__mc:
         self.tree.Branch("Ntaggable", self.Ntaggable, "Ntaggable/I")
         self.tree.Branch("Ntagged", self.Ntagged, "Ntagged/I")
 
+        if basket_size is not None :
+            self.tree.SetBasketSize("*", basket_size)
+        if autoflush is not None :
+            self.tree.SetAutoFlush(autoflush)
+
     def fill(self, enu, erec, dwall, effwall, ovaq, angle,
              pos_x, pos_y, pos_z, pos_r2, posvx, posvy, posvz,
              bdir_x, bdir_y, bdir_z, cosb, Ntrue, Ntaggable, Ntagged):
@@ -101,3 +174,81 @@ class NCQE__mc:
         # Fill the tree with the current event's data
         self.tree.Fill()
 
+    def fill_arrays(self, columns):
+        """
+        Fills the TTree with a chunk of events at once.
+
+        Parameters:
+        - columns (list): The arrays of the branches (one value per event), in the fill() argument order.
+          Extra columns after the branches (e.g. weight, channel and flavor) are ignored.
+        """
+        nrows = len(columns[0])
+        if nrows == 0 :
+            return
+        fcols = np.array(columns[:self.nfloat], dtype=np.float32)
+        icols = np.array(columns[self.nfloat:len(self.branches)], dtype=np.int32)
+        ROOT.ncqe_bulk_fill(self.tree, fcols, icols, self.fvalues, self.ivalues,
+                            len(fcols), len(icols), nrows)
+
+    def _reopen(self, filename, treename, resume):
+        """
+        Opens the output file of an interrupted run and gets the tree header of its checkpoint.
+        The baskets written after the checkpoint are not referenced by that header and stay unused.
+        """
+        self.file = ROOT.TFile(filename, "UPDATE")
+        if self.file.IsZombie() or self.file.GetEND() < resume["offset"] :
+            raise IOError(f"Could not reopen {filename} at its checkpoint (offset {resume['offset']})")
+        self.tree = self.file.Get(f"{treename};{resume['cycle']}")
+        if not self.tree or self.tree.GetEntries() != resume["entries"] :
+            raise IOError(f"{filename} does not hold the {treename} of the checkpoint "
+                          f"({resume['entries']} entries, cycle {resume['cycle']})")
+        self.cycle = resume["cycle"]
+        self._delete_cycles(keep=(self.cycle,))
+
+    def _delete_cycles(self, keep=()):
+        """
+        Deletes the header cycles of the tree in the output file, except the keep ones.
+        """
+        for key in list(self.file.GetListOfKeys()) :
+            if key.GetName() == self.tree.GetName() and key.GetCycle() not in keep :
+                key.Delete()
+
+    def checkpoint(self):
+        """
+        Writes the baskets and a new header cycle of the attached tree, so that the output file
+        holds every entry filled so far, and returns its state for NCQE__mc(resume=...):
+        entries, header cycle and end of the file. The header of the previous checkpoint is kept
+        until the next one, in case the run stops before the new state is saved.
+        """
+        self.tree.SetAutoSave(0)   # no header cycles of ROOT between two checkpoints
+        self.tree.FlushBaskets()
+        self.file.cd()
+        self.tree.Write()
+        ROOT.gROOT.cd()
+        cycle = max(key.GetCycle() for key in self.file.GetListOfKeys() if key.GetName() == self.tree.GetName())
+        self._delete_cycles(keep=(cycle, self.cycle))
+        self.cycle = cycle
+        self.file.SaveSelf(True)
+        self.file.Flush()
+        return { "entries" : int(self.tree.GetEntries()), "cycle" : int(cycle), "offset" : int(self.file.GetEND()) }
+
+    def write(self):
+        """
+        Writes the TTree (header and remaining baskets) into the output file, or into the
+        current directory if the tree is not attached to a file.
+        """
+        if self.file is not None :
+            self.file.cd()
+            # one header: drop the ones of the checkpoints and of the ROOT autosaves
+            self._delete_cycles()
+            self.tree.Write()
+            return
+        self.tree.Write("", ROOT.TObject.kOverwrite)
+
+    def close(self):
+        """
+        Closes the output file of an attached tree (after write()).
+        """
+        if self.file is not None :
+            self.file.Close()
+            self.file = None
@@ -1,15 +1,19 @@
-from collections import defaultdict
-from ROOT import TFile
+import numpy as np
 import os
 
+from T2K_FluxCache import tune_flavors, Lazy_Mapping, Flux_Tune_Cache, read_tune_hists
+
 class T2K:
-    def __init__(self, anamode):
+    def __init__(self, anamode, flux_cache=None):
+        ## flux_cache: local flux tune cache directory (see T2K_FluxCache, "" to read the ROOT files)
+        self.flux_cache = flux_cache
         self.L, self.osca, self.oscb, self.deltam32 = self._set_osc_para()
         self.nudir = self._set_nudir()
 
         self.anamode = int(anamode)
         self.ncel_scales = self._set_ncel_scales()
         self.runs, self.fluxtunes = self._set_fluxtune()
+        self.flux_tables = self._set_flux_tables()
         self.pot = { #---- FHC ----
                      "1": 0.32675e20,
                      "2": 1.12206e20,
@@ -40,14 +44,18 @@ class T2K:
  
     def _set_osc_para(self):
         ## Neutrino oscillation parameters (taken from T2K-TN-367)
-        L = 295.             # baseline [km]
-        sinth13  = 0.0211    # sin^2(theta_13) with reactor constraint
+        return self.osc_para()
+
+    def osc_para(self, sinth13=0.0211, sinth23=0.541, deltam32=2.469e-3, L=295.):
+        ## (L, osca, oscb, deltam32) of an oscillation hypothesis, nominal by default
+        ## sinth13 : sin^2(theta_13) with reactor constraint
+        ## sinth23 : sin^2(theta_23)
+        ## deltam32: (delta-m32)^2 in normal hierarchy
+        ## L       : baseline [km]
         sin2th13 = 4. * sinth13 * ( 1. - sinth13 )
-        sinth23  = 0.541     # sin^2(theta_23)
         sin2th23 = 4. * sinth23 * ( 1. - sinth23 )
         osca = sin2th13 * sinth23
         oscb = (( 1. - sinth13 ) ** 2) * sin2th23
-        deltam32 = 2.469e-3  # (delta-m32)^2 in normal hierarchy
         return L, osca, oscb, deltam32
 
     def _set_nudir(self):
@@ -62,6 +70,54 @@ class T2K:
         else:
             raise ValueError(f"Unknown anamode: {self.run_number}")
 
+    def run_weights(self, fileType, enu, n_gen):
+        ## Event weights in each run of self.runs, shape (len(enu), len(self.runs))
+        ## The weight over all runs is the sum, so an event is filled only once
+        enu = np.asarray(enu, dtype=np.float64)
+        wgts = np.empty((len(enu), len(self.runs)))
+        for irun, run in enumerate(self.runs) :
+            wgts[:, irun] = self.ncel_scales[ fileType ] * self.pot[ run ] / (n_gen)
+            if fileType in self.flux_tables[ run ] :
+                wgts[:, irun] *= self.flux_weight( run, fileType, enu )
+        return wgts
+
+    def flux_weight(self, run, flavor, enu):
+        ## Flux tuning ratio for an array of neutrino energies
+        ## Same bin as TH1::FindFixBin, including under/overflow (and NaN -> overflow)
+        table = self.flux_tables[ run ][ flavor ]
+        enu   = np.asarray(enu, dtype=np.float64)
+        xmin, xmax, nbins = table["xmin"], table["xmax"], table["nbins"]
+        inside = ( enu >= xmin ) & ( enu < xmax )
+        if table["fixed"] :
+            ibin = 1 + ((enu[inside] - xmin) * nbins / (xmax - xmin)).astype(np.int64)
+        else :
+            ibin = np.searchsorted(table["edges"], enu[inside], side="right")
+        bins = np.full(len(enu), nbins + 1, dtype=np.int64)
+        bins[inside] = ibin
+        bins[enu < xmin] = 0
+        return table["contents"][bins]
+
+    def _set_flux_tables(self):
+        ## NumPy copy of every flux tune histogram (bin edges, contents incl. under/overflow)
+        ## Taken from the local cache (filled on first use) when a run and flavor is first needed
+        cache = Flux_Tune_Cache( self.flux_cache )
+        return Lazy_Mapping( self.runs, lambda run: cache.tables( self.tunefiles[ run ], self.tunehists ) )
+
+    def warm_flux_cache(self):
+        ## Loads the flux tune tables of every run and flavor, filling the local cache
+        for run in self.runs :
+            for flavor in self.flux_tables[ run ] :
+                self.flux_tables[ run ][ flavor ]
+
+    def osc_prob(self, enu, osc_para=None):
+        ## numu -> nue and numu -> numu oscillation probabilities for an array of energies
+        ## osc_para: (L, osca, oscb, deltam32) of another hypothesis (see osc_para)
+        L, osca, oscb, deltam32 = osc_para if osc_para is not None else ( self.L, self.osca, self.oscb, self.deltam32 )
+        sin2 = np.sin( 1.267 * deltam32 * L / np.asarray(enu, dtype=np.float64) ) ** 2
+        pmutoe  = osca * sin2
+        pmutomu = 1. - ( oscb + osca ) * sin2
+        return pmutoe, pmutomu
+
     def _set_ncel_scales(self):
         ## MC scale mode
         # - 1: Flux 11b; tuning v3.1/3.2 + NEUT 5.3.3; MDLQE = 22; CCQE 2p2h on
@@ -127,16 +183,7 @@ class T2K:
                           "3c" : "sk_tuned11bv3.1_11anom_run3c_fine.root",
                           "4"  : "sk_tuned11bv3.2_11anom_run4_fine.root"
                         }
-            fluxtunes = defaultdict(dict)
-            for run in runs :
-                fluxtune = TFile( os.path.join( fluxdir, tunefiles[ run ] ) )
-                fluxtunes[ run ][ "numu" ]          = fluxtune.Get( "enu_sk_tuned11b_numu_ratio" )
-                fluxtunes[ run ][ "nue_x_numuflx" ] = fluxtune.Get( "enu_sk_tuned11b_numu_ratio" )
-                fluxtunes[ run ][ "numubar" ]       = fluxtune.Get( "enu_sk_tuned11b_numub_ratio" )
-                fluxtunes[ run ][ "nue" ]           = fluxtune.Get( "enu_sk_tuned11b_nue_ratio" )
-                fluxtunes[ run ][ "nuebar" ]        = fluxtune.Get( "enu_sk_tuned11b_nueb_ratio" )
-                for hist in fluxtunes[ run ].values() :
-                    hist.SetDirectory( 0 )
+            histname = "enu_sk_tuned11b_{}_ratio"
         # Run1-9; Flux 13a tuning v3.0 (thin target) FHC
         elif self.anamode == 2 :
             runs = [ "1", "2", "3b", "3c", "4", "5a", "5b", "6a", "6f", "7a", "7c", "8", "9a" ]
@@ -156,16 +203,7 @@ class T2K:
                           "9a" : "sk_tuned13av3_13anom_run9a_numode_fine.root"
                         }
              
-            fluxtunes = defaultdict(dict)
-            for run in runs :
-                fluxtune = TFile( os.path.join( fluxdir, tunefiles[ run ] ) )
-                fluxtunes[ run ][ "numu" ]          = fluxtune.Get( "enu_sk_tuned13a_numu_ratio" )
-                fluxtunes[ run ][ "nue_x_numuflx" ] = fluxtune.Get( "enu_sk_tuned13a_numu_ratio" )
-                fluxtunes[ run ][ "numubar" ]       = fluxtune.Get( "enu_sk_tuned13a_numub_ratio" )
-                fluxtunes[ run ][ "nue" ]           = fluxtune.Get( "enu_sk_tuned13a_nue_ratio" )
-                fluxtunes[ run ][ "nuebar" ]        = fluxtune.Get( "enu_sk_tuned13a_nueb_ratio" )
-                for hist in fluxtunes[ run ].values() :
-                    hist.SetDirectory( 0 )
+            histname = "enu_sk_tuned13a_{}_ratio"
         
         # Run1-9; Flux 13a tuning v3.0 (thin target) RHC
         elif self.anamode == 3 :
@@ -182,16 +220,7 @@ class T2K:
                           "9d" : "sk_tuned13av3_13anom_run9d_antinumode_fine.root"
                         }
             #
-            fluxtunes = defaultdict(dict)
-            for run in runs :
-                fluxtune = TFile( os.path.join( fluxdir, tunefiles[ run ] ) )
-                fluxtunes[ run ][ "numu" ]          = fluxtune.Get( "enu_sk_tuned13a_numu_ratio" )
-                fluxtunes[ run ][ "nue_x_numuflx" ] = fluxtune.Get( "enu_sk_tuned13a_numu_ratio" )
-                fluxtunes[ run ][ "numubar" ]       = fluxtune.Get( "enu_sk_tuned13a_numub_ratio" )
-                fluxtunes[ run ][ "nue" ]           = fluxtune.Get( "enu_sk_tuned13a_nue_ratio" )
-                fluxtunes[ run ][ "nuebar" ]        = fluxtune.Get( "enu_sk_tuned13a_nueb_ratio" )
-                for hist in fluxtunes[ run ].values() :
-                    hist.SetDirectory( 0 )
+            histname = "enu_sk_tuned13a_{}_ratio"
         
         # Run1-9; Flux 13a tuning v4.0 (reprica target) FHC
         elif self.anamode == 4 :
@@ -212,16 +241,7 @@ class T2K:
                           "9a" : "sk_tuned13av4_13anom_run9a_numode_fine.root"
                         }
             #
-            fluxtunes = defaultdict(dict)
-            for run in runs :
-                fluxtune = TFile( os.path.join( fluxdir, tunefiles[ run ] ) )
-                fluxtunes[ run ][ "numu" ]          = fluxtune.Get( "enu_sk_tuned13a_numu_ratio" )
-                fluxtunes[ run ][ "nue_x_numuflx" ] = fluxtune.Get( "enu_sk_tuned13a_numu_ratio" )
-                fluxtunes[ run ][ "numubar" ]       = fluxtune.Get( "enu_sk_tuned13a_numub_ratio" )
-                fluxtunes[ run ][ "nue" ]           = fluxtune.Get( "enu_sk_tuned13a_nue_ratio" )
-                fluxtunes[ run ][ "nuebar" ]        = fluxtune.Get( "enu_sk_tuned13a_nueb_ratio" )
-                for hist in fluxtunes[ run ].values() :
-                    hist.SetDirectory( 0 )
+            histname = "enu_sk_tuned13a_{}_ratio"
         
         # Run1-9; Flux 13a tuning v4.0 (reprica target) RHC
         elif self.anamode == 5 :
@@ -238,16 +258,7 @@ class T2K:
                           "9d" : "sk_tuned13av4_13anom_run9d_antinumode_fine.root",
                         }
             #
-            fluxtunes = defaultdict(dict)
-            for run in runs :
-                fluxtune = TFile( os.path.join( fluxdir, tunefiles[ run ] ) )
-                fluxtunes[ run ][ "numu" ]          = fluxtune.Get( "enu_sk_tuned13a_numu_ratio" )
-                fluxtunes[ run ][ "nue_x_numuflx" ] = fluxtune.Get( "enu_sk_tuned13a_numu_ratio" )
-                fluxtunes[ run ][ "numubar" ]       = fluxtune.Get( "enu_sk_tuned13a_numub_ratio" )
-                fluxtunes[ run ][ "nue" ]           = fluxtune.Get( "enu_sk_tuned13a_nue_ratio" )
-                fluxtunes[ run ][ "nuebar" ]        = fluxtune.Get( "enu_sk_tuned13a_nueb_ratio" )
-                for hist in fluxtunes[ run ].values() :
-                    hist.SetDirectory( 0 )
+            histname = "enu_sk_tuned13a_{}_ratio"
           
         # Run11; Flux 21b tuning v2.0 (reprica target) FHC
         elif self.anamode == 6 :
@@ -255,16 +266,7 @@ class T2K:
             fluxdir = "/disk02/usr7/licheng/SK/ncgamma/ncqeana/selection/Macro/T2KFlux"
             tunefiles = { "11" : "sk_tuned21bv2_13anom_run11_numode_fine.root"}
             #
-            fluxtunes = defaultdict(dict)
-            for run in runs :
-                fluxtune = TFile( os.path.join( fluxdir, tunefiles[ run ] ) )
-                fluxtunes[ run ][ "numu" ]          = fluxtune.Get( "enu_sk_tuned21b_numu_ratio" )
-                fluxtunes[ run ][ "nue_x_numuflx" ] = fluxtune.Get( "enu_sk_tuned21b_numu_ratio" )
-                fluxtunes[ run ][ "numubar" ]       = fluxtune.Get( "enu_sk_tuned21b_numub_ratio" )
-                fluxtunes[ run ][ "nue" ]           = fluxtune.Get( "enu_sk_tuned21b_nue_ratio" )
-                fluxtunes[ run ][ "nuebar" ]        = fluxtune.Get( "enu_sk_tuned21b_nueb_ratio" )
-                for hist in fluxtunes[ run ].values() :
-                    hist.SetDirectory( 0 )
+            histname = "enu_sk_tuned21b_{}_ratio"
 
         # Run10; Temporary take Run 9 setting
         elif self.anamode == 7 :
@@ -274,19 +276,15 @@ class T2K:
                           "10b" : "sk_tuned13av4_13anom_run9a_numode_fine.root"
                         }
             #
-            fluxtunes = defaultdict(dict)
-            for run in runs :
-                fluxtune = TFile( os.path.join( fluxdir, tunefiles[ run ] ) )
-                fluxtunes[ run ][ "numu" ]          = fluxtune.Get( "enu_sk_tuned13a_numu_ratio" )
-                fluxtunes[ run ][ "nue_x_numuflx" ] = fluxtune.Get( "enu_sk_tuned13a_numu_ratio" )
-                fluxtunes[ run ][ "numubar" ]       = fluxtune.Get( "enu_sk_tuned13a_numub_ratio" )
-                fluxtunes[ run ][ "nue" ]           = fluxtune.Get( "enu_sk_tuned13a_nue_ratio" )
-                fluxtunes[ run ][ "nuebar" ]        = fluxtune.Get( "enu_sk_tuned13a_nueb_ratio" )
-                for hist in fluxtunes[ run ].values() :
-                    hist.SetDirectory( 0 )
+            histname = "enu_sk_tuned13a_{}_ratio"
         
         else :
             raise ValueError(f"Analysis mode {self.anamode} not found.")
+
+        self.tunefiles = { run : os.path.join( fluxdir, tunefiles[ run ] ) for run in runs }
+        self.tunehists = { flavor : histname.format( suffix ) for flavor, suffix in tune_flavors.items() }
+        ## Tune histograms of a run are only read on first use (by the TChain loop)
+        fluxtunes = Lazy_Mapping( runs, lambda run: read_tune_hists( self.tunefiles[ run ], self.tunehists ) )
         return runs, fluxtunes
 
 
@@ -0,0 +1,204 @@
+#!/usr/bin/python
+#------------------------------------------------------------------------------
+#  Local cache of the T2K flux tune histograms as NumPy tables.
+#  Pre-warm once per node:  python T2K_FluxCache.py -a 4 -a 6
+#------------------------------------------------------------------------------
+import os
+import sys
+import json
+import getpass
+import hashlib
+import tempfile
+from collections.abc import Mapping
+from optparse import OptionParser
+import numpy as np
+
+# Flavor keys of the flux tune of each run and the histogram flavor they read
+tune_flavors = { "numu"          : "numu",
+                 "nue_x_numuflx" : "numu",
+                 "numubar"       : "numub",
+                 "nue"           : "nue",
+                 "nuebar"        : "nueb" }
+
+
+def default_cache_dir():
+    """
+    Node-local cache directory, $NCQE_FLUX_CACHE if set ("" disables the cache).
+    """
+    return os.environ.get("NCQE_FLUX_CACHE",
+                          os.path.join(tempfile.gettempdir(), f"ncqe_flux_cache_{getpass.getuser()}"))
+
+
+class Lazy_Mapping(Mapping):
+
+    def __init__(self, keys, load):
+        """
+        Read-only mapping whose values are loaded on first access.
+
+        Parameters:
+        - keys (iterable): Keys of the mapping, known without loading anything.
+        - load (function): Returns the value of a key.
+        """
+        self._keys   = list(keys)
+        self._load   = load
+        self._values = {}
+
+    def __getitem__(self, key):
+        if key not in self._values :
+            if key not in self._keys :
+                raise KeyError(key)
+            self._values[key] = self._load(key)
+        return self._values[key]
+
+    def __contains__(self, key):
+        return key in self._keys
+
+    def __iter__(self):
+        return iter(self._keys)
+
+    def __len__(self):
+        return len(self._keys)
+
+
+def hist_table(hist):
+    """
+    Returns the NumPy copy of a flux tune histogram (bin edges, contents incl. under/overflow).
+    """
+    axis  = hist.GetXaxis()
+    nbins = axis.GetNbins()
+    return { "nbins"    : nbins,
+             "xmin"     : axis.GetXmin(),
+             "xmax"     : axis.GetXmax(),
+             "fixed"    : not axis.IsVariableBinSize(),
+             "edges"    : np.array([ axis.GetBinLowEdge(ibin) for ibin in range(1, nbins + 2) ]),
+             "contents" : np.array([ hist.GetBinContent(ibin) for ibin in range(0, nbins + 2) ]) }
+
+
+def read_tune_hists(tunefile, histnames):
+    """
+    Reads the flux tune histograms {flavor: histogram name} of one tune file (one TFile open).
+    """
+    from ROOT import TFile
+    fluxtune = TFile( tunefile )
+    hists = {}
+    for flavor, histname in histnames.items() :
+        hists[ flavor ] = fluxtune.Get( histname )
+        hists[ flavor ].SetDirectory( 0 )
+    fluxtune.Close()
+    return hists
+
+
+class Flux_Tune_Cache:
+
+    def __init__(self, cachedir=None):
+        """
+        Content-addressed cache of the flux tune tables of each tune file.
+
+        Parameters:
+        - cachedir (str): Cache directory (default: default_cache_dir()); "" reads the ROOT files directly.
+
+        tables/<sha256>.npz holds the tables of one tune file, named after their content;
+        index/<sha256 of source path, size, mtime and histogram names>.json points a tune file
+        to its tables, so a tune file replaced in place is read again.
+        Every file is written atomically, so concurrent jobs on a node can share the cache.
+        The tune files are only stat'ed (not opened) once they are in the cache.
+        """
+        self.cachedir = default_cache_dir() if cachedir is None else cachedir
+
+    def tables(self, tunefile, histnames):
+        """
+        Returns the lazily loaded {flavor: table} of a tune file (see hist_table).
+        """
+        if not self.cachedir :
+            hists = read_tune_hists(tunefile, histnames)
+            return { flavor : hist_table(hist) for flavor, hist in hists.items() }
+
+        tablefile = self._lookup(tunefile, histnames)
+        if tablefile is None :
+            tablefile = self.store(tunefile, histnames)
+        return Lazy_Mapping(histnames, lambda flavor: _load_table(tablefile, flavor))
+
+    def store(self, tunefile, histnames):
+        """
+        Extracts the tables of a tune file into the cache and returns the tables file.
+        """
+        indexfile = self._index_file(tunefile, histnames)   # of the file as it is before reading
+        hists  = read_tune_hists(tunefile, histnames)
+        arrays = {}
+        for flavor, hist in hists.items() :
+            for key, value in hist_table(hist).items() :
+                arrays[f"{flavor}/{key}"] = np.asarray(value)
+
+        sha = hashlib.sha256()
+        for key in sorted(arrays) :
+            sha.update(key.encode())
+            sha.update(arrays[key].tobytes())
+        tablefile = os.path.join(self.cachedir, "tables", sha.hexdigest() + ".npz")
+        if not os.path.exists(tablefile) :
+            _atomic_write(tablefile, lambda fout: np.savez(fout, **arrays))
+
+        index = { "source" : os.path.abspath(tunefile), "histnames" : histnames,
+                  "tables" : os.path.basename(tablefile) }
+        _atomic_write(indexfile, lambda fout: fout.write(json.dumps(index).encode()))
+        return tablefile
+
+    def _index_file(self, tunefile, histnames):
+        stat = os.stat(tunefile)
+        key  = json.dumps([ os.path.abspath(tunefile), stat.st_size, stat.st_mtime_ns, histnames ], sort_keys=True)
+        return os.path.join(self.cachedir, "index", hashlib.sha256(key.encode()).hexdigest() + ".json")
+
+    def _lookup(self, tunefile, histnames):
+        indexfile = self._index_file(tunefile, histnames)
+        if not os.path.exists(indexfile) :
+            return None
+        with open(indexfile) as fin :
+            index = json.load(fin)
+        tablefile = os.path.join(self.cachedir, "tables", index["tables"])
+        return tablefile if os.path.exists(tablefile) else None
+
+
+def _load_table(tablefile, flavor):
+    # The npz is opened for each flavor: no file handle is shared with forked workers
+    with np.load(tablefile) as tables :
+        table = { key : tables[f"{flavor}/{key}"] for key in ("nbins", "xmin", "xmax", "fixed", "edges", "contents") }
+    for key, cast in (("nbins", int), ("xmin", float), ("xmax", float), ("fixed", bool)) :
+        table[key] = cast(table[key])
+    return table
+
+
+def _atomic_write(path, write):
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    fd, tmp = tempfile.mkstemp(dir=os.path.dirname(path), suffix=".tmp")
+    try :
+        with os.fdopen(fd, "wb") as fout :
+            write(fout)
+        os.replace(tmp, path)
+    except BaseException :
+        # no partial file is left behind
+        os.remove(tmp)
+        raise
+
+
+def main():
+    #------------------------------------------------------------------------------
+    usage = "usage: %prog [options]"
+    parser = OptionParser( usage = usage )
+    parser.add_option("-a", "--anamode", type="int", action="append",
+                      dest="anamodes", default=[], metavar="N",
+                      help="Analysis mode whose flux tunes are cached (repeatable)")
+    parser.add_option("-d", "--cache-dir",
+                      dest="cachedir", default=default_cache_dir(), metavar="DIR",
+                      help="Cache directory (default: %default, or $NCQE_FLUX_CACHE)")
+    ( options, args ) = parser.parse_args()
+    if len(options.anamodes) == 0 :
+        parser.error("at least one --anamode is needed")
+
+    from T2K_Config import T2K
+    for anamode in options.anamodes :
+        t2k = T2K(anamode=anamode, flux_cache=options.cachedir)
+        t2k.warm_flux_cache()
+        print("Cached flux tunes of anamode", anamode, "runs", t2k.runs, "in", options.cachedir)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,630 @@
+#!/usr/bin/python
+#------------------------------------------------------------------------------
+#  T2K NCQE analysis code, inherited from numerous predecessors.
+#  Last updated by LiCheng FENG on December 7, 2024.
+#  Single entry point for SKDETSIM and SKG4 inputs: the branch naming is
+#  detected per input file (NCQE_Schema), so both can be mixed in one run.
+#------------------------------------------------------------------------------
+
+import sys
+import cProfile
+from collections import defaultdict
+from optparse import OptionParser
+from glob import glob
+from math import sin
+from math import sqrt
+import progressbar as pb
+import ROOT
+from ROOT import TFile, TH1F, TH1D, TH2D, TH1, TChain, TNamed
+
+from T2K_Config import *
+from NCQE_Cut import *
+from NCQE_Tree import *
+from NCQE_Gamma_Hist import *
+from NCQE_Neutron_Hist import *
+from NCQE_Output import *
+from NCQE_Schema import *
+from NCQE_Skim import *
+from NCQE_Engine import *
+from NCQE_Parallel import *
+from NCQE_Incremental import *
+from NCQE_Scan import *
+from NCQE_Reweight import *
+from NCQE_Checkpoint import *
+from NCQE_Shard import *
+from NCQE_Columnar import *
+from NCQE_Profile import *
+from NCQE_IOStats import *
+
+def parse(schema="auto", outHistFile="ncqe_histogram_mc.root", outmcFile="ncqe_selected_mc.root"):
+    #------------------------------------------------------------------------------
+    usage = "usage: %prog [options] infiles1 infiles2 ..."
+    parser = OptionParser( usage = usage )
+    # Add options
+    parser.add_option("-o", "--histOutputName",
+                      dest="outHistFile", default=outHistFile, metavar="FILE",
+                      help="Output ROOT filename for histogram (default: %(default)s)")
+    parser.add_option("-t", "--mcOutName",
+                      dest="outmcFile", default=outmcFile, metavar="FILE",
+                      help="Output ROOT filename for TTree (default: %(default)s)")
+    parser.add_option("-f", "--friend",
+                      dest="frienddir",   default="", metavar="DIR",
+                      help="Directory containing friend trees. Only used in MC mode.")
+    parser.add_option("-s", "--schema", type="choice", choices=["auto"] + list(SCHEMAS),
+                      dest="schema", default=schema,
+                      help="Input branch naming: auto (detected per file), SKDETSIM or SKG4 (default: %default)")
+    parser.add_option("--columnar", action="store_true",
+                      dest="columnar", default=False,
+                      help="Read the input trees in chunks of NumPy arrays instead of TChain.GetEntry")
+    parser.add_option("--chunk-size", type="int",
+                      dest="chunk_size", default=10000, metavar="N",
+                      help="Number of entries per chunk in columnar mode (default: %default)")
+    parser.add_option("--tree-basket-size", type="int",
+                      dest="tree_basket_size", default=None, metavar="BYTES",
+                      help="Basket size of the selected-event tree branches (default: ROOT default)")
+    parser.add_option("--tree-compression",
+                      dest="tree_compression", default="", metavar="ALGO:LEVEL",
+                      help="Compression of the selected-event file, e.g. zstd:5, lz4:4, zlib:1 (default: ROOT default)")
+    parser.add_option("--tree-autoflush", type="int",
+                      dest="tree_autoflush", default=None, metavar="N",
+                      help="Entries (N > 0) or bytes (N < 0) between two basket flushes of the selected-event tree "
+                           "(default: ROOT default)")
+    parser.add_option("--columns-out", dest="columns_out", default="", metavar="DIR",
+                      help="Also write the selected events (NCQETree fields, weight, channel and flavor) "
+                           "as memory-mappable NumPy columns in DIR, see NCQE_Columnar.load_columns (implies --columnar)")
+    parser.add_option("--candidates-out", dest="candidates_out", default="", metavar="DIR",
+                      help="Also write the NTag candidates of the selected events (NTag and computed features, "
+                           "label, event weight) as flat NumPy columns with per-event offsets in DIR (implies --columnar)")
+    parser.add_option("--profile", dest="profile", default="", metavar="FILE",
+                      help="Time the reading, selection, weighting, neutron and filling stages and write a JSON report "
+                           "(wall/CPU time per stage, events/s and candidates/s per flavor, peak RSS) to FILE")
+    parser.add_option("--cprofile", dest="cprofile", default="", metavar="FILE",
+                      help="Run the event loop under cProfile and dump its statistics to FILE (pstats format; "
+                           "main process only, the --jobs workers are not profiled)")
+    parser.add_option("--io-stats", dest="io_stats", default="", metavar="FILE",
+                      help="Write per-file and per-branch read statistics (bytes read and decompressed, read calls, "
+                           "basket re-reads, I/O vs Python time) to FILE as JSON; TTreePerfStats per chain in TChain mode")
+    parser.add_option("--run-breakdown", action="store_true",
+                      dest="run_breakdown", default=False,
+                      help="Columnar mode: also write the weighted yield of each run (hrun_* histograms)")
+    parser.add_option("-j", "--jobs", type="int",
+                      dest="jobs", default=1, metavar="N",
+                      help="Process the input files with N worker processes (implies --columnar)")
+    parser.add_option("--skim", dest="skimdir", default="", metavar="DIR",
+                      help="Write the entries of each input file passing the loose pre-cut to DIR and stop")
+    parser.add_option("--skim-precut", dest="skim_precut", default="", metavar="CUTS",
+                      help="Skim pre-cut, e.g. 'erec=3:35,dwall=150,effwall=150' (default: NCQE_Skim.default_precut)")
+    parser.add_option("--from-skim", action="store_true",
+                      dest="from_skim", default=False,
+                      help="Input files are skim files written with --skim (implies --columnar)")
+    parser.add_option("--flux-cache", dest="flux_cache", default=None, metavar="DIR",
+                      help="Local flux tune cache directory ('' reads the tune ROOT files directly; "
+                           "default: $NCQE_FLUX_CACHE or a directory in /tmp)")
+    parser.add_option("--output-spec", dest="output_spec", default="", metavar="FILE",
+                      help="JSON {family: [name pattern, ...]} of the histograms to produce, families "
+                           "gamma, neutron and neutronNN (default: NCQE_Output.default_output)")
+    parser.add_option("--incremental", dest="cachedir", default="", metavar="DIR",
+                      help="Keep per-file partial results in DIR and only process new or changed files "
+                           "(or files whose config changed); implies --columnar")
+    parser.add_option("--scan", dest="scan_grid", default="", metavar="FILE",
+                      help="JSON grid of aopt, bopt and dwall/effwall/ovaQ cut offsets evaluated "
+                           "in the same pass (implies --columnar)")
+    parser.add_option("--scan-report", dest="scan_report", default="ncqe_cut_scan.csv", metavar="FILE",
+                      help="CSV report of the cut scan, one line per grid point (default: %default)")
+    parser.add_option("--tagout-scan", dest="tagout_scan", default="", metavar="THRESHOLDS",
+                      help="Comma-separated TagOut thresholds, e.g. '0.5,0.6,0.7,0.8': tagged multiplicity "
+                           "histograms and Gd/H/Noise purities of the selected events per threshold (implies --columnar)")
+    parser.add_option("--osc-record", dest="osc_record", default="", metavar="FILE",
+                      help="Save the record of the filled events (enu, weight without oscillation, bins) "
+                           "to FILE for NCQE_Reweight.py (implies --columnar)")
+    parser.add_option("--osc-points", dest="osc_points", default="", metavar="FILE",
+                      help="JSON list of oscillation points whose histograms are also written "
+                           "to --osc-output (implies --columnar)")
+    parser.add_option("--osc-output", dest="osc_output", default="ncqe_histogram_osc.root", metavar="FILE",
+                      help="Histograms of the oscillation points, one directory per point (default: %default)")
+    parser.add_option("--checkpoint", dest="checkpoint", default="", metavar="FILE",
+                      help="Save the accumulated histograms, selected events and input position to FILE "
+                           "periodically (implies --columnar, serial only)")
+    parser.add_option("--checkpoint-every", type="float",
+                      dest="checkpoint_every", default=600., metavar="SECONDS",
+                      help="Minimum time between two checkpoints (default: %default)")
+    parser.add_option("--resume", action="store_true",
+                      dest="resume", default=False,
+                      help="Continue from the --checkpoint file of an interrupted run")
+    parser.add_option("--first-entry", type="int",
+                      dest="first_entry", default=0, metavar="N",
+                      help="First entry to process, counted over all input files in processing order (implies --columnar)")
+    parser.add_option("--num-entries", type="int",
+                      dest="num_entries", default=-1, metavar="N",
+                      help="Number of entries to process from --first-entry (default: all)")
+    parser.add_option("--shard", dest="shard", default="", metavar="i/N",
+                      help="Process shard i (0 <= i < N) of N: the shard of --shard-plan, or 1/N of the "
+                           "entries (implies --columnar)")
+    parser.add_option("--shard-plan", dest="shard_plan", default="", metavar="FILE",
+                      help="Shard plan written by NCQE_Shard.py; its files are the input files")
+    # Parse the arguments
+    ( options, args ) = parser.parse_args()
+    options.ranged = bool(options.first_entry or options.num_entries >= 0 or options.shard)
+    if options.shard_plan and not options.shard :
+        parser.error("--shard-plan needs --shard")
+    if options.shard and ( options.first_entry or options.num_entries >= 0 ) :
+        parser.error("--shard and --first-entry/--num-entries cannot be combined")
+    if options.ranged and ( options.jobs > 1 or options.cachedir or options.checkpoint ) :
+        parser.error("entry ranges and shards run in a single process, without --jobs, --incremental or --checkpoint")
+    if options.tree_compression :
+        try :
+            options.tree_compression = compression_setting(options.tree_compression)
+        except ValueError as error :
+            parser.error(str(error))
+    else :
+        options.tree_compression = None
+    if options.resume and not options.checkpoint :
+        parser.error("--resume needs --checkpoint")
+    if options.checkpoint and ( options.jobs > 1 or options.cachedir ) :
+        parser.error("--checkpoint runs in a single process, without --jobs or --incremental")
+    if options.jobs > 1 or options.from_skim or options.cachedir or options.scan_grid \
+       or options.osc_record or options.osc_points or options.tagout_scan or options.checkpoint \
+       or options.ranged or options.columns_out or options.candidates_out :
+        options.columnar = True
+    # Add '-b' option to sys.argv
+    sys.argv.append("-b")
+    # Start of the program logic
+    print("*** START OF PROGRAM ***")
+    print("Input files:", args)
+    print("Output histogram file:", options.outHistFile)
+    print("Output mc file:", options.outmcFile)
+
+    #------------------------------------------------------------------------------
+    # Group files if there are many
+    friendFiles = False
+
+    print ("*** Extract Input FILENAMES ***")
+    if options.shard_plan :
+        # the input files of the plan, in its order
+        groupedFiles, _ = plan_files( load_plan( options.shard_plan ) )
+    else :
+        groupedFiles = group_files( args )
+
+    if len( groupedFiles ) == 0 :
+        print ("Input MC files needed!")
+        sys.exit(2)
+
+    return groupedFiles, options
+
+    
+def main(schema="auto", outHistFile="ncqe_histogram_mc.root", outmcFile="ncqe_selected_mc.root"):
+
+    # access file list from I/O parse interface
+    groupedFiles, options = parse(schema, outHistFile, outmcFile)
+
+    # input branch naming of every file (SKDETSIM or SKG4)
+    if options.from_skim :
+        # also checks that the pre-cut of every skim keeps the selected events
+        schemas = skim_schemas(groupedFiles, options.schema)
+    elif options.shard_plan :
+        _, schemas = plan_files(load_plan(options.shard_plan))
+    else :
+        schemas = file_schemas(groupedFiles, options.schema)
+
+    # skim stage: only write the pre-selected entries of each input file
+    if options.skimdir :
+        write_skims(options.skimdir, groupedFiles, schemas, branch_manifest,
+                    parse_precut(options.skim_precut), options.chunk_size)
+        print("*** END OF PROGRAM ***")
+        return
+
+    # load T2K Setting
+    # Including Run, Oscillation, POT, Xsec, parameter... etc
+    t2k = T2K(anamode=6, flux_cache=options.flux_cache)
+    ncqe_cut = NCQE_Cut(run = 11, anamode = 6)
+    n_gen = 100*1000
+
+    # Initialize gamma and neutron histograms for "ncqe_histogram_mc.root" file
+    # Only the histograms of the output spec are booked (on first use), filled and written;
+    # on skims, not those of the stages before the pre-cut, which lack the events it drops
+    output = load_output_spec(options.output_spec)
+    skip_cuts = skim_incomplete_stages if options.from_skim else []
+    hist_gamma   = NCQE_Gamma_Histo(output["gamma"], skip_cuts=skip_cuts)
+    hist_neutron = NCQE_Neutron_Histo(output["neutron"], output["neutronNN"], skip_cuts=skip_cuts)
+
+    # Optional grid of cut variations, evaluated on the same events
+    # (efficiencies w.r.t. the events passing the fiducial volume on skims)
+    scan = NCQE_Cut_Scan(ncqe_cut, load_scan_grid(options.scan_grid),
+                         reference="wallfv" if options.from_skim else "nocut") if options.scan_grid else None
+    # Optional TagOut thresholds, evaluated on the candidates of the selected events
+    tag_scan = NCQE_TagOut_Scan(parse_thresholds(options.tagout_scan), ncqe_cut.channels) if options.tagout_scan else None
+
+    # Optional stage timers of the event loop
+    profiler = NCQE_Profiler(enabled=bool(options.profile))
+    # Columnar event loop; its selected-event outputs are attached once they are opened
+    if options.columnar :
+        engine = NCQE_Engine(t2k, ncqe_cut, hist_gamma, hist_neutron, None,
+                             n_gen=n_gen, chunk_size=options.chunk_size,
+                             run_breakdown=options.run_breakdown,
+                             from_skim=options.from_skim, scan=scan,
+                             osc_record=bool(options.osc_record or options.osc_points),
+                             tag_scan=tag_scan,
+                             candidate_record=bool(options.candidates_out),
+                             profiler=profiler,
+                             io_stats=bool(options.io_stats))
+
+    # A resumed run reopens the selected-event outputs of the interrupted one at its checkpoint,
+    # once the checkpoint is known to be of the same inputs and settings (before any output is touched)
+    resumed = None
+    if options.resume :
+        try :
+            resumed = resume_outputs(options.checkpoint, checkpoint_key(engine, file_tasks(groupedFiles, schemas)))
+        except ValueError as error :
+            sys.exit(str(error))
+    if resumed is not None :
+        kinds = { NCQE__mc.kind } | ( { NCQE_Column_Store.kind } if options.columns_out else set() ) \
+                                  | ( { NCQE_Candidate_Store.kind } if options.candidates_out else set() )
+        if set(resumed) != kinds :
+            sys.exit(f"Checkpoint {options.checkpoint} has the outputs {sorted(resumed)}, not {sorted(kinds)}")
+    resumed = resumed or {}
+
+    # Initialize NCQE Tree to save selected mc value in the "ncqe_fullinfo_mc.root" file
+    # The tree is attached to the file, its baskets are written while it is filled
+    NCQE_selected = NCQE__mc(filename=options.outmcFile,
+                                  treename="NCQETree",
+                                  title="selected T2K NCQE MC",
+                                  attach=True,
+                                  basket_size=options.tree_basket_size,
+                                  compression=options.tree_compression,
+                                  autoflush=options.tree_autoflush,
+                                  resume=resumed.get(NCQE__mc.kind))
+    # Optional column stores of the same selected events and of their neutron candidates
+    stores = []
+    if options.columns_out :
+        stores.append(NCQE_Column_Store(options.columns_out, ncqe_cut.channels, list(t2k.ncel_scales),
+                                        resume=resumed.get(NCQE_Column_Store.kind)))
+    if options.candidates_out :
+        stores.append(NCQE_Candidate_Store(options.candidates_out, resume=resumed.get(NCQE_Candidate_Store.kind)))
+    if stores :
+        NCQE_selected = NCQE_Selected_Outputs(NCQE_selected, *stores)
+    if options.columnar :
+        engine.selected = NCQE_selected
+
+    # Optional cProfile of the event loop
+    cprofile = cProfile.Profile() if options.cprofile else None
+    if cprofile is not None :
+        cprofile.enable()
+
+    # Optional I/O counters (of the columnar reader, or TTreePerfStats of the TChain loop)
+    io_stats = NCQE_IO_Stats() if options.io_stats and not options.columnar else None
+
+    ### process input MC files ###
+    if options.columnar :
+        if options.cachedir :
+            process_incremental(engine, groupedFiles, schemas, options.cachedir, options.jobs)
+        elif options.jobs > 1 :
+            process_parallel(engine, groupedFiles, schemas, options.jobs)
+        elif options.checkpoint :
+            process_checkpointed(engine, groupedFiles, schemas, options.checkpoint,
+                                 options.checkpoint_every, options.resume)
+        elif options.ranged :
+            process_ranges(engine, input_ranges(options, groupedFiles, schemas))
+        else :
+            for fileType, infiles in groupedFiles.items() :
+                for schema, files in split_by_schema(infiles, schemas).items() :
+                    engine.process(fileType, files, schema)
+    else :
+        for fileType, infiles in groupedFiles.items() :
+            for schema, files in split_by_schema(infiles, schemas).items() :
+                with profiler.stage("tchain_loop") :
+                    process_tchain(fileType, files, schema, t2k, ncqe_cut, n_gen,
+                                   NCQE_selected, hist_gamma, hist_neutron,
+                                   io_stats=io_stats)
+
+    if cprofile is not None :
+        cprofile.disable()
+        cprofile.dump_stats(options.cprofile)
+    if options.columnar :
+        io_stats = engine.io_stats
+    if io_stats is not None :
+        io_stats.print_report()
+        io_stats.write(options.io_stats)
+
+    if options.columnar :
+        engine.print_cutflow()
+    if scan is not None :
+        scan.print_report()
+        scan.write_report(options.scan_report)
+    if tag_scan is not None :
+        tag_scan.print_report()
+
+    # Settings of the outputs, checked by NCQE_Merge when partial outputs are merged
+    thresholds = tag_scan.thresholds.tolist() if tag_scan is not None else []
+    config = TNamed("ncqe_config", output_fingerprint(t2k, ncqe_cut, hist_gamma, hist_neutron, n_gen,
+                                                      run_breakdown=options.columnar and options.run_breakdown,
+                                                      tagout_scan=thresholds))
+
+    ### Write histograms to "ncqe_fullinfo_mc.root" ###
+    with profiler.stage("write_tree") :
+        NCQE_selected.write()
+        config.Write()
+        for store in stores :
+            store.config = config.GetTitle()
+        NCQE_selected.close()
+
+    ### Write histograms to "ncqe_histogram_mc.root" ###
+    with profiler.stage("write_hist") :
+        if options.columnar :
+            hist_gamma.update_histograms()
+            hist_neutron.update_histograms()
+        else :
+            hist_gamma.sum_stages()
+            hist_neutron.sum_stages()
+        fout = TFile(options.outHistFile, "RECREATE")
+        fout.cd()
+        hist_gamma.write()
+        hist_neutron.write()
+
+        if options.columnar and options.run_breakdown :
+            for hist in engine.run_breakdown_histograms() :
+                hist.Write()
+        if tag_scan is not None :
+            for hist in tag_scan.histograms() :
+                hist.Write()
+        config.Write()
+        fout.Close()
+
+    ### Oscillation record and re-weighted histograms ###
+    if options.osc_record :
+        save_record(options.osc_record, engine.reweighter, t2k.anamode, output, skip_cuts)
+    if options.osc_points :
+        write_osc_histograms(options.osc_output, engine.reweighter, load_osc_points(options.osc_points),
+                             hist_gamma, hist_neutron)
+
+    if options.profile :
+        profiler.print_report()
+        profiler.write(options.profile, columnar=options.columnar, jobs=options.jobs,
+                       chunk_size=options.chunk_size, inputs=sum(len(infiles) for infiles in groupedFiles.values()))
+
+    print("*** END OF PROGRAM ***")
+
+
+def input_ranges(options, groupedFiles, schemas):
+    """
+    Returns the (fileType, schema, infile, start, stop) file ranges selected by
+    --shard (with or without --shard-plan) or --first-entry/--num-entries.
+    """
+    if options.shard_plan :
+        ishard, nshards = parse_shard(options.shard)
+        plan = load_plan(options.shard_plan)
+        if len(plan["shards"]) != nshards :
+            raise ValueError(f"{options.shard_plan} has {len(plan['shards'])} shards, not {nshards}")
+        return shard_ranges(plan, ishard)
+
+    tasks   = file_tasks(groupedFiles, schemas)
+    entries = [ file_entries(infile, schema, options.from_skim) for fileType, schema, infile in tasks ]
+    total   = sum(entries)
+    if options.shard :
+        ishard, nshards = parse_shard(options.shard)
+        first, stop = ishard * total // nshards, (ishard + 1) * total // nshards
+    else :
+        first = options.first_entry
+        stop  = total if options.num_entries < 0 else min(total, first + options.num_entries)
+    print("Processing entries", first, "to", stop, "of", total)
+    return entry_ranges(tasks, entries, first, stop)
+
+
+def process_tchain(fileType, infiles, schema, t2k, ncqe_cut, n_gen, NCQE_selected, hist_gamma, hist_neutron,
+                   io_stats=None):
+    """
+    Reference event loop: reads the files of one flavor and schema entry by entry with TChain.GetEntry.
+    With io_stats (NCQE_IO_Stats), the reads of each chain are recorded with TTreePerfStats.
+    """
+    names = SCHEMAS[ schema ]
+    # define TChain and add trees from MC files
+    manifest = branch_manifest( schema )
+    mctree  = TChain( "h1")        #For ntuple tree, add prompt info
+    mctree1 = TChain( "event")     #For NTag, Nmulti info
+    mctree3 = TChain( "ntag")      #For NTag, NTagged detail
+    mctree2 = None                 #For NTag, NTaggable detail (only if a stage reads it)
+    if "taggable" in manifest :
+        mctree2 = TChain( "taggable")
+
+    # Add up all the input file and read only the branches in the manifest
+    for chain in (mctree, mctree1, mctree2, mctree3) :
+        if chain :
+            for infile in infiles :
+                chain.Add( infile )
+            set_branch_status( chain, manifest[ chain.GetName() ] )
+    chains = { "h1" : mctree, "event" : mctree1, "ntag" : mctree3 }
+    angle_tree, angle_branch = names[ "angle" ]
+    perfstats = {}
+    if io_stats is not None :
+        for chain in (mctree, mctree1, mctree2, mctree3) :
+            if chain :
+                perfstats[ chain.GetName() ] = ROOT.TTreePerfStats( "ioperf_" + chain.GetName(), chain )
+
+    # events failing an earlier stage do not enter any requested histogram
+    first_stage_neutron = hist_neutron.first_stage()
+    first_stage = min( hist_gamma.first_stage(), first_stage_neutron )
+
+    # get TChain entries
+    maxev = mctree.GetEntries()
+    print("Begin processing for", mctree.GetNtrees(), fileType, "files")
+ 
+    # set up the progress bar
+    widgets = [ 'Events: ', 
+                pb.Percentage(), ' ',
+                pb.Bar( marker = '=', left = '[', right = ']' ), ' ', 
+                pb.ETA() ]
+    pbar = pb.ProgressBar( widgets = widgets, maxval = maxev, term_width = 80 )
+    pbar.start()
+    print("")
+    progress = NCQE_Throttle(pbar)
+
+    ### loop over all event entries ###
+    for iev in range( maxev ) :
+        progress.update(iev)
+        mctree.GetEntry(iev)
+        mctree1.GetEntry(iev)
+        if mctree2 :
+            mctree2.GetEntry(iev)
+        mctree3.GetEntry(iev)
+        # Features
+        enu      = mctree.pnu[0]    # nu energy [MeV]
+        erec_org = mctree.erec      # bsenergy  [MeV]
+        erec     = erec_org - 0.51  # visible energy [MeV]
+        dwall    = mctree.wall      # dwall   [cm]
+        effwall  = mctree.effwall   # effwall [cm]
+        ovaq     = mctree.ovaq      # ovaQ    [arb]
+        angle    = getattr( chains[ angle_tree ], angle_branch ) # Cherenkov angle [degree]
+        # Bonsai Vertex
+        pos_x    = mctree.pos[0]/100  # [m]    
+        pos_y    = mctree.pos[1]/100  # [m]
+        pos_z    = mctree.pos[2]/100  # [m] 
+        pos_r2   = (pos_x*pos_x + pos_y*pos_y)  # Radiusi squre [m^2]
+        # MC truth Vertex
+        posvx    = mctree.posv[0]/100 # [m] 
+        posvy    = mctree.posv[1]/100 # [m]
+        posvz    = mctree.posv[2]/100 # [m]
+        # Bonsai Direction 
+        bdir_x   = mctree.bdir[0] 
+        bdir_y   = mctree.bdir[1]
+        bdir_z   = mctree.bdir[2]
+        cosb     = bdir_x*t2k.nudir[0] + bdir_y*t2k.nudir[1] + bdir_z*t2k.nudir[2]
+        #Neutron multiplicity info
+        Ntrue    = mctree1.NTrueN     # MC truth Nmulti
+        Ntaggable= mctree1.NTaggableN # Pre-selection NMulti
+        Ntagged  = mctree1.NTaggedN   # NN-selected Nmulti
+
+        # Place NCQE selection (last selection stage passed) and check channel
+        stage        = ncqe_cut.last_stage(erec, dwall, effwall, ovaq, angle)
+        is_ncq_event = stage == len(ncqe_cut.stages) - 1
+        interaction  = ncqe_cut.channel(getattr( mctree, names[ "neutmode" ] ))
+
+        ### Fill NCQE mc info into TTree (also when no histogram is requested)
+        if is_ncq_event :
+            NCQE_selected.fill( enu, erec, dwall, effwall, ovaq, angle, \
+                                pos_x, pos_y, pos_z, pos_r2, posvx, posvy, posvz, \
+                                bdir_x, bdir_y, bdir_z, cosb, Ntrue, Ntaggable, Ntagged )
+
+        if stage < first_stage :
+            continue
+        # The event is filled at its last stage only; sum_stages() adds it to the earlier ones
+        cutname = ncqe_cut.stages[ stage ]
+
+        ###################################################
+        # Access Neutron Tagging details from here
+        ###################################################
+        #
+        # Variable name in NTag Output (label_map, categories, nNN_in_NTag and
+        # the histogram name mappings are shared with the columnar engine)
+        n_in_NTag = names[ "n_in_NTag" ]
+        fv_div    = names[ "fv_div" ]
+
+        # Initialize dictionaries to hold neutron info
+        n_feature = {}
+        for feature in n_in_NTag:
+            n_feature[feature] = {}
+            for category in categories:
+                n_feature[feature][category] = []
+    
+        n_featureNN = {}
+        for feature in nNN_in_NTag:
+            n_featureNN[feature] = {}
+            for category in categories:
+                n_featureNN[feature][category] = []
+    
+        ### Loop over the NN candidates event info ###
+        Neutron_candi = int(mctree1.NCandidates) if stage >= first_stage_neutron else 0
+        for i in range( 0, Neutron_candi ) :
+            if (mctree3.TagOut[i] > 0.7):
+                # neutron direction are not included in NTag, calculated here  
+                ndir = n_dir(mctree3.fvx[i]/fv_div, mctree3.fvy[i]/fv_div, mctree3.fvz[i]/fv_div, pos_x, pos_y, pos_z)
+                n_gammacos = ndir[0]*bdir_x + ndir[1]*bdir_y + ndir[2]*bdir_z
+                n_beamcos  = ndir[0]*t2k.nudir[0] + ndir[1]*t2k.nudir[1] + ndir[2]*t2k.nudir[2]
+                n_distlong = mctree3.DPrompt[i] * n_beamcos
+                n_disttran = mctree3.DPrompt[i] * n_gammacos
+                n_r2 = r2(mctree3.fvx[i], mctree3.fvy[i])
+                feature_map = {'beamcos': n_beamcos, 'gammacos': n_gammacos,
+                               'DistL': n_distlong,  'DistT': n_disttran, 'r2': n_r2 }
+                # Get the truth n classification catagory
+                category = label_map.get(mctree3.Label[i])
+                # Check if vaild capture or noise
+                if category:
+                    for feature in n_in_NTag:
+                        # Get and Fill the neutron info
+                        if feature in feature_map:
+                            value = feature_map[feature]
+                        else:
+                            value = getattr(mctree3, feature)[i]
+                        n_feature[feature]['all'].append(value)
+                        n_feature[feature][category].append(value)
+
+                    for featureNN in nNN_in_NTag:
+                        # Get and fill the neutron NN info
+                        valueNN = getattr(mctree3, featureNN)[i]
+                        n_featureNN[featureNN]['all'].append(valueNN)
+                        n_featureNN[featureNN][category].append(valueNN)
+
+                # Sample code to check if the wanted parameter are recored
+                #print("Neutron    tds: ", n_feature['FitT']['all'])
+                #print("Neutron-Gd tds: ", n_feature['FitT']['Gd'])
+                #print("Neutron    NHis: ", n_featureNN['NHits']['all'])
+                #print("Neutron-Gd NHis: ", n_featureNN['NHits']['Gd'])
+
+    
+        # Calculate the neutrino oscillation probability
+        pmutoe  = t2k.osca * (sin( 1.267 * t2k.deltam32 * t2k.L / enu) ** 2 )
+        pmutomu = 1. - ( t2k.oscb + t2k.osca ) * \
+                       ( sin( 1.267 * t2k.deltam32 * t2k.L / enu) ** 2 )
+        posc = pmutoe + pmutomu
+    
+        ### loop over selected runs with pre-calculated weight ###
+        for run in t2k.runs :
+            ## weight
+            wgt = 1.0
+            wgt = t2k.ncel_scales[ fileType ] * t2k.pot[ run ] / (n_gen)
+            if fileType in t2k.fluxtunes[ run ] :
+                ibin = t2k.fluxtunes[ run ][ fileType ].FindFixBin( enu )
+                wgt *= t2k.fluxtunes[ run ][ fileType ].GetBinContent( ibin )
+
+            variables = [enu, erec, dwall, effwall, ovaq, angle, cosb, \
+                         pos_x, pos_y, pos_z, pos_r2, \
+                         Ntrue, Ntaggable, Ntagged]
+        
+            # Fill NCQE gamma info into histograms
+            for var, feature in zip(variables, hist_gamma.features):
+                feature_name = feature["name"]
+                hist_gamma.fill(feature_name, "ncgamma", cutname, interaction, var, wgt)
+                hist_gamma.fill(feature_name, "ncgamma", cutname, "all", var, wgt)
+
+            # Fill NCQE neutron info into histogram
+            for n_record in n_feature:
+                feature_name = nfeature_mapping.get(n_record)
+                if feature_name is None:
+                    print(f"No matching feature found for {n_record}")
+                    continue
+
+                for category in n_feature[n_record]:
+                    values = n_feature[n_record][category]
+                    for value in values:
+                        hist_neutron.fill(feature_name, category, cutname, interaction, value, wgt)
+                        hist_neutron.fill(feature_name, category, cutname, "all", value, wgt)
+
+            # Fill NCQE neutron NN info into histogram
+            for n_record in n_featureNN:
+                feature_name = nfeatureNN_mapping.get(n_record)
+                if feature_name is None:
+                    print(f"No matching feature found for {n_record}")
+                    continue
+
+                for category in n_featureNN[n_record]:
+                    values = n_featureNN[n_record][category]
+                    for value in values:
+                        hist_neutron.fillNN(feature_name, category, cutname, value, wgt)
+                        hist_neutron.fillNN(feature_name, category, cutname, value, wgt)
+    progress.finish(maxev)
+
+    for treename, perf in perfstats.items() :
+        perf.Finish()
+        io_stats.add_perfstats(fileType, schema, treename, perf, len(infiles))
+
+
+if __name__ == "__main__":
+    main()
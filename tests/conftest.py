@@ -0,0 +1,103 @@
+import os
+import sys
+import importlib
+import numpy as np
+import awkward as ak
+import uproot
+import pytest
+
+# The analysis modules are top-level scripts of the repository
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+# NTag candidate features of the synthetic inputs and their ranges
+ntag_ranges = { "FitT" : (0, 600), "DPrompt" : (0, 600), "fvx" : (-1500, 1500), "fvy" : (-1500, 1500),
+                "fvz" : (-1500, 1500), "NHits" : (0, 600), "NResHits" : (0, 600), "TRMS" : (0, 600),
+                "DWall" : (0, 600), "DWallMeanDir" : (0, 600), "Beta1" : (0, 600), "Beta2" : (0, 600),
+                "Beta3" : (0, 600), "Beta4" : (0, 600), "Beta5" : (0, 600), "OpeningAngleMean" : (0, 600),
+                "OpeningAngleSkew" : (0, 600), "OpeningAngleStdev" : (0, 600), "MeanDirAngleMean" : (0, 600),
+                "MeanDirAngleRMS" : (0, 600), "BurstRatio" : (0, 600), "FitGoodness" : (0, 600),
+                "DarkLikelihood" : (0, 600), "TagOut" : (0, 1) }
+neutmodes = [ 51, 52, -51, -52, 31, -32, 36, -46, 1, -1, 2, -2, 0, 11, -13, 21 ]
+
+
+def make_mc(path, nentries, seed, schema):
+    """
+    Writes a synthetic MC file of the schema (SKG4 or SKDETSIM): h1, event, ntag and taggable trees.
+    """
+    rng = np.random.default_rng(seed)
+    h1  = { "pnu"     : rng.uniform(100, 3000, (nentries, 2)).astype(np.float32),
+            "erec"    : rng.uniform(2, 35, nentries).astype(np.float32),
+            "wall"    : rng.uniform(0, 1700, nentries).astype(np.float32),
+            "effwall" : rng.uniform(0, 4000, nentries).astype(np.float32),
+            "ovaq"    : rng.uniform(-0.2, 0.8, nentries).astype(np.float32),
+            "pos"     : rng.uniform(-1600, 1600, (nentries, 3)).astype(np.float32),
+            "posv"    : rng.uniform(-1600, 1600, (nentries, 3)).astype(np.float32),
+            "bdir"    : rng.normal(size=(nentries, 3)).astype(np.float32),
+            ( "Neutmode" if schema == "SKDETSIM" else "NEUTMode" ) :
+                rng.choice(neutmodes, nentries).astype(np.int32) }
+    if schema == "SKDETSIM" :
+        h1["angle"] = rng.uniform(0, 90, nentries).astype(np.float32)
+    counts = rng.integers(0, 6, nentries).astype(np.int32)
+    event  = { "NTrueN"      : rng.integers(0, 5, nentries).astype(np.int32),
+               "NTaggableN"  : rng.integers(0, 5, nentries).astype(np.int32),
+               "NTaggedN"    : rng.integers(0, 5, nentries).astype(np.int32),
+               "NCandidates" : counts }
+    if schema == "SKG4" :
+        event["CherenkovAngle"] = rng.uniform(0, 90, nentries).astype(np.float32)
+    total = int(counts.sum())
+    ntag  = { name : ak.unflatten(rng.uniform(lo, hi, total).astype(np.float32), counts)
+              for name, (lo, hi) in ntag_ranges.items() }
+    ntag["Label"] = ak.unflatten(rng.choice([0, 1, 2, 3], total).astype(np.int32), counts)
+    with uproot.recreate(path) as fout :
+        for treename, arrays in (("h1", h1), ("event", event), ("ntag", ntag),
+                                 ("taggable", { "x" : np.zeros(nentries, np.float32) })) :
+            types = { name : ak.type(array).content if isinstance(array, ak.Array)
+                             else array.dtype if array.ndim == 1 else (array.dtype, array.shape[1:])
+                      for name, array in arrays.items() }
+            fout.mktree(treename, types, counter_name=lambda counter: "n" + counter)
+            fout[treename].extend(arrays)
+
+
+@pytest.fixture(scope="session")
+def mc_files(tmp_path_factory):
+    """
+    Synthetic inputs of two flavors and both schemas, and a flux tune file.
+    """
+    directory = tmp_path_factory.mktemp("mc")
+    files = []
+    for ifile, (flavor, schema, nentries) in enumerate((("numu", "SKG4", 700), ("numu", "SKDETSIM", 400),
+                                                        ("nue", "SKG4", 500), ("numubar", "SKDETSIM", 300))) :
+        path = str(directory / f"lentp_{flavor}.ncgamma_synthetic.{ifile:03d}.root")
+        make_mc(path, nentries, ifile + 1, schema)
+        files.append(path)
+    rng = np.random.default_rng(10)
+    tunefile = str(directory / "tune.root")
+    with uproot.recreate(tunefile) as fout :
+        for suffix in ("numu", "numub", "nue", "nueb") :
+            fout[f"enu_sk_tuned21b_{suffix}_ratio"] = ( rng.uniform(0.8, 1.2, 30), np.linspace(0., 3000., 31) )
+    return { "files" : files, "tunefile" : tunefile }
+
+
+@pytest.fixture
+def run_ncqe(mc_files, monkeypatch, tmp_path):
+    """
+    Returns a function running main_NCQE.main in this process with the command line arguments,
+    the flux tunes read from the synthetic tune file.
+    """
+    pytest.importorskip("ROOT")
+    main_NCQE = importlib.import_module("main_NCQE")
+    set_fluxtune = main_NCQE.T2K._set_fluxtune
+
+    def synthetic_fluxtune(t2k):
+        runs, fluxtunes = set_fluxtune(t2k)
+        t2k.tunefiles = { run : mc_files["tunefile"] for run in runs }
+        return runs, fluxtunes
+    monkeypatch.setattr(main_NCQE.T2K, "_set_fluxtune", synthetic_fluxtune)
+
+    def run(*args, files=None):
+        argv = [ "main_NCQE.py", "--flux-cache", str(tmp_path / "flux_cache") ] + list(args) \
+             + list(mc_files["files"] if files is None else files)
+        monkeypatch.setattr(sys, "argv", argv)
+        main_NCQE.main()
+    return run
+
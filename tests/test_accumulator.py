@@ -0,0 +1,75 @@
+import numpy as np
+import pytest
+
+from NCQE_Accumulator import NCQE_Hist_Accumulator
+
+features = [ { "name" : "herec", "label" : "", "bins" : (26, 3.49, 29.49) },
+             { "name" : "hcosb", "label" : "", "bins" : (10, -1., 1.) } ]
+
+
+def random_fills(seed=5, nvalues=3000):
+    rng    = np.random.default_rng(seed)
+    values = np.concatenate([ rng.uniform(0., 33., nvalues), [ 3.49, 29.49, np.nan ] ])
+    wgts   = rng.uniform(0.2, 2., len(values))
+    return values, wgts
+
+
+def test_histogram_matches_filled_th1d():
+    ROOT = pytest.importorskip("ROOT")
+    values, wgts = random_fills()
+    accumulator = NCQE_Hist_Accumulator(features, ["ncgamma"], ["angle"], ["all"])
+    accumulator.fill(0, 0, 0, 0, values[:1000], wgts[:1000])
+    accumulator.flush()
+    accumulator.fill(0, 0, 0, 0, values[1000:], wgts[1000:])
+
+    filled = ROOT.TH1D("filled", "", *features[0]["bins"])
+    filled.SetDirectory(0)
+    filled.Sumw2()
+    for value, wgt in zip(values, wgts) :
+        filled.Fill(value, wgt)
+    converted = ROOT.TH1D("converted", "", *features[0]["bins"])
+    converted.SetDirectory(0)
+    accumulator.to_histogram(converted, 0, 0, 0, 0)
+
+    for ibin in range(features[0]["bins"][0] + 2) :
+        assert converted.GetBinContent(ibin) == pytest.approx(filled.GetBinContent(ibin), rel=1e-12)
+        assert converted.GetBinError(ibin) == pytest.approx(filled.GetBinError(ibin), rel=1e-12)
+    assert converted.GetEntries() == filled.GetEntries()
+    assert converted.GetMean() == pytest.approx(filled.GetMean(), rel=1e-12)
+    assert converted.GetStdDev() == pytest.approx(filled.GetStdDev(), rel=1e-12)
+
+
+def test_cumulative_stages_sum_the_later_ones():
+    values, wgts = random_fills(seed=6)
+    stages = np.random.default_rng(7).integers(0, 3, len(values))
+    cumulative = NCQE_Hist_Accumulator(features, ["ncgamma"], ["a", "b", "c"], ["all"], cumulative=True)
+    cumulative.fill(0, 0, stages, 0, values, wgts)
+    perstage = NCQE_Hist_Accumulator(features, ["ncgamma"], ["a", "b", "c"], ["all"])
+    for icut in range(3) :
+        passed = stages >= icut
+        perstage.fill(0, 0, icut, 0, values[passed], wgts[passed])
+
+    for total, expected in zip(cumulative.totals() + cumulative.moments(), perstage.totals() + perstage.moments()) :
+        np.testing.assert_allclose(total, expected, rtol=1e-12)
+    for icut in range(3) :
+        inside = ( stages >= icut ) & ( values >= 3.49 ) & ( values < 29.49 )
+        np.testing.assert_allclose(cumulative.stats(0, 0, icut, 0),
+                                   [ wgts[inside].sum(), (wgts[inside] ** 2).sum(),
+                                     (wgts * values)[inside].sum(), (wgts * values ** 2)[inside].sum() ], rtol=1e-12)
+
+
+def test_merged_states_equal_one_accumulator():
+    values, wgts = random_fills(seed=8)
+    channels = np.random.default_rng(9).integers(0, 2, len(values))
+    single = NCQE_Hist_Accumulator(features, ["ncgamma"], ["angle"], ["a", "b"])
+    single.fill(0, 0, 0, channels, values, wgts)
+    merged = NCQE_Hist_Accumulator(features, ["ncgamma"], ["angle"], ["a", "b"])
+    for part in np.array_split(np.arange(len(values)), 3) :
+        other = NCQE_Hist_Accumulator(features, ["ncgamma"], ["angle"], ["a", "b"])
+        other.fill(0, 0, 0, channels[part], values[part], wgts[part])
+        merged.merge(other.state())
+
+    for name, array in single.state().items() :
+        np.testing.assert_allclose(merged.state()[name], array, rtol=1e-12, err_msg=name)
+    merged.reset()
+    assert not any(np.any(array) for array in merged.state().values())
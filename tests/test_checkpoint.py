@@ -0,0 +1,30 @@
+import pickle
+import numpy as np
+import pytest
+
+from test_paths import assert_same_histograms, tree_arrays
+
+
+def test_resume_refuses_other_checkpoint_before_touching_outputs(run_ncqe, tmp_path):
+    checkpoint = tmp_path / "run.ckpt"
+    tree       = tmp_path / "selected.root"
+    with open(checkpoint, "wb") as fout :
+        pickle.dump({ "key" : "other run", "position" : (0, 0), "partial" : {},
+                      "outputs" : { "tree" : { "entries" : 0, "cycle" : 1, "offset" : 0 } } }, fout)
+    tree.write_bytes(b"previous output")
+
+    with pytest.raises(SystemExit, match="other input files or settings") :
+        run_ncqe("--checkpoint", str(checkpoint), "--resume", "-t", str(tree), "-o", str(tmp_path / "hist.root"))
+    assert tree.read_bytes() == b"previous output"
+    assert not (tmp_path / "hist.root").exists()
+
+
+def test_checkpointed_run_matches_plain_run(run_ncqe, tmp_path):
+    run_ncqe("--columnar", "-o", str(tmp_path / "plain_hist.root"), "-t", str(tmp_path / "plain_tree.root"))
+    run_ncqe("--checkpoint", str(tmp_path / "run.ckpt"), "--checkpoint-every", "0", "--chunk-size", "256",
+             "-o", str(tmp_path / "ckpt_hist.root"), "-t", str(tmp_path / "ckpt_tree.root"))
+    assert not (tmp_path / "run.ckpt").exists()
+    assert_same_histograms(tmp_path / "ckpt_hist.root", tmp_path / "plain_hist.root")
+    plain, ckpt = tree_arrays(tmp_path / "plain_tree.root"), tree_arrays(tmp_path / "ckpt_tree.root")
+    for branch, values in plain.items() :
+        np.testing.assert_array_equal(ckpt[branch], values, err_msg=branch)
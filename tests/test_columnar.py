@@ -0,0 +1,79 @@
+import sys
+import importlib
+import numpy as np
+
+
+def import_without_root(monkeypatch, name):
+    """
+    Imports a module as if ROOT, uproot and awkward were not installed.
+    """
+    for module in ("ROOT", "uproot", "awkward") :
+        monkeypatch.setitem(sys.modules, module, None)
+    for module in [ module for module in sys.modules if module.startswith("NCQE_") ] :
+        monkeypatch.delitem(sys.modules, module)
+    return importlib.import_module(name)
+
+
+def test_column_store_round_trip_without_root(monkeypatch, tmp_path):
+    columnar = import_without_root(monkeypatch, "NCQE_Columnar")
+    assert "NCQE_Tree" not in sys.modules and "NCQE_Schema" not in sys.modules
+
+    path  = str(tmp_path / "selected.columns")
+    store = columnar.NCQE_Column_Store(path, ["nuncqe", "others"], ["numu", "nue"], config="test")
+    rng   = np.random.default_rng(2)
+    chunks = []
+    for nrows in (5, 0, 3) :
+        chunk = [ rng.uniform(0, 10, nrows).astype(dtype) for dtype in columnar.COLUMNS.values() ]
+        store.fill_arrays(chunk)
+        chunks.append(chunk)
+    store.close()
+
+    arrays, meta = columnar.load_columns(path)
+    assert meta["nevents"] == 8 and meta["config"] == "test"
+    for icolumn, (name, dtype) in enumerate(columnar.COLUMNS.items()) :
+        assert arrays[name].dtype == np.dtype(dtype)
+        np.testing.assert_array_equal(arrays[name], np.concatenate([ chunk[icolumn] for chunk in chunks ]))
+
+
+def test_candidate_store_round_trip_without_root(monkeypatch, tmp_path):
+    columnar = import_without_root(monkeypatch, "NCQE_Columnar")
+    assert "NCQE_Engine" not in sys.modules
+
+    path   = str(tmp_path / "candidates.columns")
+    store  = columnar.NCQE_Candidate_Store(path, config="test")
+    counts = [ np.array([2, 0, 1]), np.array([0, 3]) ]
+    for chunk_counts in counts :
+        ncand = int(chunk_counts.sum())
+        cand  = { name : np.arange(ncand).astype(dtype) for name, dtype in columnar.CANDIDATE_COLUMNS.items() }
+        store.fill_arrays([ None ] * len(columnar.COLUMNS) + [ dict(cand, counts=chunk_counts) ])
+    store.close()
+
+    arrays, meta = columnar.load_columns(path)
+    assert meta["nevents"] == 5 and meta["nrows"] == 6
+    assert meta["categories"] == ["all", "Gd", "H", "Noise"]
+    np.testing.assert_array_equal(arrays["offsets"], [0, 2, 2, 3, 3, 6])
+    np.testing.assert_array_equal(arrays["event"], [0, 0, 2, 4, 4, 4])
+
+
+def test_column_store_resume_drops_rows_after_checkpoint(monkeypatch, tmp_path):
+    columnar = import_without_root(monkeypatch, "NCQE_Columnar")
+    rng    = np.random.default_rng(3)
+    chunks = [ [ rng.uniform(0, 10, nrows).astype(dtype) for dtype in columnar.COLUMNS.values() ]
+               for nrows in (4, 2, 5) ]
+
+    path  = str(tmp_path / "selected.columns")
+    store = columnar.NCQE_Column_Store(path, [], [])
+    store.fill_arrays(chunks[0])
+    state = store.checkpoint()
+    store.fill_arrays(chunks[1])   # lost: the run stops before the next checkpoint
+    store.write()
+
+    store = columnar.NCQE_Column_Store(path, [], [], resume=state)
+    store.fill_arrays(chunks[1])
+    store.fill_arrays(chunks[2])
+    store.close()
+
+    arrays, meta = columnar.load_columns(path)
+    assert meta["nevents"] == 11
+    for icolumn, name in enumerate(columnar.COLUMNS) :
+        np.testing.assert_array_equal(arrays[name], np.concatenate([ chunk[icolumn] for chunk in chunks ]))
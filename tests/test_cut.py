@@ -0,0 +1,58 @@
+import numpy as np
+import pytest
+
+from NCQE_Cut import NCQE_Cut
+
+ncqe_cut = NCQE_Cut(run=11, anamode=6)
+nan = float("nan")
+
+# (Erec, dwall, effwall, ovaq, angle) on and around the cut edges
+events = [
+    (  4.0, 800., 2500., 0.5, 80. ),   # lower energy edge, passes
+    ( 30.0, 800., 2500., 0.5, 80. ),   # upper energy edge, fails
+    (  3.99, 800., 2500., 0.5, 80. ),  # energy fails -> stage 0
+    ( 29.99, 800., 2500., 0.5, 80. ),
+    ( 10.0, 200., 2500., 0.5, 80. ),   # dwall on the fiducial edge
+    ( 10.0, 199.9, 2500., 0.5, 80. ),
+    ( 10.0, 800., 200., 0.5, 80. ),    # effwall on the fiducial edge
+    # fit quality edges, at energies where they are tighter than the fiducial volume
+    ( 4.5, ncqe_cut.cut_val("dwall", "11", 4.5), 2500., 0.5, 80. ),
+    ( 4.5, ncqe_cut.cut_val("dwall", "11", 4.5) - 0.1, 2500., 0.5, 80. ),
+    ( 5.0, 800., ncqe_cut.cut_val("effwall", "11", 5.0), 0.5, 80. ),
+    ( 5.0, 800., ncqe_cut.cut_val("effwall", "11", 5.0) - 0.1, 0.5, 80. ),
+    ( 5.0, 800., 2500., ncqe_cut.cut_val("ovaQ", "11", 5.0), 80. ),
+    ( 5.0, 800., 2500., ncqe_cut.cut_val("ovaQ", "11", 5.0) - 0.001, 80. ),
+    ( 10.0, 800., 2500., 0.5, ncqe_cut.aopt * 10.0 + ncqe_cut.bopt ),
+    ( 10.0, 800., 2500., 0.5, 20. ),
+    ( nan, 800., 2500., 0.5, 80. ),
+    ( 10.0, nan, 2500., 0.5, 80. ),
+    ( 10.0, 800., 2500., nan, 80. ),
+    ( 10.0, 800., 2500., 0.5, nan ),
+    ( nan, nan, nan, nan, nan ),
+]
+
+
+@pytest.mark.parametrize("event", events)
+def test_stage_arrays_match_scalar_cuts(event):
+    columns = [ np.array([ value ]) for value in event ]
+    assert ncqe_cut.last_stage_array(*columns)[0] == ncqe_cut.last_stage(*event)
+    assert ncqe_cut.is_NCQE_array(*columns)[0] == ncqe_cut.is_NCQE(*event)
+
+
+def test_stage_arrays_match_scalar_cuts_on_random_events():
+    rng = np.random.default_rng(11)
+    n   = 5000
+    columns = [ rng.uniform(2, 35, n), rng.uniform(0, 1700, n), rng.uniform(0, 4000, n),
+                rng.uniform(-0.2, 0.8, n), rng.uniform(0, 90, n) ]
+    columns = [ column.astype(np.float32) for column in columns ]
+    stages  = ncqe_cut.last_stage_array(*columns)
+    np.testing.assert_array_equal(stages, [ ncqe_cut.last_stage(*map(float, event)) for event in zip(*columns) ])
+    np.testing.assert_array_equal(ncqe_cut.is_NCQE_array(*columns),
+                                  [ ncqe_cut.is_NCQE(*map(float, event)) for event in zip(*columns) ])
+    assert set(stages) == set(range(len(ncqe_cut.stages)))
+
+
+@pytest.mark.parametrize("neutmode", [ 0, 1, -1, 2, -2, 11, -13, 30, 31, -34, 35, 36, -46, 51, 52, -51, -52,
+                                       99, 100, -100, 101, -101, 1000, -100000 ])
+def test_channel_array_matches_scalar_channel(neutmode):
+    assert ncqe_cut.channels[ ncqe_cut.channel_array(np.array([ neutmode ]))[0] ] == ncqe_cut.channel(neutmode)
@@ -0,0 +1,16 @@
+import numpy as np
+import pytest
+
+engine = pytest.importorskip("NCQE_Engine", exc_type=ImportError)
+
+
+def test_candidate_directions_match_scalar_path():
+    rng  = np.random.default_rng(5)
+    cand = rng.uniform(-15, 15, (50, 3))
+    pos  = rng.uniform(-15, 15, (50, 3))
+    pos[:5] = cand[:5]   # candidates at the prompt vertex
+    ndir = engine.n_dirs(cand - pos)
+    np.testing.assert_array_equal(ndir[:5], 0.)
+    assert np.all(np.isfinite(ndir))
+    for icand in range(len(cand)) :
+        np.testing.assert_allclose(ndir[icand], engine.n_dir(*cand[icand], *pos[icand]), rtol=1e-12)
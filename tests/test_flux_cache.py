@@ -0,0 +1,31 @@
+import os
+import pytest
+
+from T2K_FluxCache import Flux_Tune_Cache, _atomic_write
+
+histnames = { "numu" : "enu_sk_tuned21b_numu_ratio" }
+
+
+def test_index_follows_a_replaced_tune_file(tmp_path):
+    tunefile = tmp_path / "tune.root"
+    tunefile.write_bytes(b"first")
+    cache = Flux_Tune_Cache(str(tmp_path / "cache"))
+    first = cache._index_file(str(tunefile), histnames)
+    assert cache._index_file(str(tunefile), histnames) == first
+
+    tunefile.write_bytes(b"second tune")
+    assert cache._index_file(str(tunefile), histnames) != first
+
+
+def test_atomic_write_leaves_no_file_when_write_fails(tmp_path):
+    path = tmp_path / "index" / "key.json"
+
+    def failing(fout):
+        fout.write(b"partial")
+        raise RuntimeError("disk full")
+    with pytest.raises(RuntimeError) :
+        _atomic_write(str(path), failing)
+    assert os.listdir(path.parent) == []
+
+    _atomic_write(str(path), lambda fout: fout.write(b"{}"))
+    assert os.listdir(path.parent) == [ "key.json" ] and path.read_bytes() == b"{}"
@@ -0,0 +1,41 @@
+import numpy as np
+import pytest
+
+from T2K_Config import T2K
+from T2K_FluxCache import hist_table
+
+fixed_bins    = (30, 0., 3000.)
+variable_bins = np.array([ 0., 100., 150., 400., 401., 1000., 2500., 3000. ])
+
+
+def tune_histogram(ROOT, name, bins):
+    if isinstance(bins, tuple) :
+        hist = ROOT.TH1D(name, "", *bins)
+    else :
+        hist = ROOT.TH1D(name, "", len(bins) - 1, bins)
+    hist.SetDirectory(0)
+    for ibin in range(hist.GetNbinsX() + 2) :
+        hist.SetBinContent(ibin, 1. + 0.01 * ibin)
+    return hist
+
+
+def energies(hist):
+    axis  = hist.GetXaxis()
+    edges = np.array([ axis.GetBinLowEdge(ibin) for ibin in range(1, axis.GetNbins() + 2) ])
+    rng   = np.random.default_rng(12)
+    return np.concatenate([ edges, np.nextafter(edges, -np.inf), np.nextafter(edges, np.inf),
+                            [ -1e9, -1., 1e9, np.inf, -np.inf, np.nan ],
+                            rng.uniform(edges[0] - 100., edges[-1] + 100., 2000) ])
+
+
+@pytest.mark.parametrize("bins", [ fixed_bins, variable_bins ], ids=[ "fixed", "variable" ])
+def test_flux_weight_matches_find_fix_bin(bins):
+    ROOT = pytest.importorskip("ROOT")
+    hist = tune_histogram(ROOT, "tune", bins)
+    t2k  = T2K.__new__(T2K)
+    t2k.flux_tables = { "11" : { "numu" : hist_table(hist) } }
+    assert t2k.flux_tables["11"]["numu"]["fixed"] == isinstance(bins, tuple)
+
+    enu = energies(hist)
+    expected = [ hist.GetBinContent(hist.FindFixBin(value)) for value in enu ]
+    np.testing.assert_array_equal(t2k.flux_weight("11", "numu", enu), expected)
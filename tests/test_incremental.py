@@ -0,0 +1,33 @@
+import os
+
+from NCQE_Incremental import NCQE_Manifest
+
+
+def test_manifest_removes_unreferenced_partials(tmp_path):
+    manifest = NCQE_Manifest(str(tmp_path))
+    os.makedirs(tmp_path / "partials")
+    infile = tmp_path / "a.root"
+    infile.write_bytes(b"first")
+    record = manifest.file_record(str(infile))
+    old    = manifest.partial_path(record, "a" * 64)
+    open(old, "wb").close()
+    manifest.update(str(infile), record, "a" * 64, 10)
+    manifest.save()
+    assert os.path.exists(old)
+
+    # new settings of the same file: its old partial is dropped, other files are kept
+    new = manifest.partial_path(record, "b" * 64)
+    open(new, "wb").close()
+    other = tmp_path / "b.root"
+    other.write_bytes(b"second")
+    other_record = manifest.file_record(str(other))
+    kept = manifest.partial_path(other_record, "a" * 64)
+    open(kept, "wb").close()
+    open(tmp_path / "partials" / "notes.txt", "w").close()
+    manifest.update(str(infile), record, "b" * 64, 10)
+    manifest.update(str(other), other_record, "a" * 64, 5)
+    manifest.save()
+    assert not os.path.exists(old)
+    assert os.path.exists(new) and os.path.exists(kept)
+    assert os.path.exists(tmp_path / "partials" / "notes.txt")
+    assert NCQE_Manifest(str(tmp_path)).prune() == []
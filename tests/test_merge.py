@@ -0,0 +1,52 @@
+import numpy as np
+import pytest
+
+from test_columnar import import_without_root
+
+
+def test_natural_order_of_inputs():
+    merge = pytest.importorskip("NCQE_Merge", exc_type=ImportError)
+    paths = [ "part10/out.root", "part2/out.root", "part1/out.root", "part2b/out.root" ]
+    assert sorted(paths, key=merge.natural_key) == \
+           [ "part1/out.root", "part2/out.root", "part2b/out.root", "part10/out.root" ]
+
+
+def fill_candidates(columnar, path, chunks, config="test"):
+    store = columnar.NCQE_Candidate_Store(path, config=config)
+    for counts, cand in chunks :
+        store.fill_arrays([ None ] * len(columnar.COLUMNS) + [ dict(cand, counts=counts) ])
+    store.close()
+
+
+def test_merged_candidate_stores_match_single_store(monkeypatch, tmp_path):
+    columnar = import_without_root(monkeypatch, "NCQE_Columnar")
+    rng    = np.random.default_rng(4)
+    chunks = []
+    for nevents in (4, 0, 6, 3) :
+        counts = rng.integers(0, 4, nevents)
+        chunks.append(( counts, { name : rng.uniform(0, 10, int(counts.sum())).astype(dtype)
+                                  for name, dtype in columnar.CANDIDATE_COLUMNS.items() } ))
+    fill_candidates(columnar, str(tmp_path / "single"), chunks)
+    for ishard, shard in enumerate(( chunks[:1], chunks[1:2], chunks[2:] )) :
+        fill_candidates(columnar, str(tmp_path / f"part{ishard}"), shard)
+
+    meta = columnar.merge_stores(str(tmp_path / "merged"), [ str(tmp_path / f"part{i}") for i in range(3) ])
+    merged, merged_meta = columnar.load_columns(str(tmp_path / "merged"))
+    single, single_meta = columnar.load_columns(str(tmp_path / "single"))
+    assert merged_meta == single_meta == meta
+    for name in single :
+        np.testing.assert_array_equal(merged[name], single[name], err_msg=name)
+
+
+def test_merge_refuses_different_stores(monkeypatch, tmp_path):
+    columnar = import_without_root(monkeypatch, "NCQE_Columnar")
+    columnar.NCQE_Column_Store(str(tmp_path / "columns"), ["nuncqe"], ["numu"], config="test").close()
+    fill_candidates(columnar, str(tmp_path / "candidates"), [])
+    fill_candidates(columnar, str(tmp_path / "other"), [], config="other")
+    with pytest.raises(ValueError, match="differ") :
+        columnar.merge_stores(str(tmp_path / "merged"), [ str(tmp_path / "columns"), str(tmp_path / "candidates") ])
+    with pytest.raises(ValueError, match="config") :
+        columnar.merge_stores(str(tmp_path / "merged"), [ str(tmp_path / "candidates"), str(tmp_path / "other") ])
+    meta = columnar.merge_stores(str(tmp_path / "merged"), [ str(tmp_path / "candidates"), str(tmp_path / "other") ],
+                                 check_config=False)
+    assert meta["nevents"] == 0 and meta["nrows"] == 0
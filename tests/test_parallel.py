@@ -0,0 +1,69 @@
+import os
+import sys
+import numpy as np
+
+from test_paths import assert_same_histograms, tree_arrays
+
+
+def run_outputs(run_ncqe, directory, *args, **kwargs):
+    os.makedirs(directory, exist_ok=True)
+    hist, tree = os.path.join(directory, "hist.root"), os.path.join(directory, "tree.root")
+    run_ncqe("-o", hist, "-t", tree, *args, **kwargs)
+    return hist, tree
+
+
+def assert_same_trees(path, expected_path):
+    tree, expected = tree_arrays(path), tree_arrays(expected_path)
+    assert len(expected["erec"]) > 0 and sorted(tree) == sorted(expected)
+    for branch, values in expected.items() :
+        np.testing.assert_array_equal(tree[branch], values, err_msg=branch)
+
+
+def test_jobs_match_serial_run(run_ncqe, tmp_path):
+    serial   = run_outputs(run_ncqe, tmp_path / "serial", "--columnar")
+    parallel = run_outputs(run_ncqe, tmp_path / "parallel", "--jobs", "2")
+    assert_same_histograms(parallel[0], serial[0])
+    assert_same_trees(parallel[1], serial[1])
+
+
+def test_chunk_size_does_not_change_outputs(run_ncqe, tmp_path):
+    large = run_outputs(run_ncqe, tmp_path / "large", "--columnar")
+    small = run_outputs(run_ncqe, tmp_path / "small", "--columnar", "--chunk-size", "97")
+    assert_same_histograms(small[0], large[0])
+    assert_same_trees(small[1], large[1])
+
+
+def test_merged_shards_match_single_run(run_ncqe, monkeypatch, tmp_path):
+    import NCQE_Merge
+    single = run_outputs(run_ncqe, tmp_path / "single", "--columnar")
+    nshards = 3
+    for ishard in range(nshards) :
+        run_outputs(run_ncqe, tmp_path / f"part{ishard}", "--shard", f"{ishard}/{nshards}")
+
+    for output, inputs in (("hist.root", "hist.root"), ("tree.root", "tree.root")) :
+        monkeypatch.setattr(sys, "argv", [ "NCQE_Merge.py", "-j", "2", "-o", str(tmp_path / f"merged_{output}"),
+                                           str(tmp_path / "part*" / inputs) ])
+        NCQE_Merge.main()
+    assert_same_histograms(tmp_path / "merged_hist.root", single[0])
+    assert_same_trees(tmp_path / "merged_tree.root", single[1])
+
+
+def test_incremental_rerun_reuses_partials(run_ncqe, mc_files, capsys, tmp_path):
+    cachedir = str(tmp_path / "cache")
+    serial   = run_outputs(run_ncqe, tmp_path / "serial", "--columnar")
+    first    = run_outputs(run_ncqe, tmp_path / "first", "--incremental", cachedir)
+    assert "4 of 4 files to process" in capsys.readouterr().out
+    assert_same_histograms(first[0], serial[0])
+    assert_same_trees(first[1], serial[1])
+
+    # a rerun of the same files only reads the cached partials
+    rerun = run_outputs(run_ncqe, tmp_path / "rerun", "--incremental", cachedir)
+    assert "0 of 4 files to process" in capsys.readouterr().out
+    assert_same_histograms(rerun[0], first[0])
+    assert_same_trees(rerun[1], first[1])
+    assert len(os.listdir(os.path.join(cachedir, "partials"))) == 4
+
+    # other settings: every file is processed again and the old partials are removed
+    run_outputs(run_ncqe, tmp_path / "other", "--incremental", cachedir, "--run-breakdown")
+    assert "4 of 4 files to process" in capsys.readouterr().out
+    assert len(os.listdir(os.path.join(cachedir, "partials"))) == 4
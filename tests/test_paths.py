@@ -0,0 +1,48 @@
+import json
+import numpy as np
+import uproot
+
+
+def tree_arrays(path):
+    with uproot.open(path) as fin :
+        return fin["NCQETree"].arrays(library="np")
+
+
+def test_tree_without_histograms_matches_columnar(run_ncqe, tmp_path):
+    spec = tmp_path / "no_histograms.json"
+    spec.write_text(json.dumps({ "gamma" : [], "neutron" : [], "neutronNN" : [] }))
+    for mode, extra in (("tchain", []), ("columnar", ["--columnar"])) :
+        run_ncqe("--output-spec", str(spec), "-o", str(tmp_path / f"{mode}_hist.root"),
+                 "-t", str(tmp_path / f"{mode}_tree.root"), *extra)
+
+    tchain   = tree_arrays(tmp_path / "tchain_tree.root")
+    columnar = tree_arrays(tmp_path / "columnar_tree.root")
+    assert len(tchain["erec"]) > 0
+    assert len(tchain["erec"]) == len(columnar["erec"])
+    for branch, values in tchain.items() :
+        np.testing.assert_array_equal(np.sort(values), np.sort(columnar[branch]), err_msg=branch)
+
+
+def histograms(path):
+    with uproot.open(path) as fin :
+        return { name : fin[name] for name, classname in fin.classnames(cycle=False).items()
+                 if classname.startswith("TH1") }
+
+
+def assert_same_histograms(path, expected_path, rtol=1e-9):
+    hists, expected = histograms(path), histograms(expected_path)
+    assert len(hists) > 0 and sorted(hists) == sorted(expected)
+    for name, hist in hists.items() :
+        np.testing.assert_allclose(hist.values(flow=True), expected[name].values(flow=True), rtol=rtol, err_msg=name)
+        np.testing.assert_allclose(hist.variances(flow=True), expected[name].variances(flow=True), rtol=rtol,
+                                   err_msg=name)
+        assert hist.member("fEntries") == expected[name].member("fEntries"), name
+        for member in ("fTsumw", "fTsumw2", "fTsumwx", "fTsumwx2") :
+            np.testing.assert_allclose(hist.member(member), expected[name].member(member), rtol=rtol,
+                                       err_msg=f"{name} {member}")
+
+
+def test_columnar_histograms_match_tchain(run_ncqe, tmp_path):
+    for mode, extra in (("tchain", []), ("columnar", ["--columnar", "--chunk-size", "256"])) :
+        run_ncqe("-o", str(tmp_path / f"{mode}_hist.root"), "-t", str(tmp_path / f"{mode}_tree.root"), *extra)
+    assert_same_histograms(tmp_path / "columnar_hist.root", tmp_path / "tchain_hist.root")
@@ -0,0 +1,31 @@
+from NCQE_Profile import NCQE_Throttle
+
+
+class RecordingBar:
+
+    def __init__(self):
+        self.values   = []
+        self.finished = False
+
+    def update(self, value):
+        self.values.append(value)
+
+    def finish(self):
+        self.finished = True
+
+
+def test_throttle_pushes_the_last_value_on_finish():
+    pbar     = RecordingBar()
+    progress = NCQE_Throttle(pbar, interval=3600., stride=10)
+    for iev in range(25) :
+        progress.update(iev)
+    assert pbar.values == []   # held back by the interval
+    progress.finish()
+    assert pbar.values == [24] and pbar.finished
+
+    pbar     = RecordingBar()
+    progress = NCQE_Throttle(pbar, interval=0., stride=10)
+    for iev in range(25) :
+        progress.update(iev)
+    progress.finish(25)
+    assert pbar.values == [9, 19, 25] and pbar.finished
@@ -0,0 +1,52 @@
+import numpy as np
+
+from T2K_Config import T2K
+from NCQE_Accumulator import NCQE_Hist_Accumulator
+from NCQE_Reweight import NCQE_Osc_Reweighter
+
+
+def nominal_t2k():
+    # oscillation settings only (no flux tune files)
+    t2k = T2K.__new__(T2K)
+    t2k.L, t2k.osca, t2k.oscb, t2k.deltam32 = t2k.osc_para()
+    return t2k
+
+
+def recorded_fills(seed=4, nevents=500):
+    t2k         = nominal_t2k()
+    features    = [ { "name" : "herec", "label" : "", "bins" : (26, 3.49, 29.49) } ]
+    accumulator = NCQE_Hist_Accumulator(features, ["ncgamma"], ["angle"], ["all"])
+    reweighter  = NCQE_Osc_Reweighter(t2k, { "gamma" : accumulator })
+    rng    = np.random.default_rng(seed)
+    enu    = rng.uniform(0.1, 3., nevents)   # [GeV]
+    wgts   = rng.uniform(0.5, 1.5, nevents)
+    events = reweighter.add_events(enu, wgts, np.ones(nevents, dtype=bool))
+    accumulator.fill(0, 0, 0, 0, rng.uniform(3., 30., nevents), wgts, events)
+    accumulator.flush()
+    return t2k, accumulator, reweighter, enu
+
+
+def test_point_without_oscillation_gives_nominal_histograms():
+    t2k, accumulator, reweighter, enu = recorded_fills()
+    states = next(reweighter.reweight([ { "L" : 0. } ]))
+    np.testing.assert_allclose(states["gamma"]["sumw"], accumulator.sumw, rtol=1e-12)
+    np.testing.assert_allclose(states["gamma"]["sumw2"], accumulator.sumw2, rtol=1e-12)
+    np.testing.assert_array_equal(states["gamma"]["entries"], accumulator.entries)
+
+
+def test_nominal_point_applies_the_oscillation_factor():
+    # The nominal histograms have no oscillation factor: the nominal point scales each event
+    # weight by P(numu->nue) + P(numu->numu) and does not reproduce them.
+    t2k, accumulator, reweighter, enu = recorded_fills()
+    pmutoe, pmutomu = t2k.osc_prob(enu)
+    factor = pmutoe + pmutomu
+    assert np.all(factor <= 1.) and np.any(factor < 0.99)
+
+    states   = next(reweighter.reweight([ {} ]))
+    expected = NCQE_Hist_Accumulator(accumulator.features, ["ncgamma"], ["angle"], ["all"])
+    state    = reweighter.state()
+    index, events, values = state["fills"]["gamma"]
+    sumw = np.bincount(index, weights=state["wgts"][events] * factor[events], minlength=expected.sumw.size)
+    np.testing.assert_allclose(states["gamma"]["sumw"], sumw.reshape(expected.shape), rtol=1e-12)
+    assert states["gamma"]["sumw"].sum() < accumulator.sumw.sum()
+    np.testing.assert_array_equal(states["gamma"]["entries"], accumulator.entries)
@@ -0,0 +1,27 @@
+import numpy as np
+
+from NCQE_Shard import plan_shards
+
+tasks   = [ ("nue", "SKG4", "a.root"), ("numu", "SKG4", "b.root"), ("numu", "SKG4", "c.root") ]
+entries = [ 2000, 3000, 2501 ]
+
+
+def test_entry_plan_matches_shard_option():
+    total = sum(entries)
+    for nshards in (1, 3, 7) :
+        shards = plan_shards(tasks, entries, [ None ] * len(tasks), nshards)
+        assert [ ( shard["entry_start"], shard["entry_stop"] ) for shard in shards ] == \
+               [ ( ishard * total // nshards, (ishard + 1) * total // nshards ) for ishard in range(nshards) ]
+        assert sum(shard["cost"] for shard in shards) == total
+        for shard in shards :
+            assert sum(r["entry_stop"] - r["entry_start"] for r in shard["ranges"]) == shard["cost"]
+
+
+def test_candidate_plan_balances_cost():
+    rng        = np.random.default_rng(3)
+    candidates = [ rng.integers(0, 2, entries[0]), rng.integers(0, 20, entries[1]), None ]
+    shards = plan_shards(tasks, entries, candidates, 4)
+    assert shards[0]["entry_start"] == 0 and shards[-1]["entry_stop"] == sum(entries)
+    assert all( a["entry_stop"] == b["entry_start"] for a, b in zip(shards[:-1], shards[1:]) )
+    costs = [ shard["cost"] for shard in shards ]
+    assert max(costs) - min(costs) <= 2 * 20
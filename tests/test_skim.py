@@ -0,0 +1,124 @@
+import csv
+import json
+from glob import glob
+import numpy as np
+import awkward as ak
+import uproot
+import pytest
+
+from NCQE_Reader import NCQE_Chunk_Reader
+from NCQE_Skim import default_precut, parse_precut, precut_mask, write_skim, write_skims, skim_schemas, \
+                      NCQE_Skim_Reader
+
+branches = { "h1" : ["erec", "wall", "effwall"], "ntag" : ["FitT", "TagOut"] }
+
+
+def make_input(path, nentries=2000, seed=1):
+    rng    = np.random.default_rng(seed)
+    counts = rng.integers(0, 6, nentries)
+    total  = int(counts.sum())
+    with uproot.recreate(path) as fout :
+        fout.mktree("h1", { name : np.float32 for name in branches["h1"] })
+        fout["h1"].extend({ "erec"    : rng.uniform(2, 35, nentries).astype(np.float32),
+                            "wall"    : rng.uniform(0, 1700, nentries).astype(np.float32),
+                            "effwall" : rng.uniform(0, 4000, nentries).astype(np.float32) })
+        fout.mktree("ntag", { name : "var * float32" for name in branches["ntag"] },
+                    counter_name=lambda counter: "n" + counter)
+        fout["ntag"].extend({ name : ak.unflatten(rng.uniform(0, 600, total).astype(np.float32), counts)
+                              for name in branches["ntag"] })
+
+
+def concatenate(chunks):
+    columns = { treename : { name : np.concatenate([ chunk[treename][name] for chunk in chunks ])
+                             for name in names } for treename, names in branches.items() }
+    counts  = np.concatenate([ chunk.counts["ntag"] for chunk in chunks ])
+    return columns, counts
+
+
+def test_skim_round_trip_over_several_chunks(tmp_path):
+    infile   = str(tmp_path / "input.root")
+    skimfile = str(tmp_path / "input.skim.npz")
+    make_input(infile)
+    meta = write_skim(skimfile, "numu", "SKG4", infile, branches, default_precut, chunk_size=300)
+    assert meta["nentries"] > 3 * 128
+
+    direct = []
+    for chunk in NCQE_Chunk_Reader([infile], branches, chunk_size=10000) :
+        mask = precut_mask(chunk, default_precut)
+        keep = np.repeat(mask, chunk.counts["ntag"])
+        direct.append(type(chunk)(0, int(mask.sum()),
+                                  { "h1"   : { name : array[mask] for name, array in chunk["h1"].items() },
+                                    "ntag" : { name : array[keep] for name, array in chunk["ntag"].items() } },
+                                  { "ntag" : chunk.counts["ntag"][mask] }))
+    expected, expected_counts = concatenate(direct)
+
+    chunks = list(NCQE_Skim_Reader([skimfile], branches, chunk_size=128))
+    assert len(chunks) > 3
+    assert [ chunk.nentries for chunk in chunks[:-1] ] == [ 128 ] * (len(chunks) - 1)
+    assert sum(chunk.nentries for chunk in chunks) == meta["nentries"]
+    columns, counts = concatenate(chunks)
+    np.testing.assert_array_equal(counts, expected_counts)
+    for treename, names in branches.items() :
+        for name in names :
+            np.testing.assert_array_equal(columns[treename][name], expected[treename][name])
+
+
+@pytest.mark.parametrize("text", [ "erec=4.5:35", "erec=3:29", "dwall=210", "effwall=200.5" ])
+def test_tighter_precut_is_rejected(tmp_path, text):
+    infile = str(tmp_path / "lentp_numu.input.root")
+    make_input(infile, nentries=50)
+    groupedFiles = { "numu" : [ infile ] }
+    with pytest.raises(ValueError, match="tighter") :
+        write_skims(str(tmp_path / "skims"), groupedFiles, { infile : "SKG4" }, lambda schema: branches,
+                    parse_precut(text))
+
+    # a skim written with it anyway is refused by --from-skim
+    skimfile = str(tmp_path / "lentp_numu.input.skim.npz")
+    write_skim(skimfile, "numu", "SKG4", infile, branches, parse_precut(text))
+    with pytest.raises(ValueError, match="tighter") :
+        skim_schemas({ "numu" : [ skimfile ] })
+
+
+def test_selection_edges_are_a_valid_precut(tmp_path):
+    infile   = str(tmp_path / "lentp_numu.input.root")
+    skimfile = str(tmp_path / "lentp_numu.input.skim.npz")
+    make_input(infile, nentries=50)
+    write_skim(skimfile, "numu", "SKG4", infile, branches, parse_precut("erec=4:30,dwall=200,effwall=200"))
+    assert skim_schemas({ "numu" : [ skimfile ] }) == { skimfile : "SKG4" }
+
+
+def read_csv(path):
+    with open(path) as fin :
+        return list(csv.DictReader(fin))
+
+
+def test_from_skim_matches_raw_after_the_precut(run_ncqe, tmp_path):
+    spec = tmp_path / "spec.json"
+    spec.write_text(json.dumps({ "gamma" : [ "herec_ncgamma_*_all", "hdwall_ncgamma_*_nuncqe" ],
+                                 "neutron" : [ "hntag_Tds_all_*_all" ], "neutronNN" : [] }))
+    grid = tmp_path / "grid.json"
+    grid.write_text(json.dumps({ "bopt" : [ 14., 15. ], "dwall" : [ -20., 0. ], "signal" : [ "nuncqe", "ccqe" ] }))
+    common = [ "--output-spec", str(spec), "--scan", str(grid) ]
+    run_ncqe(*common, "--columnar", "-o", str(tmp_path / "raw_hist.root"), "-t", str(tmp_path / "raw_tree.root"),
+             "--scan-report", str(tmp_path / "raw_scan.csv"))
+    run_ncqe("--skim", str(tmp_path / "skims"))
+    run_ncqe(*common, "--from-skim", "-o", str(tmp_path / "skim_hist.root"), "-t", str(tmp_path / "skim_tree.root"),
+             "--scan-report", str(tmp_path / "skim_scan.csv"), files=sorted(glob(str(tmp_path / "skims" / "*.npz"))))
+
+    with uproot.open(tmp_path / "raw_hist.root") as raw, uproot.open(tmp_path / "skim_hist.root") as skim :
+        raw_names  = set(raw.keys(cycle=False))
+        skim_names = set(skim.keys(cycle=False))
+        dropped    = { name for name in raw_names if "_nocut_" in name or "_postact_" in name }
+        assert dropped and not dropped & skim_names
+        assert skim_names == raw_names - dropped
+        for name in skim_names :
+            if name == "ncqe_config" :
+                continue
+            np.testing.assert_allclose(skim[name].values(flow=True), raw[name].values(flow=True), rtol=1e-9,
+                                       err_msg=name)
+
+    raw_rows, skim_rows = read_csv(tmp_path / "raw_scan.csv"), read_csv(tmp_path / "skim_scan.csv")
+    assert "efficiency_wallfv" in skim_rows[0] and "efficiency" not in skim_rows[0]
+    for raw_row, skim_row in zip(raw_rows, skim_rows) :
+        assert float(skim_row["signal"]) == pytest.approx(float(raw_row["signal"]), rel=1e-9)
+        assert float(skim_row["efficiency_wallfv"]) > float(raw_row["efficiency"])